@@ -0,0 +1,4 @@
+"""Benchmarks of the twosfs hot paths.
+
+Run them with `python -m benchmarks run`. See `benchmarks.core` for details.
+"""
@@ -0,0 +1,4 @@
+"""Run the benchmarks from the command line."""
+from benchmarks.core import main
+
+main()
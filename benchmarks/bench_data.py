@@ -0,0 +1,23 @@
+"""Benchmarks of reading data files."""
+import io
+
+import numpy as np
+
+from benchmarks.core import benchmark
+
+
+@benchmark(num_lines=[10 ** 6, 10 ** 7], quick=dict(num_lines=[10 ** 5]))
+def get_allele_counts_at_sites(num_lines):
+    """Read allele counts at every third line of a counts file."""
+    from twosfs.data import get_allele_counts_at_sites
+
+    rng = np.random.default_rng(1)
+    nobs = rng.integers(0, 100, size=num_lines)
+    mac = rng.binomial(nobs, 0.05)
+    text = "".join(f"{a} {b}\n" for a, b in zip(nobs.tolist(), mac.tolist()))
+    sites = np.arange(0, num_lines, 3)
+
+    def read():
+        return get_allele_counts_at_sites(io.StringIO(text), sites, 50)
+
+    return read
@@ -0,0 +1,99 @@
+"""Benchmarks of building and manipulating Spectra."""
+import numpy as np
+
+from benchmarks.core import benchmark
+
+
+def _tree_sequence(num_samples: int, sequence_length: int):
+    import msprime
+
+    return msprime.sim_ancestry(
+        samples=num_samples,
+        ploidy=1,
+        sequence_length=sequence_length,
+        recombination_rate=0.05,
+        random_seed=1,
+    )
+
+
+def _spectra(num_samples: int, num_windows: int):
+    from twosfs.spectra import spectra_from_TreeSequence
+
+    tseq = _tree_sequence(num_samples, num_windows)
+    return spectra_from_TreeSequence(np.arange(num_windows + 1), 0.05, tseq)
+
+
+@benchmark(n=[50, 100, 1000], L=[20, 100], quick=dict(n=[50], L=[20]))
+def spectra_from_TreeSequence(n, L):
+    """Build Spectra from a tree sequence with n samples and L windows."""
+    from twosfs.spectra import spectra_from_TreeSequence
+
+    tseq = _tree_sequence(n, L)
+    windows = np.arange(L + 1)
+    return lambda: spectra_from_TreeSequence(windows, 0.05, tseq)
+
+
+@benchmark(
+    num_sites=[10 ** 3, 10 ** 4],
+    L=[20, 100],
+    quick=dict(num_sites=[10 ** 3], L=[20]),
+)
+def spectra_from_sites(num_sites, L):
+    """Build Spectra from a dictionary of allele counts."""
+    from twosfs.spectra import spectra_from_sites
+
+    n = 100
+    rng = np.random.default_rng(1)
+    positions = np.sort(rng.choice(10 * num_sites, num_sites, replace=False))
+    counts = rng.integers(1, n, size=num_sites)
+    allele_counts = dict(zip(positions.tolist(), counts.tolist()))
+    windows = np.arange(L + 1)
+    return lambda: spectra_from_sites(n, windows, 1e-8, allele_counts)
+
+
+@benchmark(
+    num_sites=[10 ** 5, 10 ** 6],
+    L=[20, 100],
+    quick=dict(num_sites=[10 ** 5], L=[20]),
+)
+def num_pairs_from_positions(num_sites, L):
+    """Count the pairs of sites in each window from unsorted positions."""
+    from twosfs.pairs import num_pairs_from_positions
+
+    rng = np.random.default_rng(1)
+    positions = rng.choice(10 * num_sites, num_sites, replace=False)
+    windows = np.arange(L + 1)
+    return lambda: num_pairs_from_positions(positions, windows)
+
+
+@benchmark(
+    reps=[10 ** 3, 10 ** 4],
+    n=[50, 100],
+    quick=dict(reps=[10 ** 3], n=[50]),
+)
+def add_spectra(reps, n):
+    """Add reps Spectra from a generator."""
+    from twosfs.spectra import add_spectra
+
+    spectra = _spectra(n, 20)
+    return lambda: add_spectra(spectra for _ in range(reps))
+
+
+@benchmark(n=[50, 100, 1000], batch=[1, 100], quick=dict(n=[50], batch=[1]))
+def foldtwosfs(n, batch):
+    """Fold a batch of 2SFS arrays."""
+    from twosfs.spectra import foldtwosfs
+
+    L = 20 if batch == 1 or n < 1000 else 1
+    twosfs = np.random.default_rng(1).uniform(size=(batch, L, n + 1, n + 1))
+    return lambda: foldtwosfs(twosfs)
+
+
+@benchmark(n=[50, 100, 1000], batch=[1, 100], quick=dict(n=[50], batch=[1]))
+def lump_twosfs(n, batch):
+    """Lump a batch of 2SFS arrays at k_max=20."""
+    from twosfs.spectra import lump_twosfs
+
+    L = 20 if batch == 1 or n < 1000 else 1
+    twosfs = np.random.default_rng(1).uniform(size=(batch, L, n + 1, n + 1))
+    return lambda: lump_twosfs(twosfs, 20)
@@ -0,0 +1,50 @@
+"""Benchmarks of KS statistics and resampling."""
+import numpy as np
+
+from benchmarks.bench_spectra import _spectra
+from benchmarks.core import benchmark
+
+
+def _pdf(rng, num_windows: int, k_max: int) -> np.ndarray:
+    pdf = rng.uniform(size=(num_windows, k_max, k_max))
+    return pdf / np.sum(pdf)
+
+
+@benchmark(L=[20, 100], quick=dict(L=[20]))
+def max_ks_distance(L):
+    """Compute the KS distance between two 2SFS pdfs over all CDF orientations."""
+    from twosfs.statistics import max_ks_distance
+
+    rng = np.random.default_rng(1)
+    pdf1, pdf2 = _pdf(rng, L, 20), _pdf(rng, L, 20)
+    return lambda: max_ks_distance(pdf1, pdf2)
+
+
+@benchmark(dtype=["float64", "float32"], quick=dict(dtype=["float64", "float32"]))
+def batch_max_ks_distance(dtype):
+    """Compute KS distances of a chunk of resampled pdfs in each precision."""
+    from twosfs.statistics import batch_max_ks_distance
+
+    rng = np.random.default_rng(1)
+    pdfs = np.stack([_pdf(rng, 20, 20) for _ in range(100)]).astype(dtype)
+    pdf = _pdf(rng, 20, 20).astype(dtype)
+    return lambda: batch_max_ks_distance(pdfs, pdf)
+
+
+@benchmark(
+    reps=[10 ** 4, 10 ** 5, 10 ** 6],
+    n=[50, 100],
+    quick=dict(reps=[10 ** 3], n=[50]),
+)
+def sample_ks_statistics(reps, n):
+    """Resample KS statistics between two Spectra."""
+    from twosfs.statistics import sample_ks_statistics
+
+    spectra_comp = _spectra(n, 20)
+    spectra_null = _spectra(n, 20)
+    num_pairs = np.zeros(20)
+    num_pairs[3::3] = 5000
+    rng = np.random.default_rng(1)
+    return lambda: sample_ks_statistics(
+        spectra_comp, spectra_null, 20, False, reps, num_pairs, rng
+    )
@@ -0,0 +1,321 @@
+"""A small benchmark runner with machine-readable results.
+
+Benchmarks are functions in the `bench_*` modules of this package, registered
+with the `benchmark` decorator. A benchmark takes its parameters as keyword
+arguments, builds its synthetic inputs and returns a function of no arguments,
+which is timed::
+
+    @benchmark(n=[50, 100, 1000], quick=dict(n=[50]))
+    def foldtwosfs(n):
+        twosfs = np.random.default_rng(0).uniform(size=(20, n + 1, n + 1))
+        return lambda: spectra.foldtwosfs(twosfs)
+
+Usage::
+
+    python -m benchmarks run [--quick] [--filter PATTERN] [-o results.json]
+    python -m benchmarks compare base.json head.json [--threshold 0.1]
+    python -m benchmarks compare-commits BASE HEAD [--quick] [--threshold 0.1]
+
+`run` writes the timings of every benchmark and parameter combination to a JSON
+file, together with the commit and machine. `compare` flags benchmarks that got
+slower by more than threshold (as a fraction of the base time) and exits with
+status 1 if there are any. `compare-commits` checks out both commits in
+temporary git worktrees, runs the current benchmarks against each version of
+the package and compares them.
+"""
+import argparse
+import importlib
+import itertools
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Iterator, Optional
+
+# Modules that define benchmarks.
+MODULES = ["bench_data", "bench_spectra", "bench_statistics"]
+
+# Minimum total time of the calls in one timing sample, in seconds.
+MIN_SAMPLE_TIME = 0.1
+
+REGISTRY: dict[str, "Benchmark"] = {}
+
+
+class Benchmark(object):
+    """
+    A registered benchmark.
+
+    Parameters
+    ----------
+    name : str
+        The qualified name of the benchmark function.
+    setup : Callable
+        Takes the parameters as keyword arguments and returns the function to time.
+    params : dict[str, list]
+        The values of each parameter. Every combination is timed.
+    quick : dict[str, list]
+        The parameter values used with --quick. Defaults to the first values.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        setup: Callable[..., Callable[[], Any]],
+        params: dict[str, list],
+        quick: Optional[dict[str, list]] = None,
+    ):
+        self.name = name
+        self.setup = setup
+        self.params = params
+        self.quick = quick or {key: values[:1] for key, values in params.items()}
+
+    def cases(self, quick: bool = False) -> Iterator[tuple[str, dict[str, Any]]]:
+        """Iterate over (case name, parameters) of every parameter combination."""
+        params = self.quick if quick else self.params
+        keys = list(params)
+        for values in itertools.product(*(params[k] for k in keys)):
+            kwargs = dict(zip(keys, values))
+            label = ",".join(f"{k}={v}" for k, v in kwargs.items())
+            yield f"{self.name}[{label}]" if label else self.name, kwargs
+
+
+def benchmark(quick: Optional[dict[str, list]] = None, **params: list) -> Callable:
+    """Register a benchmark with the given parameter values."""
+
+    def decorator(setup):
+        name = f"{setup.__module__.split('.')[-1]}.{setup.__name__}"
+        REGISTRY[name] = Benchmark(name, setup, params, quick)
+        return setup
+
+    return decorator
+
+
+def time_function(function: Callable[[], Any], max_repeats: int = 5) -> dict:
+    """Time function and return statistics of the time per call in seconds.
+
+    The number of calls per sample is chosen so that a sample takes at least
+    MIN_SAMPLE_TIME. Fewer samples are taken of functions that take over a second.
+    """
+    start = time.perf_counter()
+    function()
+    first = time.perf_counter() - start
+    number = max(1, int(MIN_SAMPLE_TIME / max(first, 1e-9)))
+    repeats = max_repeats if first < 1.0 else max(1, min(3, max_repeats))
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "number": number,
+        "repeats": repeats,
+    }
+
+
+def _git_commit(path: str) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _load_modules() -> None:
+    for module in MODULES:
+        importlib.import_module(f"benchmarks.{module}")
+
+
+def run_benchmarks(
+    quick: bool = False, pattern: Optional[str] = None, verbose: bool = True
+) -> dict[str, dict]:
+    """Run the registered benchmarks whose case names match pattern.
+
+    Benchmarks that raise are recorded with their error instead of timings.
+    """
+    _load_modules()
+    results = {}
+    for bench in REGISTRY.values():
+        for case, kwargs in bench.cases(quick):
+            if pattern and not re.search(pattern, case):
+                continue
+            try:
+                results[case] = time_function(bench.setup(**kwargs))
+            except Exception as e:
+                results[case] = {"error": f"{type(e).__name__}: {e}"}
+            if verbose:
+                print(_format_result(case, results[case]), file=sys.stderr)
+    return results
+
+
+def _format_result(case: str, result: dict) -> str:
+    if "error" in result:
+        return f"{case:60s} {result['error']}"
+    return f"{case:60s} {result['min'] * 1e3:12.3f} ms"
+
+
+def _metadata(source: str) -> dict:
+    import numpy as np
+
+    return {
+        "commit": _git_commit(source),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def compare_results(
+    base: dict[str, dict], head: dict[str, dict], threshold: float = 0.1
+) -> list[dict]:
+    """Compare the minimum times of the cases in both base and head.
+
+    Returns one row per common case with the ratio head / base and a status of
+    "regression" if the ratio exceeds 1 + threshold, "improvement" if it is below
+    1 / (1 + threshold), and "unchanged" otherwise.
+    """
+    rows = []
+    for case in base:
+        if case not in head or "error" in base[case] or "error" in head[case]:
+            continue
+        ratio = head[case]["min"] / base[case]["min"]
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "unchanged"
+        rows.append(
+            {
+                "case": case,
+                "base": base[case]["min"],
+                "head": head[case]["min"],
+                "ratio": ratio,
+                "status": status,
+            }
+        )
+    return rows
+
+
+def _print_comparison(rows: list[dict]) -> int:
+    for row in rows:
+        print(
+            f"{row['case']:60s} {row['base'] * 1e3:12.3f} {row['head'] * 1e3:12.3f} "
+            f"{row['ratio']:7.2f}  {row['status']}"
+        )
+    regressions = [row for row in rows if row["status"] == "regression"]
+    print(f"{len(regressions)} regressions in {len(rows)} benchmarks.")
+    return 1 if regressions else 0
+
+
+def _read_results(path: str) -> dict[str, dict]:
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def _run_at_commit(commit: str, output: str, args: argparse.Namespace) -> None:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        worktree = os.path.join(tmp, "worktree")
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", worktree, commit],
+            cwd=root,
+            check=True,
+        )
+        try:
+            command = [sys.executable, "-m", "benchmarks", "run", "-o", output]
+            command += ["--source", worktree]
+            if args.quick:
+                command.append("--quick")
+            if args.filter:
+                command += ["--filter", args.filter]
+            subprocess.run(command, cwd=root, check=True)
+        finally:
+            subprocess.run(
+                ["git", "worktree", "remove", "--force", worktree],
+                cwd=root,
+                check=True,
+            )
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the benchmark command."""
+    parser = argparse.ArgumentParser(prog="benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Run benchmarks.")
+    run.add_argument("-o", "--output", help="Write results to this JSON file.")
+    run.add_argument(
+        "--source", help="Import twosfs from this directory (default: installed)."
+    )
+
+    compare = subparsers.add_parser("compare", help="Compare two result files.")
+    compare.add_argument("base")
+    compare.add_argument("head")
+
+    commits = subparsers.add_parser(
+        "compare-commits", help="Run benchmarks at two commits and compare them."
+    )
+    commits.add_argument("base")
+    commits.add_argument("head")
+    commits.add_argument("--output-dir", default=".", help="Where to keep results.")
+
+    for subparser in [run, commits]:
+        subparser.add_argument(
+            "--quick", action="store_true", help="Only run the smallest inputs."
+        )
+        subparser.add_argument("--filter", help="Only run cases matching this regex.")
+    for subparser in [compare, commits]:
+        subparser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.1,
+            help="Flag slowdowns above this fraction (default: 0.1).",
+        )
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        source = os.getcwd()
+        if args.source:
+            source = os.path.abspath(args.source)
+            sys.path.insert(0, source)
+        results = run_benchmarks(args.quick, args.filter)
+        data = _metadata(source) | {"quick": args.quick, "results": results}
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(data, f, indent=2)
+        else:
+            print(json.dumps(data, indent=2))
+    elif args.command == "compare":
+        rows = compare_results(
+            _read_results(args.base), _read_results(args.head), args.threshold
+        )
+        sys.exit(_print_comparison(rows))
+    elif args.command == "compare-commits":
+        outputs = []
+        for commit in [args.base, args.head]:
+            name = re.sub(r"[^\w.-]", "_", commit) + ".json"
+            outputs.append(os.path.abspath(os.path.join(args.output_dir, name)))
+            _run_at_commit(commit, outputs[-1], args)
+        rows = compare_results(
+            _read_results(outputs[0]), _read_results(outputs[1]), args.threshold
+        )
+        sys.exit(_print_comparison(rows))
@@ -0,0 +1,181 @@
+"""Benchmark every stage of the workflow on a miniature configuration.
+
+Usage::
+
+    python -m benchmarks.workflow [--config CONFIG] [--workers N] [-o stages.json]
+
+Each stage runs as a `twosfs` command in a subprocess, in a temporary
+simulation directory. The stages are simulate, merge, fit, search-r,
+simulate-grid, search-grid and power-scan. For each stage the harness
+records:
+
+- wall time,
+- CPU time (user + system) of the stage and its worker processes,
+- peak resident set size of the largest of these processes,
+- block input and output of these processes, in bytes,
+- the total size of the files the stage wrote.
+
+Stages that fail are recorded with their exit status, and the later stages
+still run. The default configuration, `workflow_parameters.json`, has the same
+structure as `simulation_parameters.json` with far fewer models, runs and
+replicates, so that the whole workflow takes minutes on a laptop.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from benchmarks.core import _metadata
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), "workflow_parameters.json")
+
+# Size of the blocks counted by getrusage.
+BLOCK_SIZE = 512
+
+
+def _stage_arguments(config_file: str) -> list[tuple[str, list[str]]]:
+    from twosfs.config import configuration_from_json
+
+    config = configuration_from_json(config_file)
+    models = list(config.iter_models())
+    null_file = config.format_initial_spectra_file(*models[0])
+    comp_file = config.format_initial_spectra_file(*models[-1])
+    length = str(config.power_sequence_lengths[0])
+    density = str(config.power_pair_densities[0])
+    power_file = os.path.join(config.simulation_directory, "power_scan.jsonl")
+    return [
+        ("simulate", ["simulate", "--config", config_file]),
+        ("merge", ["merge", "--config", config_file]),
+        ("fit", ["fit", "--config", config_file]),
+        ("search-r", ["search-r", "--config", config_file]),
+        ("simulate-grid", ["simulate-grid", "--config", config_file]),
+        ("search-grid", ["search-grid", "--config", config_file]),
+        (
+            "power-scan",
+            [
+                "power-scan",
+                comp_file,
+                null_file,
+                "--pair-densities",
+                density,
+                "--max-distances",
+                length,
+                "--k-max",
+                str(config.k_max),
+                "--n-reps",
+                "100",
+                "-o",
+                power_file,
+            ],
+        ),
+    ]
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def run_stage(command: list[str], directory: str) -> dict:
+    """Run a command and measure its resource use and the bytes it writes."""
+    size_before = _directory_size(directory)
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # wait4 returns the resource use of the process and the children it waited for.
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    stderr = process.stderr.read().decode()
+    process.stdout.close()
+    process.stderr.close()
+    return {
+        "returncode": os.waitstatus_to_exitcode(status),
+        "wall_time": wall_time,
+        "cpu_time": usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in kilobytes on Linux.
+        "max_rss_bytes": usage.ru_maxrss * 1024,
+        "block_input_bytes": usage.ru_inblock * BLOCK_SIZE,
+        "block_output_bytes": usage.ru_oublock * BLOCK_SIZE,
+        "output_bytes": _directory_size(directory) - size_before,
+        "stderr": stderr[-2000:],
+    }
+
+
+def run_workflow(
+    config_file: str = DEFAULT_CONFIG,
+    workers: int = 1,
+    directory: Optional[str] = None,
+    stages: Optional[list[str]] = None,
+) -> list[dict]:
+    """Run the workflow stages on a copy of config_file in directory.
+
+    If directory is None, a temporary directory is used and removed afterwards.
+    """
+    tmp = None
+    if directory is None:
+        tmp = directory = tempfile.mkdtemp(prefix="twosfs-workflow-")
+    try:
+        with open(config_file) as f:
+            data = json.load(f)
+        data["simulation_directory"] = os.path.join(directory, "simulations")
+        os.makedirs(data["simulation_directory"], exist_ok=True)
+        local_config = os.path.join(directory, "config.json")
+        with open(local_config, "w") as f:
+            json.dump(data, f)
+
+        results = []
+        for name, arguments in _stage_arguments(local_config):
+            if stages and name not in stages:
+                continue
+            command = [sys.executable, "-m", "twosfs.cli", "--workers", str(workers)]
+            result = {"stage": name} | run_stage(command + arguments, directory)
+            results.append(result)
+            print(_format_stage(result), file=sys.stderr)
+        return results
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+
+def _format_stage(result: dict) -> str:
+    status = "ok" if result["returncode"] == 0 else f"exit {result['returncode']}"
+    return (
+        f"{result['stage']:15s} {result['wall_time']:9.2f} s wall "
+        f"{result['cpu_time']:9.2f} s cpu "
+        f"{result['max_rss_bytes'] / 2 ** 20:9.1f} MiB rss "
+        f"{result['output_bytes'] / 2 ** 20:9.2f} MiB out  {status}"
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the workflow benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stages", nargs="+", help="Only run these stages.")
+    parser.add_argument("--directory", help="Keep the simulations in this directory.")
+    parser.add_argument("-o", "--output", help="Write results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results = run_workflow(args.config, args.workers, args.directory, args.stages)
+    data = _metadata(os.getcwd()) | {
+        "config": args.config,
+        "workers": args.workers,
+        "stages": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=2)
+    else:
+        print(json.dumps(data, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Tests for the batch module."""
+
+import dataclasses
+import os
+
+import hypothesis.strategies as st
+import numpy as np
+import pytest
+from hypothesis import given
+
+from twosfs.batch import (
+    SpectraStore,
+    load_store,
+    merge_stores,
+    parse_shard,
+    shard_units,
+)
+from twosfs.config import configuration_from_json
+from twosfs.spectra import zero_spectra
+
+
+@given(st.integers(min_value=0, max_value=50), st.integers(min_value=1, max_value=8))
+def test_shard_units_partition(num_units, num_shards):
+    units = [("const", {}, rep) for rep in range(num_units)]
+    shards = [shard_units(units, i, num_shards) for i in range(num_shards)]
+    assert sorted(u for shard in shards for u in shard) == units
+    assert max(map(len, shards)) - min(map(len, shards)) <= 1
+
+
+def test_parse_shard():
+    assert parse_shard("2/5") == (2, 5)
+    for shard in ["5/5", "-1/2", "1", "a/b"]:
+        with pytest.raises(ValueError):
+            parse_shard(shard)
+
+
+def test_store_roundtrip(tmp_path):
+    spectra = zero_spectra(4, np.arange(3), 1.0)
+    spectra.onesfs[1] = 1.0
+    spectra.num_sites = 1.0
+    stores = [SpectraStore(), SpectraStore()]
+    stores[0].add("const", {}, [0, 2], spectra)
+    stores[0].add("beta", {"alpha": 1.5}, [0], spectra)
+    stores[1].add("const", {}, [1], spectra)
+    paths = [str(tmp_path / f"shard={i}.hdf5") for i in range(2)]
+    for store, path in zip(stores, paths):
+        store.save(path)
+    loaded = load_store(paths[0])
+    assert loaded.models == stores[0].models
+    assert loaded.reps == stores[0].reps
+
+    merged = merge_stores(paths)
+    assert len(merged) == 2
+    assert merged.reps["model=const.params={}"] == {0, 1, 2}
+    assert merged.totals["model=const.params={}"] == spectra + spectra
+    with pytest.raises(ValueError):
+        merged.update_from(stores[1])
+
+
+def test_write_initial_spectra_checks_models(tmp_path):
+    config = configuration_from_json("simulation_parameters.json")
+    config = dataclasses.replace(config, simulation_directory=str(tmp_path), nruns=2)
+    store = SpectraStore()
+    store.add("const", {}, [0, 1], zero_spectra(4, np.arange(3), 1.0))
+    with pytest.raises(ValueError, match=r'model=beta\.params=\{"alpha":1\.05\}'):
+        store.write_initial_spectra(config)
+    assert not os.path.exists(config.format_initial_spectra_file("const", {}))
+    assert store.write_initial_spectra(config, ["const"]) == [
+        config.format_initial_spectra_file("const", {})
+    ]
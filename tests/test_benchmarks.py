@@ -0,0 +1,25 @@
+"""Tests for the benchmark runner."""
+
+from benchmarks.core import Benchmark, compare_results
+
+
+def test_compare_results():
+    base = {"a": {"min": 1.0}, "b": {"min": 1.0}, "c": {"min": 1.0}, "d": {"min": 1}}
+    head = {
+        "a": {"min": 1.2},
+        "b": {"min": 0.8},
+        "c": {"min": 1.05},
+        "d": {"error": ""},
+    }
+    rows = compare_results(base, head, threshold=0.1)
+    assert {row["case"]: row["status"] for row in rows} == {
+        "a": "regression",
+        "b": "improvement",
+        "c": "unchanged",
+    }
+
+
+def test_benchmark_cases():
+    bench = Benchmark("f", lambda n, L: None, dict(n=[1, 2], L=[3]))
+    assert [case for case, _ in bench.cases()] == ["f[n=1,L=3]", "f[n=2,L=3]"]
+    assert list(bench.cases(quick=True)) == [("f[n=1,L=3]", {"n": 1, "L": 3})]
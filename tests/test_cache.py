@@ -0,0 +1,119 @@
+"""Tests for the cache module."""
+
+import json
+
+import hypothesis.strategies as st
+import numpy as np
+from hypothesis import given
+
+from twosfs.cache import (
+    CACHE_DIR_VARIABLE,
+    RESULT_CACHE_DIR_VARIABLE,
+    JSONCache,
+    ResultCache,
+    canonical_hash,
+    result_cache,
+    result_key,
+)
+
+parameter_dicts = st.dictionaries(
+    st.text(min_size=1, max_size=5), st.floats(allow_nan=False), max_size=5
+)
+
+
+@given(parameter_dicts)
+def test_canonical_hash_ignores_key_order(params):
+    reversed_params = dict(reversed(list(params.items())))
+    assert canonical_hash("model", params) == canonical_hash("model", reversed_params)
+
+
+def test_canonical_hash_numpy():
+    assert canonical_hash([1.0, 2.0]) == canonical_hash(np.array([1.0, 2.0]))
+    assert canonical_hash(2) == canonical_hash(np.int64(2))
+
+
+def test_json_cache_persists(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = JSONCache(path)
+    assert "a" not in cache
+    cache["a"] = 1.5
+    other = JSONCache(path)
+    assert other["a"] == 1.5
+    other["b"] = [1, 2]
+    # Entries written by another instance are visible after a miss.
+    assert cache.get("b") == [1, 2]
+    assert cache.get("c", 0) == 0
+
+
+def test_result_key_normalizes_parameters():
+    assert result_key("f", {"alpha": 1}, (1, 2)) == result_key(
+        "f", {"alpha": 1.0}, np.array([1.0, 2.0])
+    )
+    assert result_key("f", {"alpha": 1}) != result_key("g", {"alpha": 1})
+
+
+def test_result_cache_computes_once(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"a": 1}
+
+    def save(result, path):
+        with open(path, "w") as f:
+            json.dump(result, f)
+
+    def load(path):
+        with open(path) as f:
+            return json.load(f)
+
+    key = result_key("compute")
+    for _ in range(2):
+        assert cache.get_or_compute(key, compute, load, save, ".json") == {"a": 1}
+    assert len(calls) == 1
+
+
+def test_result_cache_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.delenv(RESULT_CACHE_DIR_VARIABLE, raising=False)
+    monkeypatch.setenv(CACHE_DIR_VARIABLE, str(tmp_path))
+    assert result_cache() is None
+    monkeypatch.setenv(RESULT_CACHE_DIR_VARIABLE, str(tmp_path / "results"))
+    assert result_cache().directory == str(tmp_path / "results")
+
+
+def test_expected_t2_is_memoized(tmp_path, monkeypatch):
+    from twosfs import cache, demography
+    from twosfs.simulations import T2_CACHE_FILE, clear_t2_cache, expected_t2
+
+    calls = []
+    compute = demography.expected_t2_demography
+
+    def counted(demo):
+        calls.append(1)
+        return compute(demo)
+
+    monkeypatch.setattr(demography, "expected_t2_demography", counted)
+    monkeypatch.setenv(CACHE_DIR_VARIABLE, str(tmp_path))
+    clear_t2_cache()
+    try:
+        params = {"end_time": 0.5, "growth_rate": 1.0}
+        t2 = expected_t2("exp", params)
+        assert expected_t2("exp", {"growth_rate": 1.0, "end_time": 0.5}) == t2
+        assert len(calls) == 1
+        assert (tmp_path / T2_CACHE_FILE).exists()
+        # A new process reads the value back from the cache directory.
+        clear_t2_cache()
+        assert expected_t2("exp", params) == t2
+        assert len(calls) == 1
+        assert expected_t2("exp", {"end_time": 0.5, "growth_rate": 1}) == t2
+        assert len(calls) == 1
+        expected_t2("exp", {"end_time": 0.5, "growth_rate": 2.0})
+        assert len(calls) == 2
+        # Values computed by another version of the code are not reused.
+        monkeypatch.setattr(cache, "CODE_VERSION", cache.CODE_VERSION + 1)
+        clear_t2_cache()
+        assert expected_t2("exp", params) == t2
+        assert len(calls) == 3
+    finally:
+        clear_t2_cache()
@@ -0,0 +1,61 @@
+"""Tests for the command line interface."""
+
+import json
+import os
+
+import pytest
+
+from twosfs.cli import make_parser, make_requests
+
+
+def test_make_requests(tmp_path):
+    with open("simulation_parameters.json") as f:
+        data = json.load(f)
+    data["simulation_directory"] = str(tmp_path)
+    config_file = str(tmp_path / "config.json")
+    with open(config_file, "w") as f:
+        json.dump(data, f)
+    num_models = (
+        1 + len(data["alphas"]) + len(data["growth_rates"]) * len(data["end_times"])
+    )
+    parser = make_parser()
+
+    args = parser.parse_args(["simulate", "--config", config_file])
+    requests = make_requests(args)
+    assert len(requests) == num_models * data["nruns"]
+    assert all(r["job"] == "simulate" for r in requests)
+
+    args = parser.parse_args(["fit", "--config", config_file, "--model", "beta"])
+    assert len(make_requests(args)) == 2 * len(data["alphas"])
+
+    args = parser.parse_args(["merge", "--config", config_file, "--model", "const"])
+    (request,) = make_requests(args)
+    assert len(request["kwargs"]["inputs"]) == data["nruns"]
+
+    args = parser.parse_args(["search-r", "--config", config_file, "--workers", "3"])
+    requests = make_requests(args)
+    assert requests and all(r["kwargs"]["workers"] == 3 for r in requests)
+    args = parser.parse_args(
+        ["--workers", "2", "search-r", "--config", config_file, "--workers", "3"]
+    )
+    with pytest.raises(ValueError):
+        make_requests(args)
+
+
+def test_profile_paths(tmp_path, monkeypatch):
+    import multiprocessing
+
+    from twosfs import cli
+
+    profile = str(tmp_path / "profile")
+    request = {"job": "ping"}
+    cli._init_profiler(profile)
+    try:
+        assert cli._run_request(request)["ok"]
+        assert os.path.exists(profile)
+        # Pool workers append their pid, however they were started.
+        monkeypatch.setattr(multiprocessing, "parent_process", lambda: object())
+        assert cli._run_request(request)["ok"]
+        assert os.path.exists(f"{profile}.{os.getpid()}")
+    finally:
+        monkeypatch.setattr(cli, "_profiler", None)
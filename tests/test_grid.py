@@ -0,0 +1,43 @@
+"""Tests for the grid module."""
+
+import numpy as np
+
+from twosfs.grid import (
+    SpectraGrid,
+    grid_ks_distances,
+    interpolate_pdfs,
+    load_spectra_grid,
+)
+from twosfs.spectra import zero_spectra
+from twosfs.statistics import spectra_ks_distance
+
+
+def random_spectra(rng, recombination_rate):
+    spectra = zero_spectra(6, np.arange(5), recombination_rate)
+    spectra.num_sites = 1.0
+    spectra.onesfs[1:-1] = rng.uniform(size=5)
+    spectra.num_pairs[:] = 1.0
+    spectra.twosfs[:, 1:-1, 1:-1] = rng.uniform(size=(4, 5, 5))
+    return spectra
+
+
+def test_interpolate_pdfs():
+    rng = np.random.default_rng(1)
+    rates = np.array([0.1, 0.2, 0.4])
+    pdfs = rng.uniform(size=(3, 2, 3, 3))
+    pdfs /= np.sum(pdfs, axis=(1, 2, 3), keepdims=True)
+    assert np.allclose(interpolate_pdfs(rates, pdfs, rates), pdfs)
+    new_pdfs = interpolate_pdfs(rates, pdfs, [0.15, 0.3])
+    assert np.allclose(np.sum(new_pdfs, axis=(1, 2, 3)), 1.0)
+    assert np.all(new_pdfs >= 0)
+
+
+def test_grid_ks_distances(tmp_path):
+    rng = np.random.default_rng(2)
+    rates = [0.05, 0.1, 0.2]
+    grid = SpectraGrid(rates, [random_spectra(rng, r) for r in rates])
+    grid.save(str(tmp_path / "grid.hdf5"))
+    grid = load_spectra_grid(str(tmp_path / "grid.hdf5"))
+    target = random_spectra(rng, 0.1)
+    expected = [spectra_ks_distance(target, s, 3, False) for s in grid.spectra]
+    assert np.allclose(grid_ks_distances(target, grid, 3, False, rates), expected)
@@ -0,0 +1,61 @@
+"""Tests that importing twosfs is fast."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules that are slow to import and must only be loaded when needed.
+HEAVY_MODULES = ["msprime", "tskit", "h5py", "fitsfs", "scipy"]
+
+# Set to check the import times too. Timings are flaky on loaded machines.
+TIMING_VARIABLE = "TWOSFS_TEST_IMPORT_TIME"
+
+# Budgets in seconds for importing the package, not counting the interpreter start,
+# and for importing it once numpy is loaded: several times the times measured when
+# they were set (0.15 s and 0.08 s).
+IMPORT_BUDGET = 1.0
+PACKAGE_BUDGET = 0.5
+
+IMPORT_SCRIPT = f"""
+import sys
+import time
+
+start = time.perf_counter()
+import numpy
+numpy_loaded = time.perf_counter()
+import twosfs
+import twosfs.config
+import twosfs.simulations
+import twosfs.spectra
+import twosfs.statistics
+end = time.perf_counter()
+print(end - start)
+print(end - numpy_loaded)
+print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+
+def _import_twosfs() -> tuple[float, float, str]:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.splitlines()
+    return float(output[0]), float(output[1]), output[2]
+
+
+def test_import_is_lazy():
+    _, _, loaded = _import_twosfs()
+    assert loaded == ""
+
+
+@pytest.mark.skipif(
+    not os.environ.get(TIMING_VARIABLE), reason=f"{TIMING_VARIABLE} is not set"
+)
+def test_import_time():
+    elapsed, package_elapsed, _ = _import_twosfs()
+    assert elapsed < IMPORT_BUDGET
+    assert package_elapsed < PACKAGE_BUDGET
@@ -0,0 +1,55 @@
+"""Tests for the instrument module."""
+
+import json
+import time
+
+from twosfs.instrument import instrumentation, instrumented, instrumented_iter
+
+
+@instrumented
+def inner():
+    time.sleep(0.01)
+    return 1
+
+
+@instrumented(name="outer")
+def outer():
+    return sum(instrumented_iter("steps", (inner() for _ in range(3))))
+
+
+def test_instrumentation(tmp_path):
+    assert outer() == 3
+    output = str(tmp_path / "timings.json")
+    with instrumentation(output, memory=True) as recorder:
+        assert outer() == 3
+    assert outer() == 3
+    stats = recorder.to_dict()["functions"]
+    assert stats["test_instrument.inner"]["calls"] == 3
+    assert stats["steps"]["calls"] == 4
+    assert stats["outer"]["calls"] == 1
+    assert "bytes_allocated" in stats["outer"]
+    assert stats["outer"]["self_time"] < stats["outer"]["total_time"] / 2
+    assert stats["steps"]["total_time"] >= stats["test_instrument.inner"]["total_time"]
+    with open(output) as f:
+        assert json.load(f)["functions"] == stats
+
+
+@instrumented
+def temporary():
+    return len(bytearray(10 ** 6))
+
+
+@instrumented(name="nested")
+def nested():
+    before = bytearray(10 ** 6)
+    return len(before) + temporary()
+
+
+def test_memory_counts_temporaries():
+    with instrumentation(memory=True) as recorder:
+        nested()
+    stats = recorder.to_dict()["functions"]
+    assert stats["test_instrument.temporary"]["bytes_allocated"] >= 10 ** 6
+    # The nested temporary is freed while the first allocation is still held.
+    assert stats["nested"]["bytes_allocated"] >= 2 * 10 ** 6
+    assert stats["nested"]["peak_bytes"] == stats["nested"]["bytes_allocated"]
@@ -0,0 +1,75 @@
+"""Tests for the manifest module."""
+
+import dataclasses
+import os
+import sqlite3
+
+import pytest
+
+from twosfs.config import configuration_from_json
+from twosfs.manifest import Manifest, load_manifest, open_manifest, target_paths
+
+
+def test_manifest(tmp_path):
+    config = configuration_from_json("simulation_parameters.json")
+    config = dataclasses.replace(
+        config, simulation_directory=str(tmp_path), alphas=[1.5], power_reps=2
+    )
+    with Manifest(str(tmp_path / "manifest.sqlite")) as manifest:
+        assert manifest.build(config)
+        assert not manifest.build(config)
+        assert manifest.paths("initial_spectra") == list(config.initial_spectra_files())
+        assert manifest.paths("fitted_demography") == list(
+            config.fitted_demography_files()
+        )
+        assert manifest.paths("recombination_search") == list(
+            config.recombination_search_files()
+        )
+        assert manifest.paths("recombination_grid_search") == list(
+            config.recombination_grid_search_files()
+        )
+
+        path = config.format_fitted_demography_file("beta", {"alpha": 1.5}, True)
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write("{}")
+        assert manifest.refresh(hash_contents=True) == 1
+        assert manifest.refresh() == 0
+        missing = manifest.missing("fitted_demography", model="beta")
+        assert missing == [
+            config.format_fitted_demography_file("beta", {"alpha": 1.5}, False)
+        ]
+        assert list(manifest.hashes()) == [path]
+
+        # Targets that the new config keeps keep their status.
+        assert manifest.build(dataclasses.replace(config, alphas=[1.5, 1.6]))
+        assert manifest.paths(exists=True) == [path]
+        assert len(manifest.missing("fitted_demography", model="beta")) == 3
+
+
+def test_open_manifest_read_only(tmp_path):
+    config = configuration_from_json("simulation_parameters.json")
+    config = dataclasses.replace(config, simulation_directory=str(tmp_path))
+    with pytest.raises(FileNotFoundError):
+        open_manifest(config)
+    load_manifest(config).close()
+    with open_manifest(config) as manifest:
+        assert manifest.paths("initial_spectra") == list(config.initial_spectra_files())
+        changed = dataclasses.replace(config, power_reps=config.power_reps + 1)
+        with pytest.raises(sqlite3.OperationalError):
+            manifest.build(changed)
+    with pytest.raises(ValueError):
+        open_manifest(changed)
+
+
+def test_target_paths_without_manifest(tmp_path):
+    config = configuration_from_json("simulation_parameters.json")
+    config = dataclasses.replace(config, simulation_directory=str(tmp_path))
+    expected = list(config.recombination_search_files())
+    assert target_paths(config, "recombination_search") == expected
+    load_manifest(config).close()
+    assert target_paths(config, "recombination_search") == expected
+    changed = dataclasses.replace(config, power_reps=config.power_reps + 1)
+    assert target_paths(changed, "recombination_search") == list(
+        changed.recombination_search_files()
+    )
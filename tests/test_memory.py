@@ -0,0 +1,42 @@
+"""Tests for the memory module."""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from twosfs.memory import memory_budget, operation_nbytes, parse_size
+from twosfs.spectra import load_spectra, zero_spectra
+
+
+def test_parse_size():
+    assert parse_size("800M") == 800 * 2 ** 20
+    assert parse_size("1.5gb") == 3 * 2 ** 29
+    assert parse_size("1000") == 1000
+
+
+@pytest.mark.parametrize("folded", [False, True])
+def test_normalized_twosfs_within_budget(folded):
+    num_samples, num_windows = 40, 30
+    spectra = zero_spectra(num_samples, np.arange(num_windows + 1), 1.0)
+    spectra.num_pairs[:] = 1.0
+    spectra.twosfs[1:] = np.random.default_rng(1).uniform(size=spectra.twosfs[1:].shape)
+    expected = spectra.normalized_twosfs(folded, k_max=10)
+    budget = operation_nbytes("normalize", num_samples, num_windows, 10) // 4
+    with memory_budget(budget):
+        tracemalloc.start()
+        normed = spectra.normalized_twosfs(folded, k_max=10)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    assert peak <= budget
+    np.testing.assert_allclose(normed, expected)
+
+
+def test_load_over_budget(tmp_path):
+    spectra = zero_spectra(10, np.arange(11), 1.0)
+    path = str(tmp_path / "spectra.hdf5")
+    spectra.save(path)
+    with memory_budget(1000):
+        with pytest.raises(MemoryError):
+            load_spectra(path)
+    assert load_spectra(path) == spectra
@@ -0,0 +1,81 @@
+"""Tests for the pairs module."""
+
+import numpy as np
+import pytest
+
+from twosfs.jobs import pair_counts_from_sites_files
+from twosfs.pairs import (
+    num_pairs_from_positions,
+    pair_mask,
+    pair_weights,
+    positions_distance_counts,
+)
+from twosfs.spectra import spectra_from_sites
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 10, 19, 40])
+def test_codon_weights(max_distance):
+    expected = np.zeros(20)
+    for i in range(3, min(max_distance, 19) + 1, 3):
+        expected[i] = 1
+    weights = pair_weights(np.arange(21), max_distance)
+    assert np.array_equal(weights, expected)
+    assert pair_weights(np.arange(21), max_distance) is weights
+    assert not weights.flags.writeable
+    # Wider windows count the multiples of the stride they contain.
+    wide = pair_weights([0, 4, 10, 20], max_distance)
+    assert np.array_equal(wide, np.add.reduceat(expected, [0, 4, 10]))
+
+
+def test_empirical_and_learned_weights(tmp_path):
+    rng = np.random.default_rng(4)
+    positions = np.sort(rng.choice(500, size=100, replace=False))
+    counts = positions_distance_counts(positions, 10)
+    assert counts[0] == 100
+    assert counts[4] == sum(p + 4 in set(positions) for p in positions)
+
+    sites_file = str(tmp_path / "sites.txt")
+    np.savetxt(sites_file, positions, fmt="%d")
+    windows = np.arange(21)
+    empirical = pair_weights(windows, 10, "empirical", sites_file)
+    assert np.isclose(np.sum(empirical), 10)
+    assert np.allclose(empirical[1:11], counts[1:] * 10 / np.sum(counts[1:]))
+    assert np.array_equal(
+        pair_mask(windows, 10, "empirical", sites_file), empirical > 0
+    )
+
+    spectra = spectra_from_sites(4, windows, 1.0, dict.fromkeys(positions.tolist(), 1))
+    learned = pair_weights(windows, 10, "learned", spectra)
+    assert np.allclose(learned, empirical)
+    assert np.allclose(pair_weights(windows, 10, "learned", spectra.num_pairs), learned)
+    with pytest.raises(ValueError):
+        pair_weights(windows, 10, "empirical")
+
+
+def test_num_pairs_from_positions(tmp_path):
+    rng = np.random.default_rng(5)
+    positions = rng.choice(300, size=120)
+    windows = np.array([0, 1, 2, 5, 10, 30, 100])
+    spectra = spectra_from_sites(4, windows, 1.0, dict.fromkeys(positions.tolist(), 1))
+    num_pairs = num_pairs_from_positions(positions, windows)
+    assert np.array_equal(num_pairs, spectra.num_pairs)
+    # Pairs on different chromosomes do not count.
+    chromosomes = np.repeat(["2L", "2R"], len(positions))
+    assert np.array_equal(
+        num_pairs_from_positions(np.tile(positions, 2), windows, chromosomes),
+        2 * num_pairs,
+    )
+
+    sites_files = []
+    for chromosome in range(2):
+        sites_files.append(str(tmp_path / f"sites{chromosome}.txt"))
+        np.savetxt(sites_files[-1], positions, fmt="%d")
+    output = str(tmp_path / "num_pairs.npy")
+    pair_counts_from_sites_files(sites_files, 21, output)
+    assert np.array_equal(
+        np.load(output), 2 * num_pairs_from_positions(positions, np.arange(21))
+    )
+    assert np.allclose(
+        pair_weights(np.arange(21), 10, "learned", output),
+        pair_weights(np.arange(21), 10, "empirical", positions),
+    )
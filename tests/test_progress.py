@@ -0,0 +1,67 @@
+"""Tests for the progress module."""
+
+import io
+import json
+
+import numpy as np
+
+from twosfs.progress import Progress, reporting
+from twosfs.spectra import add_spectra, zero_spectra
+from twosfs.statistics import scan_parameters
+
+
+def test_progress(tmp_path):
+    spectra = zero_spectra(4, np.arange(3), 1.0)
+    spectra.onesfs[1] = 1.0
+    spectra.num_sites = 1.0
+    reports = []
+    status_file = str(tmp_path / "status.json")
+    log = io.StringIO()
+    progress = Progress(reports.append, status_file, log, interval=0.0)
+    assert add_spectra([spectra] * 3, progress) == spectra + spectra + spectra
+    assert [r["done"] for r in reports] == [1, 2, 3, 3]
+    assert reports[-1]["finished"] and reports[-1]["eta"] == 0.0
+    assert reports[-1]["totals"] == {"num_sites": 3.0}
+    assert len(log.getvalue().splitlines()) == 4
+
+    with reporting(progress):
+        add_spectra(iter([spectra] * 2))
+    assert reports[-1]["total"] is None and reports[-1]["done"] == 2
+    add_spectra([spectra] * 2)
+    assert len(reports) == 7
+
+    with open(status_file) as f:
+        assert json.load(f)["tasks"]["add_spectra"] == reports[-1]
+
+
+def test_short_tasks_are_not_reported():
+    spectra = zero_spectra(4, np.arange(3), 1.0)
+    reports = []
+    with reporting(Progress(reports.append, interval=60.0)):
+        sum([spectra] * 5)
+        add_spectra([spectra] * 5)
+    assert reports == []
+
+
+def test_scan_parameters_progress():
+    spectra = zero_spectra(4, np.arange(8), 1.0)
+    spectra.num_pairs[:] = 1.0
+    spectra.twosfs[:, 1, 1] = 1.0
+    reports = []
+    results = list(
+        scan_parameters(
+            spectra,
+            spectra,
+            [1, 2],
+            [6],
+            2,
+            False,
+            5,
+            np.random.default_rng(1),
+            Progress(reports.append, interval=0.0),
+        )
+    )
+    assert len(results) == 2
+    assert [r["done"] for r in reports] == [5, 10, 10]
+    assert reports[-1]["total"] == 10
+    assert reports[-1]["totals"] == {"pair_density": 2, "max_distance": 6}
@@ -0,0 +1,83 @@
+"""Tests for the simulations module."""
+
+import numpy as np
+import pytest
+
+from twosfs import simulations
+from twosfs.simulations import jackknife_rse, simulate_spectra_adaptive
+from twosfs.spectra import Spectra
+
+
+def _sites_spectra(num_sites: float) -> Spectra:
+    onesfs = np.zeros(5)
+    onesfs[1] = num_sites
+    return Spectra(
+        4, np.arange(3), 1.0, num_sites, np.zeros(2), onesfs, np.zeros((2, 5, 5))
+    )
+
+
+def _num_sites(spectra: Spectra) -> float:
+    return spectra.num_sites
+
+
+def test_jackknife_rse():
+    parts = [_sites_spectra(n) for n in (1.0, 2.0, 3.0)]
+    total = _sites_spectra(6.0)
+    # Leaving out each part gives 5, 4 and 3, with jackknife variance 2 * 2 / 3.
+    assert np.isclose(jackknife_rse(total, parts, _num_sites), np.sqrt(4 / 3) / 6)
+    zero = _sites_spectra(0.0)
+    assert jackknife_rse(zero, [zero, zero], _num_sites) == np.inf
+
+    # The mean number of sites of parts of 1, 2 and 3 replicates, stored in
+    # num_pairs: the pseudovalues are the means of the parts, 1, 2 and 3.
+    parts = [_sites_spectra(n * n) for n in (1.0, 2.0, 3.0)]
+    for n, part in enumerate(parts, 1):
+        part.num_pairs[0] = n
+    total = parts[0] + parts[1] + parts[2]
+    rse = jackknife_rse(total, parts, lambda s: s.num_sites / s.num_pairs[0], [1, 2, 3])
+    variance = ((1 - 7 / 3) ** 2 / 5 + (2 - 7 / 3) ** 2 / 2 + (3 - 7 / 3) ** 2) / 3
+    assert np.isclose(rse, np.sqrt(variance) / (7 / 3))
+
+
+@pytest.fixture
+def batch_sizes(monkeypatch):
+    """Replace msprime by batches of one site per replicate, plus noise."""
+    sizes = []
+    rng = np.random.default_rng(0)
+
+    def simulate(coal_model, demography, r, seed, msprime_parameters, progress=None):
+        n = msprime_parameters["num_replicates"]
+        sizes.append(n)
+        return _sites_spectra(n * rng.uniform(0.5, 1.5))
+
+    monkeypatch.setattr(simulations, "_simulate", simulate)
+    return sizes
+
+
+def test_adaptive_stops_at_target(batch_sizes, monkeypatch):
+    rses = []
+
+    def recorded_rse(*args):
+        rses.append(jackknife_rse(*args))
+        return rses[-1]
+
+    monkeypatch.setattr(simulations, "jackknife_rse", recorded_rse)
+    parameters = dict(num_replicates=1000)
+    total, rse = simulate_spectra_adaptive(
+        "const", {}, parameters, 1.0, 1, 0.05, 5, _num_sites, min_batches=4
+    )
+    # The RSE is checked from the fourth batch on, until it reaches the target.
+    assert len(rses) == len(batch_sizes) - 3
+    assert rse == rses[-1] <= 0.05
+    assert all(r > 0.05 for r in rses[:-1])
+    assert sum(batch_sizes) < 1000
+
+
+def test_adaptive_caps_replicates(batch_sizes):
+    parameters = dict(num_replicates=23)
+    total, rse = simulate_spectra_adaptive(
+        "const", {}, parameters, 1.0, 1, 0.0, 5, _num_sites, num_groups=3
+    )
+    assert batch_sizes == [5, 5, 5, 5, 3]
+    assert rse > 0
+    assert np.isclose(total.num_sites, np.sum(total.onesfs))
@@ -3,10 +3,12 @@
 from copy import deepcopy
 from tempfile import TemporaryFile
 
+import attr
 import hypothesis.extra.numpy as hnp
 import hypothesis.strategies as st
 import msprime
 import numpy as np
+import pytest
 from hypothesis import assume, given
 
 from twosfs.spectra import (
@@ -16,6 +18,8 @@ from twosfs.spectra import (
     load_spectra,
     lump_onesfs,
     lump_twosfs,
+    spectra_batch_from_list,
+    spectra_from_sites,
     spectra_from_TreeSequence,
     zero_spectra_like,
 )
@@ -161,6 +165,36 @@ def test_sum_function(xs):
     assert sum(xs) == xs[0] + xs[1]
 
 
+@given(spectras())
+def test_from_arrays_unchecked(x):
+    fields = [getattr(x, field.name) for field in attr.fields(Spectra)]
+    y = Spectra.from_arrays_unchecked(*fields)
+    y.validate()
+    assert x == y
+    assert x == y.copy()
+
+
+def test_validate():
+    x = Spectra.from_arrays_unchecked(
+        1, np.arange(3.0), 1.0, 0.0, np.zeros(2), np.zeros(2), -np.ones((2, 2, 2))
+    )
+    with pytest.raises(ValueError):
+        x.validate()
+
+
+@given(spectras(num=3))
+def test_spectra_batch(xs):
+    batch = spectra_batch_from_list(xs)
+    assert len(batch) == 3
+    assert all(b == x for b, x in zip(batch, xs))
+    assert batch.sum().close(sum(xs))
+    assert batch[0].twosfs.base is batch.twosfs
+    for folded in [True, False]:
+        normed = batch.normalized_twosfs(folded=folded)
+        for b, x in zip(normed, xs):
+            assert np.allclose(b, x.normalized_twosfs(folded=folded))
+
+
 @given(spectras())
 def test_save_load(x):
     """Test that saving and loading are inverses."""
@@ -171,6 +205,48 @@ def test_save_load(x):
     assert x == loaded
 
 
+@pytest.mark.parametrize("format", ["hdf5", "npz"])
+def test_count_spectra(tmp_path, format):
+    rng = np.random.default_rng(2)
+    positions = rng.choice(200, size=60, replace=False)
+    allele_counts = dict(zip(positions.tolist(), rng.integers(1, 10, 60).tolist()))
+    windows = np.array([0, 1, 3, 6, 10])
+    spectra = spectra_from_sites(10, windows, 1.0, allele_counts, counts=True)
+    assert spectra.twosfs.dtype == np.uint64
+    assert spectra == spectra_from_sites(10, windows, 1.0, allele_counts)
+    assert spectra_from_sites(10, windows, 1.0, allele_counts).twosfs.dtype == float
+
+    # Count pairs the slow way.
+    twosfs = np.zeros((4, 11, 11))
+    for pos, ac1 in allele_counts.items():
+        for i in range(4):
+            for d in range(windows[i], windows[i + 1]):
+                if pos + d in allele_counts:
+                    twosfs[i, ac1, allele_counts[pos + d]] += 1
+                    twosfs[i, allele_counts[pos + d], ac1] += 1
+    assert np.all(spectra.twosfs == twosfs)
+    assert np.all(2 * spectra.num_pairs == np.sum(twosfs, axis=(1, 2)))
+
+    path = str(tmp_path / f"spectra.{format}")
+    spectra.save(path, format=format)
+    loaded = load_spectra(path, format=format)
+    assert loaded == spectra and loaded.twosfs.dtype == np.uint64
+    assert np.allclose(np.sum(spectra.normalized_twosfs()[1:], axis=(1, 2)), 1)
+
+    assert (spectra + spectra).twosfs.dtype == np.uint64
+    assert (spectra + spectra.astype(float)).twosfs.dtype == float
+    fractional = spectra.astype(float)
+    fractional.twosfs[1] /= 3
+    with pytest.raises(ValueError):
+        fractional.astype(np.uint64)
+    with pytest.raises(ValueError):
+        spectra.astype(np.int64)
+    # Other integer input is stored as float, so that float workflows keep working.
+    ints = Spectra(2, [0, 1], 1.0, 1, [1], [0, 1, 0], [[[0, 0, 0], [0, 2, 0], [0] * 3]])
+    assert ints.twosfs.dtype == float
+    ints.twosfs /= 2
+
+
 # TODO:
 # - linear
 # - nullspace
@@ -0,0 +1,296 @@
+"""Tests for the statistics module."""
+
+from tempfile import TemporaryFile
+
+import hypothesis.extra.numpy as hnp
+import hypothesis.strategies as st
+import numpy as np
+import pytest
+from hypothesis import assume, given
+
+from twosfs.precision import precision
+from twosfs.simulations import simulate_spectra
+from twosfs.spectra import Spectra, zero_spectra
+from twosfs.statistics import (
+    NullDistribution,
+    empirical_pvals,
+    load_null_distribution,
+    resample_pdf_counts,
+    resample_pdf_sparse,
+    sample_ks_statistics,
+    sample_spectra_batch,
+    search_recombination_rates,
+    surrogate_search,
+    twosfs_pdf,
+)
+
+samples = hnp.arrays(
+    dtype=float,
+    shape=st.integers(min_value=1, max_value=100),
+    elements=st.floats(min_value=0.0, max_value=10.0),
+)
+
+
+@given(samples, st.floats(min_value=-1.0, max_value=11.0))
+def test_null_distribution_pvals(null, value):
+    expected = empirical_pvals(np.full_like(null, value), list(null))
+    assert np.allclose(NullDistribution(null).pvals(value), expected)
+
+
+@given(samples, samples)
+def test_null_distribution_pvals_vectorized(null, values):
+    dist = NullDistribution(null)
+    pvals = dist.pvals(values)
+    assert pvals.shape == values.shape
+    assert np.allclose(pvals, [dist.pvals(v) for v in values])
+
+
+@given(samples)
+def test_null_distribution_save_load(null):
+    dist = NullDistribution(null)
+    for format in ["hdf5", "npz"]:
+        with TemporaryFile() as tf:
+            dist.save(tf, format=format)
+            tf.seek(0)
+            loaded = load_null_distribution(tf, format=format)
+        assert np.all(loaded.samples == dist.samples)
+
+
+@given(
+    hnp.arrays(
+        dtype=float,
+        shape=st.tuples(
+            st.integers(min_value=1, max_value=5), st.integers(min_value=1, max_value=5)
+        ),
+        elements=st.floats(min_value=0.0, max_value=1.0),
+    ),
+    st.integers(min_value=0, max_value=50),
+    st.integers(min_value=1, max_value=10),
+)
+def test_resample_pdf_sparse(pdf, n_obs, num_replicates):
+    assume(np.sum(pdf) > 0)
+    rng = np.random.default_rng(1)
+    counts = resample_pdf_sparse(pdf, n_obs, num_replicates, rng)
+    dense = counts.to_dense()
+    assert dense.shape == (num_replicates, *pdf.shape)
+    assert np.all(counts.totals() == n_obs)
+    assert np.all(np.sum(dense, axis=(1, 2)) == n_obs)
+    assert np.all(dense[:, pdf == 0] == 0)
+    rng = np.random.default_rng(1)
+    assert np.array_equal(resample_pdf_counts(pdf, n_obs, num_replicates, rng), dense)
+
+
+def test_sample_spectra_batch_multinomial():
+    rng = np.random.default_rng(1)
+    twosfs = rng.random((3, 5, 5))
+    twosfs[1] = 0
+    spectra = Spectra(4, [0, 1, 2, 3], 1.0, 10, [1, 0, 1], rng.random(5), twosfs)
+    num_pairs = np.array([100, 0, 7])
+    batch = sample_spectra_batch(spectra, num_pairs, 20, rng, multinomial=True)
+    assert len(batch) == 20
+    assert np.all(np.sum(batch.twosfs, axis=(2, 3)) == num_pairs)
+    assert all(s.compatible(spectra) for s in batch)
+
+
+def test_resample_pdf_sparse_skips_trailing_zeros():
+    class LastDraw(object):
+        def random(self, size):
+            return np.full(size, np.nextafter(1.0, 0.0))
+
+    # The cumulative sum of seven sevenths rounds to just below one.
+    pdf = np.r_[np.full(7, 1 / 7), np.zeros(5)]
+    counts = resample_pdf_sparse(pdf, 3, 2, LastDraw())
+    assert np.all(counts.cells == 6)
+
+
+def test_resample_without_rng_uses_global_state():
+    rng = np.random.default_rng(3)
+    spectra = Spectra(
+        4, [0, 1, 2], 1.0, 10, [10, 10], rng.random(5), rng.random((2, 5, 5))
+    )
+    num_pairs = np.array([50, 5])
+    samples = []
+    for _ in range(2):
+        np.random.seed(7)
+        samples.append(sample_ks_statistics(spectra, spectra, 4, False, 5, num_pairs))
+    assert np.array_equal(samples[0], samples[1])
+
+
+def test_search_recombination_rates_resumes(tmp_path, monkeypatch):
+    import twosfs.statistics as statistics
+
+    msprime_parameters = dict(samples=4, ploidy=2, sequence_length=4, num_replicates=20)
+    spectra = simulate_spectra("const", {}, msprime_parameters, 0.1, 1)
+
+    def search(checkpoint_file):
+        sim_kwargs = dict(
+            model="const",
+            model_parameters={},
+            msprime_parameters=msprime_parameters,
+            random_seed=np.random.default_rng(2),
+        )
+        result = search_recombination_rates(
+            spectra, 4, False, sim_kwargs, 0.05, 0.2, 3, checkpoint_file
+        )
+        return result, sim_kwargs["random_seed"].integers(1000)
+
+    expected = search(None)
+
+    simulate_ks = statistics.simulate_ks
+    calls = []
+
+    def interrupted_ks(*args, **kwargs):
+        calls.append(1)
+        if len(calls) > 3:
+            raise KeyboardInterrupt
+        return simulate_ks(*args, **kwargs)
+
+    monkeypatch.setattr(statistics, "simulate_ks", interrupted_ks)
+    checkpoint_file = str(tmp_path / "search.checkpoint")
+    with pytest.raises(KeyboardInterrupt):
+        search(checkpoint_file)
+    monkeypatch.setattr(statistics, "simulate_ks", simulate_ks)
+
+    (low, high), state = search(checkpoint_file)
+    (expected_low, expected_high), expected_state = expected
+    assert state == expected_state
+    for result, expected_result in [(low, expected_low), (high, expected_high)]:
+        assert result[:2] == expected_result[:2]
+        assert result[2] == expected_result[2]
+
+
+def test_search_recombination_rates_resumes_after_last_evaluation(
+    tmp_path, monkeypatch
+):
+    import twosfs.statistics as statistics
+
+    spectra = zero_spectra(4, np.arange(3), 1.0)
+    calls = []
+
+    def quadratic_ks(r, *args, **kwargs):
+        # The minimum is at r_high, so the latest evaluation is always the best.
+        calls.append(r)
+        return (r - 0.2) ** 2, zero_spectra(4, np.arange(3), r)
+
+    monkeypatch.setattr(statistics, "simulate_ks", quadratic_ks)
+    checkpoint_file = str(tmp_path / "search.checkpoint")
+    expected = search_recombination_rates(
+        spectra, 4, False, {}, 0.05, 0.2, 1, checkpoint_file
+    )
+    num_calls = len(calls)
+    # Preempted before writing the output: all evaluations are replayed.
+    low, high = search_recombination_rates(
+        spectra, 4, False, {}, 0.05, 0.2, 1, checkpoint_file
+    )
+    assert len(calls) == num_calls
+    for result, expected_result in zip((low, high), expected):
+        assert result[:2] == expected_result[:2]
+        assert result[2] == expected_result[2]
+
+
+def test_surrogate_search_resumes(tmp_path, monkeypatch):
+    import twosfs.statistics as statistics
+
+    spectra = zero_spectra(4, np.arange(3), 1.0)
+    calls = []
+
+    def quadratic_ks(r, *args, **kwargs):
+        calls.append(r)
+        return (r - 0.13) ** 2, zero_spectra(4, np.arange(3), r)
+
+    monkeypatch.setattr(statistics, "simulate_ks", quadratic_ks)
+    checkpoint_file = str(tmp_path / "search.checkpoint")
+    expected = search_recombination_rates(
+        spectra, 4, False, {}, 0.05, 0.2, 4, checkpoint_file, method="surrogate"
+    )
+    num_calls = len(calls)
+    # The upper end of the bracket is neither the latest nor the best evaluation,
+    # the only ones whose spectra golden section search needs.
+    assert sorted(calls, key=lambda r: (r - 0.13) ** 2)[0] == calls[-2]
+    assert expected[1][0] == calls[-3]
+    low, high = search_recombination_rates(
+        spectra, 4, False, {}, 0.05, 0.2, 4, checkpoint_file, method="surrogate"
+    )
+    assert len(calls) == num_calls
+    for result, expected_result in zip((low, high), expected):
+        assert result[:2] == expected_result[:2]
+        assert result[2] == expected_result[2]
+
+
+def test_search_ignores_mismatched_checkpoint(tmp_path, monkeypatch):
+    import twosfs.statistics as statistics
+
+    spectra = zero_spectra(4, np.arange(3), 1.0)
+    args = (spectra, 4, False, {}, 0.05, 0.2, 4)
+    keys = {
+        statistics._search_key(*args, method, batch_size)
+        for method, batch_size in [("golden", 1), ("surrogate", 1), ("surrogate", 2)]
+    }
+    assert len(keys) == 3
+
+    calls = []
+
+    def quadratic_ks(r, *args, **kwargs):
+        calls.append(r)
+        return (r - 0.13) ** 2, zero_spectra(4, np.arange(3), r)
+
+    monkeypatch.setattr(statistics, "simulate_ks", quadratic_ks)
+    expected = search_recombination_rates(*args, method="surrogate")
+    # Even a checkpoint with the same key is ignored once it stops matching.
+    monkeypatch.setattr(statistics, "_search_key", lambda *args: "key")
+    checkpoint_file = str(tmp_path / "search.checkpoint")
+    search_recombination_rates(*args, checkpoint_file)
+    calls.clear()
+    result = search_recombination_rates(*args, checkpoint_file, method="surrogate")
+    assert len(calls) == 6
+    for r, expected_r in zip(result, expected):
+        assert r[:2] == expected_r[:2]
+        assert r[2] == expected_r[2]
+
+
+def test_surrogate_search_quadratic():
+    xs, ys, x_min = surrogate_search(
+        lambda xs: list((xs - 0.3) ** 2), 0.0, 1.0, 8, batch_size=2
+    )
+    assert len(xs) == len(ys) == 8
+    assert abs(x_min - 0.3) < 0.02
+
+
+def test_surrogate_search_never_repeats_points():
+    evaluated = []
+
+    def evaluate(xs):
+        evaluated.extend(xs)
+        return list((xs - 0.3) ** 2)
+
+    # The initial design includes 0.5, one of the five candidates, and the
+    # batches ask for more points than there are candidates left.
+    xs, ys, _ = surrogate_search(evaluate, 0.0, 1.0, 10, batch_size=3, num_candidates=5)
+    assert len(np.unique(xs)) == len(xs) == len(evaluated) == 7
+    assert np.array_equal(xs, evaluated)
+
+
+@pytest.mark.parametrize("folded", [False, True])
+def test_float32_ks_error(folded):
+    rng = np.random.default_rng(3)
+    spectra = []
+    for _ in range(2):
+        s = zero_spectra(30, np.arange(11), 1.0)
+        s.num_pairs[1:] = 1.0
+        s.twosfs[1:] = rng.exponential(size=s.twosfs[1:].shape)
+        spectra.append(s)
+    pdf32 = twosfs_pdf(spectra[0], 10, folded, dtype=np.float32)
+    assert pdf32.dtype == np.float32
+    np.testing.assert_allclose(pdf32, twosfs_pdf(spectra[0], 10, folded), atol=1e-7)
+
+    num_pairs = np.zeros(10)
+    num_pairs[3::3] = 1000
+    ks64 = sample_ks_statistics(
+        *spectra, 10, folded, 200, num_pairs, np.random.default_rng(1)
+    )
+    with precision("float32"):
+        ks32 = sample_ks_statistics(
+            *spectra, 10, folded, 200, num_pairs, np.random.default_rng(1)
+        )
+    # The KS statistics are scaled by sqrt(num_pairs), here about 55.
+    assert np.max(np.abs(ks32 - ks64)) < 1e-3
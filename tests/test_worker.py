@@ -0,0 +1,78 @@
+"""Tests for the worker module."""
+
+import io
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from twosfs.simulations import simulate_spectra
+from twosfs.spectra import load_spectra, zero_spectra
+from twosfs.worker import make_server, serve_stdio, submit
+
+
+def test_serve_stdio(tmp_path):
+    spectra = zero_spectra(4, np.arange(3), 1.0)
+    spectra.onesfs[1] = 1.0
+    spectra.num_sites = 1.0
+    inputs = []
+    for i in range(3):
+        inputs.append(str(tmp_path / f"rep={i}.hdf5"))
+        spectra.save(inputs[-1])
+    output = str(tmp_path / "rep=all.hdf5")
+    requests = [
+        {"id": 0, "job": "ping"},
+        {"id": 1, "job": "add", "kwargs": {"inputs": inputs, "output": output}},
+        {"id": 2, "job": "missing"},
+    ]
+    infile = io.StringIO("".join(json.dumps(r) + "\n" for r in requests))
+    outfile = io.StringIO()
+    serve_stdio(infile, outfile)
+    responses = [json.loads(line) for line in outfile.getvalue().splitlines()]
+    assert [r["id"] for r in responses] == [0, 1, 2]
+    assert [r["ok"] for r in responses] == [True, True, False]
+    assert load_spectra(output) == spectra + spectra + spectra
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_serve_socket(tmp_path, workers):
+    from twosfs import jobs
+
+    msprime_parameters = dict(samples=4, ploidy=2, sequence_length=4, num_replicates=5)
+    spectra_file = str(tmp_path / "spectra.hdf5")
+    simulate_spectra("const", {}, msprime_parameters, 0.1, 1).save(spectra_file)
+    socket_path = str(tmp_path / "worker.sock")
+    jobs._load_spectra.cache_clear()
+    with make_server(socket_path, workers) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            responses = [
+                submit(
+                    "power_scan",
+                    socket_path,
+                    i,
+                    spectra_comp_file=spectra_file,
+                    spectra_null_file=spectra_file,
+                    pair_densities=[10],
+                    max_distances=[3],
+                    k_max=4,
+                    folded=False,
+                    n_reps=2,
+                    output=str(tmp_path / f"scan{i}.jsonl"),
+                )
+                for i in range(4)
+            ]
+        finally:
+            server.shutdown()
+    assert all(r["ok"] for r in responses)
+    # Jobs run in persistent processes, so caches stay warm between jobs.
+    pids = {r["pid"] for r in responses}
+    if workers == 1:
+        assert pids == {os.getpid()}
+        assert jobs._load_spectra.cache_info().hits == 7
+    else:
+        assert os.getpid() not in pids
+        assert len(pids) <= workers
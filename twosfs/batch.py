@@ -0,0 +1,251 @@
+"""Run all initial simulations of a Configuration as one batch.
+
+The Snakemake workflow runs every (model, rep) simulation as a separate job.
+Here the same units are split into shards, for example one per element of a
+cluster job array, and each shard runs its units on a local process pool. Each
+shard sums its reps per model and writes one store: an hdf5 file with one
+spectra group per model. Stores are then merged, and the totals can be written
+to the `rep=all` initial spectra files that the rest of the workflow reads.
+
+Every unit uses the seed of its per-rep output file, so a batch gives the same
+spectra as the per-rep jobs, up to rounding: units are summed in the order they
+finish, not in rep order.
+"""
+import os
+from typing import Iterable, Iterator, Optional
+
+import attr
+import numpy as np
+
+from twosfs.config import (
+    Configuration,
+    make_parameter_string,
+    parse_parameter_string,
+)
+from twosfs.spectra import Spectra, spectra_from_hdf5, spectra_to_hdf5
+
+# model, params, rep
+SimulationUnit = tuple[str, dict, int]
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """Parse a shard string "i/N" into (i, N), with 0 <= i < N."""
+    try:
+        index, num_shards = map(int, shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard '{shard}' must have the form i/N.")
+    if not 0 <= index < num_shards:
+        raise ValueError(f"Shard index must be in [0, {num_shards}), got {index}.")
+    return index, num_shards
+
+
+def model_key(model: str, params: dict) -> str:
+    """Get the name of the store group of a model."""
+    return f"model={model}.params={make_parameter_string(params)}"
+
+
+def iter_simulation_units(
+    config: Configuration, models: Optional[list[str]] = None
+) -> Iterator[SimulationUnit]:
+    """Iterate over every (model, params, rep) simulation of a configuration."""
+    for model, params in config.iter_models():
+        if models and model not in models:
+            continue
+        for rep in range(config.nruns):
+            yield model, params, rep
+
+
+def shard_units(
+    units: Iterable[SimulationUnit], index: int, num_shards: int
+) -> list[SimulationUnit]:
+    """Get the units of shard index out of num_shards.
+
+    Units are dealt round-robin, so that every shard gets a similar mix of
+    cheap and expensive models.
+    """
+    return list(units)[index::num_shards]
+
+
+def _simulate_unit(
+    args: tuple[Configuration, SimulationUnit]
+) -> tuple[SimulationUnit, Spectra]:
+    from twosfs.simulations import filename2seed, simulate_spectra
+
+    config, unit = args
+    model, params, rep = unit
+    output = config.initial_spectra_file.format(
+        model=model, params=make_parameter_string(params), rep=rep
+    )
+    spectra = simulate_spectra(
+        model=model,
+        model_parameters=params,
+        msprime_parameters=config.msprime_parameters,
+        scaled_recombination_rate=config.scaled_recombination_rate,
+        random_seed=filename2seed(output),
+    )
+    return unit, spectra
+
+
+@attr.s(eq=False)
+class SpectraStore(object):
+    """
+    Stores summed spectra of simulation units, keyed by `model_key`.
+
+    Attributes
+    ----------
+    totals : dict[str, Spectra]
+        The summed spectra of each model.
+    reps : dict[str, set[int]]
+        The reps included in each total.
+    models : dict[str, tuple[str, dict]]
+        The model and parameters of each key.
+    """
+
+    totals: dict[str, Spectra] = attr.ib(factory=dict)
+    reps: dict[str, set[int]] = attr.ib(factory=dict)
+    models: dict[str, tuple[str, dict]] = attr.ib(factory=dict)
+
+    def __len__(self) -> int:
+        """Return the number of models in the store."""
+        return len(self.totals)
+
+    def add(self, model: str, params: dict, reps: Iterable[int], spectra: Spectra):
+        """Add the spectra of reps of a model. Raise ValueError on repeated reps."""
+        key = model_key(model, params)
+        reps = set(reps)
+        if key in self.totals:
+            if self.reps[key] & reps:
+                raise ValueError(f"Reps {self.reps[key] & reps} of {key} added twice.")
+            self.totals[key] = self.totals[key] + spectra
+            self.reps[key] |= reps
+        else:
+            self.totals[key] = spectra
+            self.reps[key] = reps
+            self.models[key] = (model, params)
+
+    def update_from(self, other: "SpectraStore") -> None:
+        """Add all totals of another store."""
+        for key, spectra in other.totals.items():
+            model, params = other.models[key]
+            self.add(model, params, other.reps[key], spectra)
+
+    def save(self, output_file) -> None:
+        """Save the store to an hdf5 file."""
+        import h5py
+
+        with h5py.File(output_file, "w") as f:
+            for key, spectra in self.totals.items():
+                model, params = self.models[key]
+                spectra_to_hdf5(
+                    spectra,
+                    f,
+                    key,
+                    attrs={
+                        "model": model,
+                        "params": make_parameter_string(params),
+                        "reps": np.array(sorted(self.reps[key]), dtype=int),
+                    },
+                )
+
+    def write_initial_spectra(
+        self, config: Configuration, models: Optional[list[str]] = None
+    ) -> list[str]:
+        """Write the totals to the `rep=all` initial spectra files of config.
+
+        Raise ValueError, before writing anything, if a model of config (or only
+        of models, if given) has no total, or if a total is missing reps.
+        """
+        expected = [
+            model_key(model, params)
+            for model, params in config.iter_models()
+            if not models or model in models
+        ]
+        absent = [key for key in expected if key not in self.totals]
+        if absent:
+            raise ValueError(
+                f"The stores are missing {len(absent)} models: {', '.join(absent)}."
+            )
+        for key in self.totals:
+            missing = set(range(config.nruns)) - self.reps[key]
+            if missing:
+                raise ValueError(f"{key} is missing {len(missing)} reps.")
+        outputs = []
+        for key, spectra in self.totals.items():
+            output = config.format_initial_spectra_file(*self.models[key])
+            os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+            spectra.save(output)
+            outputs.append(output)
+        return outputs
+
+
+def load_store(input_file) -> SpectraStore:
+    """Read a SpectraStore from an hdf5 file created by SpectraStore.save()."""
+    import h5py
+
+    store = SpectraStore()
+    with h5py.File(input_file, "r") as f:
+        for group in f.values():
+            store.add(
+                str(group.attrs["model"]),
+                parse_parameter_string(str(group.attrs["params"])),
+                group.attrs["reps"].tolist(),
+                spectra_from_hdf5(group),
+            )
+    return store
+
+
+def merge_stores(input_files: Iterable) -> SpectraStore:
+    """Add the stores saved in input_files."""
+    store = SpectraStore()
+    for input_file in input_files:
+        store.update_from(load_store(input_file))
+    return store
+
+
+def _map_units(tasks, workers, chunk_size):
+    # Totals are accumulated as units finish, so only a few Spectra are in memory.
+    if workers <= 1:
+        yield from map(_simulate_unit, tasks)
+    else:
+        from multiprocessing import Pool
+
+        with Pool(workers) as pool:
+            yield from pool.imap_unordered(_simulate_unit, tasks, chunk_size)
+
+
+def simulate_batch(
+    config: Configuration,
+    shard: int = 0,
+    num_shards: int = 1,
+    workers: int = 1,
+    chunk_size: int = 1,
+    models: Optional[list[str]] = None,
+) -> SpectraStore:
+    """Simulate one shard of the initial spectra of config.
+
+    Parameters
+    ----------
+    config : Configuration
+        The simulation configuration.
+    shard : int
+        The index of the shard to simulate.
+    num_shards : int
+        The number of shards the simulation units are split into.
+    workers : int
+        The number of processes. If 1 (default), simulate in this process.
+    chunk_size : int
+        The number of units sent to a process at a time.
+    models : list[str], optional
+        Only simulate these models (default: all).
+
+    Returns
+    -------
+    SpectraStore
+        The summed spectra of the shard for each model.
+    """
+    units = shard_units(iter_simulation_units(config, models), shard, num_shards)
+    tasks = [(config, unit) for unit in units]
+    store = SpectraStore()
+    for (model, params, rep), spectra in _map_units(tasks, workers, chunk_size):
+        store.add(model, params, [rep], spectra)
+    return store
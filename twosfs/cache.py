@@ -0,0 +1,205 @@
+"""Memoization of expensive computations in memory and on disk."""
+import json
+import os
+from hashlib import blake2b
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+import numpy as np
+
+# Environment variable naming a directory for caches shared between jobs.
+CACHE_DIR_VARIABLE = "TWOSFS_CACHE_DIR"
+
+# Environment variable naming a directory for cached results, such as simulations.
+# Separate from CACHE_DIR_VARIABLE, because the results can take much disk space.
+RESULT_CACHE_DIR_VARIABLE = "TWOSFS_RESULT_CACHE_DIR"
+
+T = TypeVar("T")
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def canonical_json(obj: Any) -> str:
+    """Convert an object to json with sorted keys and no whitespace.
+
+    Numpy arrays and scalars are converted to lists and python scalars, so that
+    equal parameters always produce the same string.
+    """
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=_json_default)
+
+
+def canonical_hash(*objs: Any, digest_size: int = 16) -> str:
+    """Hash the canonical json representation of objs.
+
+    Examples
+    --------
+    >>> canonical_hash("exp", {"growth_rate": 1.0, "end_time": 0.5})
+    '3a6abaa482aeee4d9b08023216806a43'
+
+    Key order does not matter.
+
+    >>> (canonical_hash("exp", {"growth_rate": 1.0, "end_time": 0.5})
+    ...  == canonical_hash("exp", {"end_time": 0.5, "growth_rate": 1.0}))
+    True
+    """
+    h = blake2b(canonical_json(list(objs)).encode(), digest_size=digest_size)
+    return h.hexdigest()
+
+
+def cache_directory() -> Optional[str]:
+    """Return the shared cache directory, or None if caching to disk is off."""
+    return os.environ.get(CACHE_DIR_VARIABLE) or None
+
+
+class JSONCache(object):
+    """
+    A persistent mapping from string keys to JSON-serializable values.
+
+    The file is re-read before every write and replaced atomically, so that
+    concurrent jobs never see a partially written cache. If two jobs write at the
+    same time, one of the new entries may be lost, which only costs a recomputation.
+
+    Parameters
+    ----------
+    path : str
+        The location of the JSON file. It is created on the first write.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data: Optional[dict[str, Any]] = None
+
+    def _read(self) -> dict[str, Any]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @property
+    def data(self) -> dict[str, Any]:
+        """Return the cached entries, reading the file on first access."""
+        if self._data is None:
+            self._data = self._read()
+        return self._data
+
+    def __contains__(self, key: str) -> bool:
+        """Check whether key is cached, re-reading the file on a miss."""
+        if key not in self.data:
+            self._data = self._read()
+        return key in self.data
+
+    def __getitem__(self, key: str) -> Any:
+        """Return the cached value for key."""
+        if key not in self:
+            raise KeyError(key)
+        return self.data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        """Cache a value and write the merged cache back to disk."""
+        self._data = self._read()
+        self._data[key] = value
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(canonical_json(self._data))
+        os.replace(tmp_path, self.path)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over cached keys."""
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        """Return the number of cached entries."""
+        return len(self.data)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the cached value for key, or default if it is missing."""
+        return self[key] if key in self else default
+
+
+# Bump when a change to the code changes cached results, to invalidate them.
+CODE_VERSION = 1
+
+
+def normalize_parameters(obj: Any) -> Any:
+    """Convert numbers to floats and tuples and arrays to lists, recursively.
+
+    Parameters that differ only in formatting, such as 1 and 1.0, are equal after
+    normalization.
+
+    Examples
+    --------
+    >>> normalize_parameters({"sizes": (1, 2.5), "alpha": np.float64(1.5)})
+    {'sizes': [1.0, 2.5], 'alpha': 1.5}
+    """
+    if isinstance(obj, dict):
+        return {str(k): normalize_parameters(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        return [normalize_parameters(v) for v in obj]
+    if isinstance(obj, (bool, np.bool_)):
+        return bool(obj)
+    if isinstance(obj, (int, float, np.number)):
+        return float(obj)
+    return obj
+
+
+def result_key(function: str, *args: Any) -> str:
+    """Hash a function name, its normalized arguments and the code version."""
+    return canonical_hash(function, normalize_parameters(args), CODE_VERSION)
+
+
+class ResultCache(object):
+    """
+    A content-addressed store of results, one file per key.
+
+    Files are written to a temporary name and moved into place, so that
+    concurrent jobs computing the same result never see a partial file.
+
+    Parameters
+    ----------
+    directory : str
+        The root directory of the cache.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, key: str, suffix: str = ".hdf5") -> str:
+        """Return the file of key."""
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], T],
+        load: Callable[[str], T],
+        save: Callable[[T, str], None],
+        suffix: str = ".hdf5",
+    ) -> T:
+        """Load the result of key, or compute, save and return it."""
+        path = self.path(key, suffix)
+        if os.path.exists(path):
+            return load(path)
+        result = compute()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        save(result, tmp_path)
+        os.replace(tmp_path, path)
+        return result
+
+
+def result_cache() -> Optional[ResultCache]:
+    """Return the shared result cache, or None if caching results is off.
+
+    Results are cached only if TWOSFS_RESULT_CACHE_DIR is set.
+    """
+    directory = os.environ.get(RESULT_CACHE_DIR_VARIABLE)
+    return ResultCache(directory) if directory else None
@@ -0,0 +1,498 @@
+"""Command line interface to the twosfs workflow.
+
+Each subcommand builds a list of jobs from `twosfs.jobs` and runs them in one
+process, or in a pool of worker processes with --workers.
+"""
+import argparse
+import cProfile
+import json
+import multiprocessing
+import os
+import sys
+from typing import Any, Iterable, Iterator, Optional
+
+from twosfs.cache import CACHE_DIR_VARIABLE, RESULT_CACHE_DIR_VARIABLE
+from twosfs.config import make_parameter_string
+from twosfs.jobs import load_configuration
+from twosfs.memory import MEMORY_BUDGET_VARIABLE
+from twosfs.worker import handle_request
+
+Request = dict[str, Any]
+
+_profiler: Optional[cProfile.Profile] = None
+_profile_path: Optional[str] = None
+
+
+def _init_profiler(profile_path: Optional[str]) -> None:
+    global _profiler, _profile_path
+    if profile_path:
+        _profiler = cProfile.Profile()
+        _profile_path = profile_path
+
+
+def _run_request(request: Request) -> Request:
+    # Profiles accumulate per process and are written after every job.
+    if _profiler is None:
+        return handle_request(request)
+    _profiler.enable()
+    try:
+        return handle_request(request)
+    finally:
+        _profiler.disable()
+        path = _profile_path
+        # Checking the pid of the main process would fail in spawned workers,
+        # which re-import this module.
+        if path and multiprocessing.parent_process() is not None:
+            path = f"{path}.{os.getpid()}"
+        _profiler.dump_stats(path)
+
+
+def run_requests(
+    requests: Iterable[Request],
+    workers: int = 1,
+    chunk_size: int = 1,
+    profile: Optional[str] = None,
+) -> Iterator[Request]:
+    """Run jobs and yield their responses as they finish.
+
+    Parameters
+    ----------
+    requests : Iterable[dict]
+        Jobs in the format of `twosfs.worker`.
+    workers : int
+        The number of processes. If 1 (default), run jobs in this process.
+    chunk_size : int
+        The number of jobs sent to a worker process at a time.
+    profile : str, optional
+        Write cProfile statistics to this path. Worker processes append their pid.
+    """
+    if workers <= 1:
+        _init_profiler(profile)
+        yield from map(_run_request, requests)
+    else:
+        from multiprocessing import Pool
+
+        with Pool(workers, initializer=_init_profiler, initargs=(profile,)) as pool:
+            yield from pool.imap_unordered(_run_request, requests, chunk_size)
+
+
+def _keep(request: Request, overwrite: bool) -> bool:
+    return overwrite or not os.path.exists(request["kwargs"]["output"])
+
+
+def _selected(model: str, models: Optional[list[str]]) -> bool:
+    return not models or model in models
+
+
+def simulate_requests(
+    config_file: str, models: Optional[list[str]], reps: Optional[list[int]]
+) -> Iterator[Request]:
+    """Make jobs to simulate initial spectra for every model and rep."""
+    config = load_configuration(config_file)
+    for model, params in config.iter_models():
+        if not _selected(model, models):
+            continue
+        for rep in reps if reps is not None else range(config.nruns):
+            output = config.initial_spectra_file.format(
+                model=model, params=make_parameter_string(params), rep=rep
+            )
+            yield _request(
+                "simulate",
+                config_file=config_file,
+                model=model,
+                params=params,
+                output=output,
+            )
+
+
+def merge_requests(config_file: str, models: Optional[list[str]]) -> Iterator[Request]:
+    """Make jobs to add the simulated reps of every model."""
+    config = load_configuration(config_file)
+    for model, params in config.iter_models():
+        if not _selected(model, models):
+            continue
+        output = config.format_initial_spectra_file(model, params)
+        inputs = [
+            output.replace(".rep=all.", f".rep={r}.") for r in range(config.nruns)
+        ]
+        yield _request("add", inputs=inputs, output=output)
+
+
+def fit_requests(config_file: str, models: Optional[list[str]]) -> Iterator[Request]:
+    """Make jobs to fit a demography to every model."""
+    config = load_configuration(config_file)
+    for model, params, folded in config.iter_demos():
+        if not _selected(model, models):
+            continue
+        yield _request(
+            "fit",
+            config_file=config_file,
+            input=config.format_initial_spectra_file(model, params),
+            folded=folded,
+            output=config.format_fitted_demography_file(model, params, folded),
+        )
+
+
+def search_requests(
+    config_file: str, models: Optional[list[str]], workers: int = 1
+) -> Iterator[Request]:
+    """Make jobs to search the recombination rate for every configuration.
+
+    Each search simulates batches of a surrogate search in workers processes.
+    """
+    config = load_configuration(config_file)
+    for model, params, folded, density, length, rep in config.iter_rec_search():
+        if not _selected(model, models):
+            continue
+        yield _request(
+            "search_recombination",
+            config_file=config_file,
+            spectra_file=config.format_initial_spectra_file(model, params),
+            demo_file=config.format_fitted_demography_file(model, params, folded),
+            folded=folded,
+            pair_density=density,
+            sequence_length=length,
+            output=config.format_recombination_search_file(
+                model, params, folded, density, length, rep
+            ),
+            workers=workers,
+        )
+
+
+def grid_requests(config_file: str, models: Optional[list[str]]) -> Iterator[Request]:
+    """Make jobs to simulate a spectra grid for every fitted demography."""
+    config = load_configuration(config_file)
+    for model, params, folded in config.iter_demos():
+        if not _selected(model, models):
+            continue
+        for length in config.power_sequence_lengths:
+            yield _request(
+                "simulate_grid",
+                config_file=config_file,
+                demo_file=config.format_fitted_demography_file(model, params, folded),
+                sequence_length=length,
+                output=config.spectra_grid_file.format(
+                    model=model,
+                    params=make_parameter_string(params),
+                    folded=folded,
+                    sequence_length=length,
+                ),
+            )
+
+
+def grid_search_requests(
+    config_file: str, models: Optional[list[str]]
+) -> Iterator[Request]:
+    """Make jobs to search the recombination rate on spectra grids."""
+    config = load_configuration(config_file)
+    for model, params, folded, density, length, rep in config.iter_rec_search():
+        if not _selected(model, models):
+            continue
+        yield _request(
+            "search_recombination_grid",
+            config_file=config_file,
+            spectra_file=config.format_initial_spectra_file(model, params),
+            grid_file=config.spectra_grid_file.format(
+                model=model,
+                params=make_parameter_string(params),
+                folded=folded,
+                sequence_length=length,
+            ),
+            folded=folded,
+            pair_density=density,
+            sequence_length=length,
+            output=config.format_recombination_grid_search_file(
+                model, params, folded, density, length, rep
+            ),
+        )
+
+
+def _request(job: str, **kwargs) -> Request:
+    return {"id": kwargs.get("output"), "job": job, "kwargs": kwargs}
+
+
+def _add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--config", default="simulation_parameters.json")
+    parser.add_argument(
+        "--model", nargs="+", help="Only run these models (default: all)."
+    )
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Make the argument parser of the twosfs command."""
+    parser = argparse.ArgumentParser(prog="twosfs", description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes.")
+    parser.add_argument(
+        "--chunk-size", type=int, default=1, help="Jobs sent to a process at a time."
+    )
+    parser.add_argument("--profile", help="Write cProfile statistics to this file.")
+    parser.add_argument(
+        "--overwrite", action="store_true", help="Rerun jobs whose output exists."
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Cache expected T2 values and simulations in this directory "
+        "(sets TWOSFS_CACHE_DIR and TWOSFS_RESULT_CACHE_DIR).",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        help="Chunk spectra operations to fit e.g. 800M (sets TWOSFS_MEMORY_BUDGET).",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    simulate = subparsers.add_parser("simulate", help="Simulate initial spectra.")
+    _add_config_arguments(simulate)
+    simulate.add_argument("--reps", type=int, nargs="+", help="Default: all reps.")
+
+    merge = subparsers.add_parser("merge", help="Add spectra files.")
+    _add_config_arguments(merge)
+    merge.add_argument("inputs", nargs="*", help="If given, add only these files.")
+    merge.add_argument("-o", "--output", help="Output file for inputs.")
+
+    fit = subparsers.add_parser("fit", help="Fit demographies to initial spectra.")
+    _add_config_arguments(fit)
+
+    search = subparsers.add_parser("search-r", help="Search recombination rates.")
+    _add_config_arguments(search)
+    search.add_argument(
+        "--workers",
+        dest="search_workers",
+        type=int,
+        default=1,
+        help="Processes simulating each batch of a surrogate search.",
+    )
+
+    grid = subparsers.add_parser(
+        "simulate-grid", help="Simulate spectra grids of fitted demographies."
+    )
+    _add_config_arguments(grid)
+
+    search_grid = subparsers.add_parser(
+        "search-grid", help="Search recombination rates on spectra grids."
+    )
+    _add_config_arguments(search_grid)
+
+    sites = subparsers.add_parser(
+        "build-from-sites", help="Build spectra from allele counts."
+    )
+    sites.add_argument("--sites", required=True, help="Site positions, one per line.")
+    sites.add_argument("--allele-counts", required=True, help="Gzipped counts file.")
+    sites.add_argument("--num-samples", type=int, required=True)
+    sites.add_argument("--num-windows", type=int, required=True)
+    sites.add_argument("--recombination-rate", type=float, required=True)
+    sites.add_argument("--cov-cutoff", type=int, required=True)
+    sites.add_argument("--start", type=float, default=0)
+    sites.add_argument("--end", type=float, default=float("inf"))
+    sites.add_argument("-o", "--output", required=True)
+
+    pair_counts = subparsers.add_parser(
+        "pair-counts", help="Count the pairs of sites in each window."
+    )
+    pair_counts.add_argument(
+        "sites", nargs="+", help="Site positions, one file per chromosome."
+    )
+    pair_counts.add_argument("--num-windows", type=int, required=True)
+    pair_counts.add_argument("-o", "--output", required=True, help="A .npy file.")
+
+    batch = subparsers.add_parser(
+        "simulate-batch", help="Simulate a shard of initial spectra into one store."
+    )
+    _add_config_arguments(batch)
+    batch.add_argument("--shard", default="0/1", help="i/N, with 0 <= i < N.")
+    batch.add_argument(
+        "-o", "--output", help="Default: {simulation_directory}/batch/shard=i-of-N.hdf5"
+    )
+
+    consolidate = subparsers.add_parser(
+        "consolidate", help="Merge batch stores into initial spectra files."
+    )
+    consolidate.add_argument("stores", nargs="+")
+    _add_config_arguments(consolidate)
+    consolidate.add_argument("-o", "--output", help="Also save the merged store.")
+
+    manifest = subparsers.add_parser(
+        "manifest", help="Index the target files of a config."
+    )
+    _add_config_arguments(manifest)
+    manifest.add_argument("--list", action="store_true", help="Print the targets.")
+    manifest.add_argument("--kind", help="Default: all kinds of targets.")
+    manifest.add_argument(
+        "--missing", action="store_true", help="Only list missing targets."
+    )
+    manifest.add_argument(
+        "--refresh", action="store_true", help="Check the file system first."
+    )
+    manifest.add_argument(
+        "--hash", action="store_true", help="Record content hashes on refresh."
+    )
+
+    power = subparsers.add_parser("power-scan", help="Sample KS statistics.")
+    power.add_argument("spectra_comp")
+    power.add_argument("spectra_null")
+    power.add_argument("--pair-densities", type=int, nargs="+", required=True)
+    power.add_argument("--max-distances", type=int, nargs="+", required=True)
+    power.add_argument("--k-max", type=int, required=True)
+    power.add_argument("--folded", action="store_true")
+    power.add_argument("--n-reps", type=int, required=True)
+    power.add_argument(
+        "--pair-scheme",
+        choices=["codon", "empirical", "learned"],
+        default="codon",
+        help="How pairs are weighted across windows (see twosfs.pairs).",
+    )
+    power.add_argument(
+        "--pair-source",
+        help="Sites file (empirical), or spectra or .npy pair counts (learned).",
+    )
+    power.add_argument("-o", "--output", required=True)
+    return parser
+
+
+def make_requests(args: argparse.Namespace) -> list[Request]:
+    """Make the jobs requested by parsed command line arguments."""
+    if args.command == "simulate":
+        requests = simulate_requests(args.config, args.model, args.reps)
+    elif args.command == "merge" and args.inputs:
+        if not args.output:
+            raise ValueError("merge needs --output when inputs are given.")
+        requests = iter([_request("add", inputs=args.inputs, output=args.output)])
+    elif args.command == "merge":
+        requests = merge_requests(args.config, args.model)
+    elif args.command == "fit":
+        requests = fit_requests(args.config, args.model)
+    elif args.command == "search-r":
+        if args.workers > 1 and args.search_workers > 1:
+            # Pool processes cannot start pools of their own.
+            raise ValueError("search-r --workers needs the global --workers 1.")
+        requests = search_requests(args.config, args.model, args.search_workers)
+    elif args.command == "simulate-grid":
+        requests = grid_requests(args.config, args.model)
+    elif args.command == "search-grid":
+        requests = grid_search_requests(args.config, args.model)
+    elif args.command == "build-from-sites":
+        requests = iter(
+            [
+                _request(
+                    "build_from_sites",
+                    sites_file=args.sites,
+                    allele_count_file=args.allele_counts,
+                    num_samples=args.num_samples,
+                    num_windows=args.num_windows,
+                    recombination_rate=args.recombination_rate,
+                    cov_cutoff=args.cov_cutoff,
+                    start=args.start,
+                    end=args.end,
+                    output=args.output,
+                )
+            ]
+        )
+    elif args.command == "pair-counts":
+        requests = iter(
+            [
+                _request(
+                    "pair_counts",
+                    sites_files=args.sites,
+                    num_windows=args.num_windows,
+                    output=args.output,
+                )
+            ]
+        )
+    elif args.command == "power-scan":
+        requests = iter(
+            [
+                _request(
+                    "power_scan",
+                    spectra_comp_file=args.spectra_comp,
+                    spectra_null_file=args.spectra_null,
+                    pair_densities=args.pair_densities,
+                    max_distances=args.max_distances,
+                    k_max=args.k_max,
+                    folded=args.folded,
+                    n_reps=args.n_reps,
+                    output=args.output,
+                    pair_scheme=args.pair_scheme,
+                    pair_source=args.pair_source,
+                )
+            ]
+        )
+    else:
+        raise ValueError(f"Unknown command {args.command}.")
+    return [r for r in requests if _keep(r, args.overwrite)]
+
+
+def run_batch(args: argparse.Namespace) -> None:
+    """Run the simulate-batch and consolidate commands."""
+    from twosfs.batch import merge_stores, parse_shard, simulate_batch
+
+    config = load_configuration(args.config)
+    if args.command == "simulate-batch":
+        shard, num_shards = parse_shard(args.shard)
+        output = args.output or os.path.join(
+            config.simulation_directory, "batch", f"shard={shard}-of-{num_shards}.hdf5"
+        )
+        if os.path.exists(output) and not args.overwrite:
+            print(f"{output} exists.")
+            return
+        store = simulate_batch(
+            config, shard, num_shards, args.workers, args.chunk_size, args.model
+        )
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        store.save(output)
+        print(f"Saved {sum(map(len, store.reps.values()))} reps to {output}.")
+    else:
+        store = merge_stores(args.stores)
+        if args.output:
+            store.save(args.output)
+        outputs = store.write_initial_spectra(config, args.model)
+        print(f"Wrote {len(outputs)} initial spectra files.")
+
+
+def list_manifest(args: argparse.Namespace) -> None:
+    """Run the manifest command."""
+    from twosfs.manifest import load_manifest
+
+    with load_manifest(load_configuration(args.config)) as manifest:
+        models = args.model or [None]
+        num_paths = 0
+        for model in models:
+            filters = {"model": model} if model else {}
+            if args.refresh:
+                manifest.refresh(args.kind, hash_contents=args.hash, **filters)
+            exists = False if args.missing else None
+            paths = manifest.paths(args.kind, exists, **filters)
+            num_paths += len(paths)
+            if args.list:
+                for path in paths:
+                    print(path)
+        if not args.list:
+            missing = "missing " if args.missing else ""
+            print(f"{num_paths} {missing}targets in {manifest.path}.")
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the twosfs command."""
+    args = make_parser().parse_args(argv)
+    if args.cache_dir:
+        os.environ[CACHE_DIR_VARIABLE] = args.cache_dir
+        os.environ[RESULT_CACHE_DIR_VARIABLE] = os.path.join(args.cache_dir, "results")
+    if args.memory_budget:
+        os.environ[MEMORY_BUDGET_VARIABLE] = args.memory_budget
+    if args.command == "manifest":
+        list_manifest(args)
+        return
+    if args.command in ("simulate-batch", "consolidate"):
+        run_batch(args)
+        return
+    requests = make_requests(args)
+    failed = 0
+    for response in run_requests(requests, args.workers, args.chunk_size, args.profile):
+        if not response["ok"]:
+            failed += 1
+            print(json.dumps(response), file=sys.stderr)
+    print(f"{len(requests) - failed} of {len(requests)} jobs succeeded.")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
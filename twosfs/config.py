@@ -2,7 +2,7 @@
 import json
 from dataclasses import dataclass, field
 from os import PathLike
-from typing import Any, Dict, Iterator, List, Union
+from typing import Any, Dict, Iterator, List, Optional, Union
 
 
 @dataclass
@@ -40,6 +40,16 @@ class Configuration:
     search_r_high: float
     search_iters: int
     search_num_replicates: int
+    # "golden" or "surrogate", see twosfs.statistics.search_recombination_rates
+    search_method: str = "golden"
+    search_batch_size: int = 1
+    # number of recombination rates of precomputed spectra grids
+    search_grid_size: int = 16
+    # weights of the pairs in each window of resampled spectra: "codon",
+    # "empirical" (source: a sites file) or "learned" (source: a spectra file or
+    # .npy pair counts), see twosfs.pairs.pair_weights
+    pair_scheme: str = "codon"
+    pair_source: Optional[str] = None
 
     def __post_init__(self):
         """Initialize filename templates."""
@@ -58,6 +68,17 @@ class Configuration:
             + "sequence_length={sequence_length}."
             + "rep={rep}.hdf5"
         )
+        self.spectra_grid_file = (
+            self.simulation_directory
+            + "/spectra_grids/model={model}.params={params}.folded={folded}."
+            + "sequence_length={sequence_length}.hdf5"
+        )
+        self.recombination_grid_search_file = (
+            self.simulation_directory
+            + "/recombination_grid_search/model={model}.params={params}."
+            + "folded={folded}.pair_density={pair_density}."
+            + "sequence_length={sequence_length}.rep={rep}.hdf5"
+        )
         self.tree_file = (
             self.simulation_directory
             + "/tree_files/model={model}.params={params}.rep={rep}.trees"
@@ -124,6 +145,25 @@ class Configuration:
             rep=rep,
         )
 
+    def format_recombination_grid_search_file(
+        self,
+        model: str,
+        params: dict,
+        folded: bool,
+        pair_density: int,
+        sequence_length: int,
+        rep: int,
+    ) -> str:
+        """Get a recombination grid search filename."""
+        return self.recombination_grid_search_file.format(
+            model=model,
+            params=make_parameter_string(params),
+            folded=folded,
+            pair_density=pair_density,
+            sequence_length=sequence_length,
+            rep=rep,
+        )
+
     def iter_demos(self) -> Iterator[tuple[str, dict, bool]]:
         """Return an iterator over all model-parameter-demography combinations."""
         for model, params in self.iter_models():
@@ -156,6 +196,13 @@ class Configuration:
             lambda x: self.format_recombination_search_file(*x), self.iter_rec_search()
         )
 
+    def recombination_grid_search_files(self) -> Iterator[str]:
+        """Iterate all recombination grid search files."""
+        return map(
+            lambda x: self.format_recombination_grid_search_file(*x),
+            self.iter_rec_search(),
+        )
+
 
 def configuration_from_json(config_file: Union[str, bytes, PathLike]):
     """Read a configuration from a json file."""
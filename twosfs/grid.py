@@ -0,0 +1,185 @@
+"""Recombination rate searches on a precomputed grid of simulated spectra.
+
+For a fixed demography, spectra are simulated once on a grid of scaled
+recombination rates. The 2SFS pdf at any rate in the range of the grid is then
+interpolated between grid points with a monotone cubic (PCHIP) spline per bin,
+so that searching for the rate that best fits a target takes no simulation.
+"""
+from typing import Optional, Union
+
+import attr
+import numpy as np
+
+from twosfs.spectra import Spectra, spectra_from_hdf5, spectra_to_hdf5
+from twosfs.statistics import (
+    batch_max_ks_distance,
+    reweight_and_symmetrize,
+    twosfs_pdf,
+)
+
+
+def _sorted_rates(instance, attribute, value):
+    if np.any(np.diff(value) <= 0):
+        raise ValueError(f"{attribute.name} must be strictly increasing.")
+
+
+def _matches_rates(instance, attribute, value):
+    if len(value) != len(instance.rates):
+        raise ValueError(f"{attribute.name} must have one Spectra per rate.")
+
+
+@attr.s(eq=False)
+class SpectraGrid(object):
+    """
+    Stores spectra simulated on a grid of scaled recombination rates.
+
+    Attributes
+    ----------
+    rates : ndarray
+        The scaled recombination rates, strictly increasing.
+    spectra : list[Spectra]
+        The spectra simulated at each rate.
+    """
+
+    rates: np.ndarray = attr.ib(
+        converter=lambda x: np.array(x, dtype=float), validator=_sorted_rates
+    )
+    spectra: list[Spectra] = attr.ib(converter=list, validator=_matches_rates)
+
+    def twosfs_pdfs(self, k_max: int, folded: bool) -> np.ndarray:
+        """Return the lumped 2SFS pdf at each rate, with rates on the first axis."""
+        return np.stack([twosfs_pdf(s, k_max, folded) for s in self.spectra])
+
+    def save(self, output_file) -> None:
+        """Save the grid to an hdf5 file."""
+        import h5py
+
+        with h5py.File(output_file, "w") as f:
+            f.create_dataset("rates", data=self.rates)
+            for i, spectra in enumerate(self.spectra):
+                spectra_to_hdf5(spectra, f, f"spectra_{i}")
+
+
+def load_spectra_grid(input_file) -> SpectraGrid:
+    """Read a SpectraGrid from an hdf5 file created by SpectraGrid.save()."""
+    import h5py
+
+    with h5py.File(input_file, "r") as f:
+        rates = f["rates"][()]
+        spectra = [spectra_from_hdf5(f[f"spectra_{i}"]) for i in range(len(rates))]
+    return SpectraGrid(rates, spectra)
+
+
+def simulate_spectra_grid(
+    rates,
+    model: str,
+    model_parameters: dict,
+    msprime_parameters: dict,
+    random_seed: Union[int, np.random.Generator],
+) -> SpectraGrid:
+    """Simulate spectra at each of the scaled recombination rates."""
+    from twosfs.simulations import simulate_spectra
+
+    rng = np.random.default_rng(random_seed)
+    return SpectraGrid(
+        rates,
+        [
+            simulate_spectra(
+                model=model,
+                model_parameters=model_parameters,
+                msprime_parameters=msprime_parameters,
+                scaled_recombination_rate=r,
+                random_seed=rng,
+            )
+            for r in rates
+        ],
+    )
+
+
+def interpolate_pdfs(rates: np.ndarray, pdfs: np.ndarray, new_rates) -> np.ndarray:
+    """Interpolate pdfs along their first axis from rates to new_rates.
+
+    Each bin is interpolated by a monotone cubic spline, which does not overshoot
+    between grid points. Interpolated pdfs are clipped at zero and renormalized.
+    """
+    from scipy.interpolate import PchipInterpolator
+
+    interp = PchipInterpolator(rates, pdfs, axis=0, extrapolate=False)
+    new_pdfs = np.clip(interp(np.asarray(new_rates, dtype=float)), 0, None)
+    axes = tuple(range(1, pdfs.ndim))
+    return new_pdfs / np.sum(new_pdfs, axis=axes, keepdims=True)
+
+
+def grid_ks_distances(
+    spectra: Spectra,
+    grid: SpectraGrid,
+    k_max: int,
+    folded: bool,
+    rates,
+    chunk_size: int = 100,
+) -> np.ndarray:
+    """Compute the KS distance of spectra to the interpolated grid at rates.
+
+    The distances are the same as those of `spectra_ks_distance` with simulated
+    spectra, but with the interpolated pdfs of the grid.
+    """
+    rates = np.asarray(rates, dtype=float)
+    grid_pdfs = grid.twosfs_pdfs(k_max, folded)
+    target = reweight_and_symmetrize(
+        twosfs_pdf(spectra, k_max, folded)[: grid_pdfs.shape[1]], spectra.num_pairs
+    )
+    distances = []
+    for start in range(0, len(rates), chunk_size):
+        pdfs = interpolate_pdfs(
+            grid.rates, grid_pdfs, rates[start : start + chunk_size]
+        )
+        pdfs = reweight_and_symmetrize(pdfs, spectra.num_pairs)
+        distances.append(batch_max_ks_distance(pdfs, target))
+    return np.concatenate(distances)
+
+
+def grid_search_recombination_rate(
+    spectra: Spectra,
+    grid: SpectraGrid,
+    k_max: int,
+    folded: bool,
+    r_low: Optional[float] = None,
+    r_high: Optional[float] = None,
+    num_points: int = 1001,
+) -> tuple[float, float, np.ndarray, np.ndarray]:
+    """Find the rate that minimizes the KS distance to the interpolated grid.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The target spectra.
+    grid : SpectraGrid
+        Spectra simulated under the demography to fit.
+    k_max : int
+        The maximum allele count of the lumped 2SFS.
+    folded : bool
+        If True, compare folded 2SFS.
+    r_low, r_high : float, optional
+        The range of rates to search. Defaults to the range of the grid.
+    num_points : int
+        The number of evenly spaced rates at which the KS distance is computed.
+
+    Returns
+    -------
+    r : float
+        The rate with the smallest KS distance.
+    ks : float
+        The KS distance at r.
+    rates : ndarray
+        The searched rates.
+    ks_distances : ndarray
+        The KS distance at each of rates.
+    """
+    r_low = grid.rates[0] if r_low is None else r_low
+    r_high = grid.rates[-1] if r_high is None else r_high
+    if r_low < grid.rates[0] or r_high > grid.rates[-1]:
+        raise ValueError("The search range must be within the range of the grid.")
+    rates = np.linspace(r_low, r_high, num_points)
+    ks_distances = grid_ks_distances(spectra, grid, k_max, folded, rates)
+    i = np.argmin(ks_distances)
+    return float(rates[i]), float(ks_distances[i]), rates, ks_distances
@@ -0,0 +1,194 @@
+"""Opt-in timing of the hot paths of twosfs.
+
+Functions decorated with `instrumented` record their number of calls and
+their total and self time (total minus the time of nested instrumented calls)
+while instrumentation is on. Optionally, they also record the peak of the
+memory traced by tracemalloc during each call, above the memory traced when it
+started. When instrumentation is off, a
+decorated function costs one extra function call and a global lookup.
+
+Instrumentation is turned on by the `instrumentation` context manager::
+
+    with instrumentation("timings.json") as recorder:
+        search_recombination_rates(...)
+
+or, for workflow jobs, by setting the environment variable TWOSFS_INSTRUMENT to
+"1" (timings) or "memory" (timings and allocations). Each job then writes
+`{output}.timings.json` next to its output.
+"""
+import functools
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+
+# Environment variable that turns on instrumentation of workflow jobs.
+INSTRUMENT_VARIABLE = "TWOSFS_INSTRUMENT"
+
+T = TypeVar("T")
+
+_recorder: Optional["Recorder"] = None
+
+
+class Recorder(object):
+    """
+    Accumulates the calls, times and allocations of instrumented functions.
+
+    Parameters
+    ----------
+    memory : bool
+        If True, also record the bytes allocated by each call: the peak traced
+        memory during the call minus the traced memory when it started. Temporaries
+        freed before the call returns count. "bytes_allocated" is the sum over calls
+        and "peak_bytes" the maximum.
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.stats: dict[str, dict[str, float]] = {}
+        # The time spent in nested instrumented calls of each active call.
+        self._child_times: list[float] = []
+        # The peak traced memory of each active call, before its last nested call.
+        self._peaks: list[int] = []
+        self.start = time.perf_counter()
+        self.wall_time = 0.0
+
+    def _record(self, name: str, elapsed: float, child_time: float, nbytes: int):
+        stats = self.stats.setdefault(
+            name, {"calls": 0, "total_time": 0.0, "self_time": 0.0}
+        )
+        stats["calls"] += 1
+        stats["total_time"] += elapsed
+        stats["self_time"] += elapsed - child_time
+        if self.memory:
+            stats["bytes_allocated"] = stats.get("bytes_allocated", 0) + nbytes
+            stats["peak_bytes"] = max(stats.get("peak_bytes", 0), nbytes)
+        if self._child_times:
+            self._child_times[-1] += elapsed
+
+    def call(self, name: str, func: Callable[..., T], *args, **kwargs) -> T:
+        """Call func and record it under name."""
+        self._child_times.append(0.0)
+        if self.memory:
+            before, peak = tracemalloc.get_traced_memory()
+            # Resetting the peak hides it from the active calls, so save it.
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            self._peaks.append(before)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            nbytes = 0
+            if self.memory:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                nbytes = peak - before
+            self._record(name, elapsed, self._child_times.pop(), nbytes)
+
+    def iterate(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Iterate over iterable, recording each step under name."""
+        iterator = iter(iterable)
+        while True:
+            try:
+                yield self.call(name, next, iterator)
+            except StopIteration:
+                return
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return the recorded statistics, with the mean time per call."""
+        functions = {}
+        for name, stats in sorted(self.stats.items()):
+            functions[name] = dict(
+                stats, mean_time=stats["total_time"] / stats["calls"]
+            )
+        return {"wall_time": self.wall_time, "functions": functions}
+
+    def save(self, output_file: str) -> None:
+        """Write the recorded statistics to a JSON file."""
+        with open(output_file, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def instrumented(func: Optional[Callable] = None, *, name: Optional[str] = None):
+    """Record calls of func while instrumentation is on.
+
+    The default name is the module (without the package) and qualified name of
+    func, e.g. "spectra.add_spectra". May be used with or without arguments.
+    """
+
+    def decorate(func):
+        label = name or f"{func.__module__.split('.')[-1]}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return func(*args, **kwargs)
+            return recorder.call(label, func, *args, **kwargs)
+
+        return wrapper
+
+    return decorate(func) if func is not None else decorate
+
+
+def instrumented_iter(name: str, iterable: Iterable[T]) -> Iterable[T]:
+    """Record each step of iterable under name while instrumentation is on.
+
+    Use this for lazy iterators whose items are expensive to produce, such as
+    the tree sequences of msprime.sim_ancestry.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return iterable
+    return recorder.iterate(name, iterable)
+
+
+@contextmanager
+def instrumentation(
+    output_file: Optional[str] = None, memory: bool = False
+) -> Iterator[Recorder]:
+    """Turn on instrumentation within the context.
+
+    Parameters
+    ----------
+    output_file : str, optional
+        If given, write the statistics as JSON to this file on exit.
+    memory : bool
+        If True, trace allocations with tracemalloc, which slows down the code.
+    """
+    global _recorder
+    previous = _recorder
+    recorder = Recorder(memory)
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+        recorder.wall_time = time.perf_counter() - recorder.start
+        if started_tracing:
+            tracemalloc.stop()
+        if output_file is not None:
+            recorder.save(output_file)
+
+
+def instrumentation_from_environment(output: str):
+    """Return the instrumentation requested by TWOSFS_INSTRUMENT for a job.
+
+    Statistics are written to `{output}.timings.json`. If the variable is not set,
+    return a context that does nothing.
+    """
+    from contextlib import nullcontext
+
+    mode = os.environ.get(INSTRUMENT_VARIABLE)
+    if not mode:
+        return nullcontext()
+    return instrumentation(f"{output}.timings.json", memory=mode == "memory")
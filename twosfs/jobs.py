@@ -0,0 +1,319 @@
+"""Workflow jobs that read their inputs from files and write their outputs to files.
+
+Each job corresponds to a rule of the Snakemake workflow. The jobs take only
+strings, numbers and booleans, so that they can be submitted as JSON.
+"""
+import json
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Union
+
+from twosfs.config import (
+    Configuration,
+    configuration_from_json,
+    parse_parameter_string,
+)
+from twosfs.spectra import Spectra, add_spectra, load_spectra, spectra_to_hdf5
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+@lru_cache(maxsize=None)
+def _load_configuration(config_file: str, mtime: float) -> Configuration:
+    return configuration_from_json(config_file)
+
+
+def load_configuration(config_file: str) -> Configuration:
+    """Read a configuration from a json file, reusing it until the file changes."""
+    return _load_configuration(config_file, os.path.getmtime(config_file))
+
+
+# A Spectra can take gigabytes, and the memory budget does not account for
+# cached ones, so only the two inputs of a power scan are kept.
+@lru_cache(maxsize=2)
+def _load_spectra(input_file: str, mtime: float) -> Spectra:
+    return load_spectra(input_file)
+
+
+def load_spectra_cached(input_file: str) -> Spectra:
+    """Read a Spectra from an hdf5 file, reusing it until the file changes.
+
+    Only the two most recently used files are kept. The returned Spectra is
+    shared between calls and must not be modified.
+    """
+    return _load_spectra(input_file, os.path.getmtime(input_file))
+
+
+def _parameters(params: Union[str, dict]) -> dict:
+    if isinstance(params, str):
+        return parse_parameter_string(params)
+    return params
+
+
+def simulate_initial_spectra(
+    config_file: str, model: str, params: Union[str, dict], output: str
+) -> None:
+    """Simulate spectra for a model and save them to output."""
+    from twosfs.simulations import filename2seed, simulate_spectra
+
+    config = load_configuration(config_file)
+    spectra = simulate_spectra(
+        model=model,
+        model_parameters=_parameters(params),
+        msprime_parameters=config.msprime_parameters,
+        scaled_recombination_rate=config.scaled_recombination_rate,
+        random_seed=filename2seed(output),
+    )
+    spectra.save(output)
+
+
+def add_spectra_files(inputs: list[str], output: str) -> None:
+    """Add the spectra saved in inputs and save the total to output."""
+    total = add_spectra(load_spectra(infn) for infn in inputs)
+    total.save(output)
+
+
+def fit_demography(config_file: str, input: str, folded: bool, output: str) -> None:
+    """Fit a piecewise constant demography to saved spectra."""
+    config = load_configuration(config_file)
+    spectra = load_spectra_cached(input)
+    fit = spectra.fit_pwc_demography(
+        folded=folded,
+        k_max=config.k_max,
+        num_epochs=config.num_epochs,
+        penalty_coef=config.penalty_coef,
+    )
+    with open(output, "w") as f:
+        f.write(fit.toJson())
+
+
+def _sample_target(
+    config: Configuration,
+    spectra_file: str,
+    pair_density: int,
+    sequence_length: int,
+    rng: "np.random.Generator",
+) -> Spectra:
+    from twosfs.pairs import pair_weights
+    from twosfs.statistics import sample_spectra
+
+    raw_spectra = load_spectra_cached(spectra_file)
+    num_pairs = int(pair_density) * pair_weights(
+        raw_spectra.windows,
+        int(sequence_length),
+        config.pair_scheme,
+        config.pair_source,
+    )
+    return sample_spectra(raw_spectra, num_pairs=num_pairs, rng=rng)
+
+
+def _search_msprime_parameters(config: Configuration, sequence_length: int) -> dict:
+    return config.msprime_parameters | {
+        "sequence_length": int(sequence_length),
+        "num_replicates": config.search_num_replicates,
+    }
+
+
+def search_recombination_rate(
+    config_file: str,
+    spectra_file: str,
+    demo_file: str,
+    folded: bool,
+    pair_density: int,
+    sequence_length: int,
+    output: str,
+    workers: int = 1,
+) -> None:
+    """Resample spectra and search for the best-fitting recombination rate.
+
+    With the surrogate search method, workers processes simulate each batch.
+    """
+    import numpy as np
+
+    from twosfs.simulations import filename2seed
+    from twosfs.statistics import search_recombination_rates_save
+
+    config = load_configuration(config_file)
+    rng = np.random.default_rng(filename2seed(output))
+    spectra_samp = _sample_target(
+        config, spectra_file, pair_density, sequence_length, rng
+    )
+    with open(demo_file) as f:
+        model_parameters = json.load(f)
+    sim_kwargs = dict(
+        model="pwc",
+        model_parameters=model_parameters,
+        msprime_parameters=_search_msprime_parameters(config, sequence_length),
+        random_seed=rng,
+    )
+    search_recombination_rates_save(
+        output,
+        spectra_samp,
+        config.k_max,
+        folded,
+        sim_kwargs,
+        config.search_r_low,
+        config.search_r_high,
+        config.search_iters,
+        method=config.search_method,
+        batch_size=config.search_batch_size,
+        workers=workers,
+    )
+
+
+def simulate_grid(
+    config_file: str, demo_file: str, sequence_length: int, output: str
+) -> None:
+    """Simulate spectra of a fitted demography on the grid of search rates."""
+    import numpy as np
+
+    from twosfs.grid import simulate_spectra_grid
+    from twosfs.simulations import filename2seed
+
+    config = load_configuration(config_file)
+    with open(demo_file) as f:
+        model_parameters = json.load(f)
+    grid = simulate_spectra_grid(
+        np.linspace(config.search_r_low, config.search_r_high, config.search_grid_size),
+        "pwc",
+        model_parameters,
+        _search_msprime_parameters(config, sequence_length),
+        filename2seed(output),
+    )
+    grid.save(output)
+
+
+def search_recombination_rate_grid(
+    config_file: str,
+    spectra_file: str,
+    grid_file: str,
+    folded: bool,
+    pair_density: int,
+    sequence_length: int,
+    output: str,
+) -> None:
+    """Resample spectra and search for the best rate on a spectra grid."""
+    import h5py
+    import numpy as np
+
+    from twosfs.grid import grid_search_recombination_rate, load_spectra_grid
+    from twosfs.simulations import filename2seed
+
+    config = load_configuration(config_file)
+    rng = np.random.default_rng(filename2seed(output))
+    spectra_samp = _sample_target(
+        config, spectra_file, pair_density, sequence_length, rng
+    )
+    r, ks, rates, ks_distances = grid_search_recombination_rate(
+        spectra_samp, load_spectra_grid(grid_file), config.k_max, folded
+    )
+    with h5py.File(output, "w") as f:
+        spectra_to_hdf5(spectra_samp, f, "spectra_target")
+        f.attrs["recombination_rate"] = r
+        f.attrs["ks_distance"] = ks
+        f.create_dataset("rates", data=rates)
+        f.create_dataset("ks_distances", data=ks_distances)
+
+
+def spectra_from_sites_files(
+    sites_file: str,
+    allele_count_file: str,
+    num_samples: int,
+    num_windows: int,
+    recombination_rate: float,
+    cov_cutoff: int,
+    start: float,
+    end: float,
+    output: str,
+) -> None:
+    """Build spectra from the allele counts at the sites in [start, end)."""
+    import gzip
+
+    import numpy as np
+
+    from twosfs.data import get_allele_counts_at_sites
+    from twosfs.spectra import spectra_from_sites
+
+    sites = np.loadtxt(sites_file, dtype=int)
+    central_sites = sites[(sites >= start) & (sites < end)]
+    with gzip.open(allele_count_file) as infile:
+        mac_dict = get_allele_counts_at_sites(infile, central_sites, cov_cutoff)
+    spectra = spectra_from_sites(
+        num_samples, np.arange(num_windows), recombination_rate, mac_dict
+    )
+    spectra.save(output)
+
+
+def pair_counts_from_sites_files(
+    sites_files: list[str], num_windows: int, output: str
+) -> None:
+    """Count the pairs of sites in each window, with one sites file per chromosome.
+
+    The counts are those of build_from_sites with the same num_windows, written to
+    output as a .npy array for the num_pairs of resampling or a learned pair source.
+    """
+    import numpy as np
+
+    from twosfs.pairs import num_pairs_from_positions
+
+    positions = [np.loadtxt(f, dtype=np.int64, ndmin=1) for f in sites_files]
+    chromosomes = np.repeat(np.arange(len(positions)), [len(p) for p in positions])
+    num_pairs = num_pairs_from_positions(
+        np.concatenate(positions), np.arange(num_windows), chromosomes
+    )
+    with open(output, "wb") as f:
+        np.save(f, num_pairs)
+
+
+def power_scan(
+    spectra_comp_file: str,
+    spectra_null_file: str,
+    pair_densities: list[int],
+    max_distances: list[int],
+    k_max: int,
+    folded: bool,
+    n_reps: int,
+    output: str,
+    pair_scheme: str = "codon",
+    pair_source: Optional[str] = None,
+) -> None:
+    """Sample KS statistics over pair densities and max distances.
+
+    Write one JSON object per parameter combination to output.
+    """
+    import numpy as np
+
+    from twosfs.simulations import filename2seed
+    from twosfs.statistics import scan_parameters
+
+    rng = np.random.default_rng(filename2seed(output))
+    results = scan_parameters(
+        load_spectra_cached(spectra_comp_file),
+        load_spectra_cached(spectra_null_file),
+        pair_densities,
+        max_distances,
+        k_max,
+        folded,
+        n_reps,
+        rng,
+        pair_scheme=pair_scheme,
+        pair_source=pair_source,
+    )
+    with open(output, "w") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+
+# Job names used by the worker protocol and the command line interface.
+JOBS = {
+    "simulate": simulate_initial_spectra,
+    "add": add_spectra_files,
+    "fit": fit_demography,
+    "search_recombination": search_recombination_rate,
+    "simulate_grid": simulate_grid,
+    "search_recombination_grid": search_recombination_rate_grid,
+    "build_from_sites": spectra_from_sites_files,
+    "pair_counts": pair_counts_from_sites_files,
+    "power_scan": power_scan,
+}
@@ -0,0 +1,315 @@
+"""An index of the output files of a Configuration.
+
+Enumerating `Configuration.recombination_search_files()` formats every
+combination of models, demographies, densities, lengths and reps. A Manifest
+does this once, stores one row per target in an sqlite database, and only
+re-enumerates when the configuration changes. Queries such as "missing search
+files for model=beta" are then indexed lookups.
+
+Each row records whether the file exists, its size and mtime, and optionally a
+hash of its contents. `Manifest.refresh` only re-hashes files whose size or
+mtime changed.
+
+Workflows build the manifest once, with `twosfs manifest`, and read it with
+`target_paths`, which opens it read-only so that concurrent jobs never write to
+the database, which is unsafe on shared file systems such as NFS. Without an
+up-to-date manifest, `target_paths` enumerates the configuration instead.
+"""
+import dataclasses
+import os
+import sqlite3
+from hashlib import blake2b
+from typing import Any, Iterator, Optional
+from urllib.parse import quote
+
+from twosfs.cache import canonical_hash
+from twosfs.config import Configuration, make_parameter_string
+
+# The kinds of targets and the wildcards of their file names.
+KINDS = (
+    "initial_spectra",
+    "fitted_demography",
+    "recombination_search",
+    "spectra_grid",
+    "recombination_grid_search",
+)
+COLUMNS = ("model", "params", "folded", "pair_density", "sequence_length", "rep")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS targets (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    model TEXT NOT NULL,
+    params TEXT NOT NULL,
+    folded INTEGER,
+    pair_density INTEGER,
+    sequence_length INTEGER,
+    rep INTEGER,
+    exists_ INTEGER NOT NULL DEFAULT 0,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS targets_kind_model ON targets (kind, model, exists_);
+"""
+
+Target = tuple[str, str, dict[str, Any]]
+
+
+def iter_targets(config: Configuration) -> Iterator[Target]:
+    """Iterate over (path, kind, wildcards) of every target of config.
+
+    The paths are the same as those of `Configuration.initial_spectra_files`,
+    `fitted_demography_files`, `recombination_search_files` and
+    `recombination_grid_search_files`, plus the spectra grids of the latter.
+    """
+    for model, params in config.iter_models():
+        params_str = make_parameter_string(params)
+        wildcards = dict(model=model, params=params_str)
+        path = config.initial_spectra_file.format(rep="all", **wildcards)
+        yield path, "initial_spectra", wildcards
+        for folded in [True, False]:
+            demo = dict(wildcards, folded=folded)
+            yield config.fitted_demography_file.format(
+                **demo
+            ), "fitted_demography", demo
+            for length in config.power_sequence_lengths:
+                grid = dict(demo, sequence_length=length)
+                yield config.spectra_grid_file.format(**grid), "spectra_grid", grid
+            for density in config.power_pair_densities:
+                for length in config.power_sequence_lengths:
+                    search = dict(demo, pair_density=density, sequence_length=length)
+                    for rep in range(config.power_reps):
+                        rep_search = dict(search, rep=rep)
+                        yield config.recombination_search_file.format(
+                            **rep_search
+                        ), "recombination_search", rep_search
+                        yield config.recombination_grid_search_file.format(
+                            **rep_search
+                        ), "recombination_grid_search", rep_search
+
+
+def _config_hash(config: Configuration) -> str:
+    return canonical_hash(dataclasses.asdict(config))
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash the contents of a file."""
+    h = blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest(object):
+    """
+    An sqlite index of the targets of a Configuration.
+
+    Parameters
+    ----------
+    path : str
+        The location of the database. It is created if it does not exist.
+    read_only : bool
+        If True, open an existing database without locking it. It must not be
+        modified while it is open, and `build` and `refresh` fail.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        if read_only:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No manifest at {path}.")
+            uri = f"file:{quote(os.path.abspath(path))}?mode=ro&immutable=1"
+            self.connection = sqlite3.connect(uri, uri=True)
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self) -> "Manifest":
+        """Return the manifest."""
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Close the database."""
+        self.close()
+
+    def close(self) -> None:
+        """Close the database."""
+        self.connection.close()
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def indexes(self, config: Configuration) -> bool:
+        """Check whether the targets of config are indexed."""
+        return self._meta("config_hash") == _config_hash(config)
+
+    def build(self, config: Configuration) -> bool:
+        """Index the targets of config, unless they are already indexed.
+
+        Rows of targets that config still has keep their status. Return True if
+        the targets were re-enumerated.
+        """
+        if self.indexes(config):
+            return False
+        config_hash = _config_hash(config)
+        rows = [
+            (path, kind) + tuple(wildcards.get(c) for c in COLUMNS)
+            for path, kind, wildcards in iter_targets(config)
+        ]
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE new (path TEXT PRIMARY KEY)")
+            self.connection.executemany(
+                "INSERT INTO new VALUES (?)", ((row[0],) for row in rows)
+            )
+            self.connection.execute(
+                "DELETE FROM targets WHERE path NOT IN (SELECT path FROM new)"
+            )
+            self.connection.execute("DROP TABLE new")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO targets (path, kind, "
+                + ", ".join(COLUMNS)
+                + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('config_hash', ?)", (config_hash,)
+            )
+        return True
+
+    def _where(self, kind: Optional[str], filters: dict[str, Any]) -> tuple[str, list]:
+        clauses, values = [], []
+        if kind is not None:
+            if kind not in KINDS:
+                raise ValueError(f"kind must be one of {KINDS}.")
+            clauses.append("kind = ?")
+            values.append(kind)
+        for column, value in filters.items():
+            if column not in COLUMNS:
+                raise ValueError(f"Can only filter by {COLUMNS}, not {column}.")
+            if column == "params" and isinstance(value, dict):
+                value = make_parameter_string(value)
+            clauses.append(f"{column} = ?")
+            values.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), values
+
+    def paths(
+        self, kind: Optional[str] = None, exists: Optional[bool] = None, **filters
+    ) -> list[str]:
+        """Return the paths of targets, in the order they were indexed.
+
+        Parameters
+        ----------
+        kind : str, optional
+            One of KINDS. Default: all kinds.
+        exists : bool, optional
+            If given, only return targets that exist (True) or are missing (False),
+            according to the last refresh.
+        **filters
+            Values of the columns in COLUMNS, e.g. `model="beta"`.
+        """
+        where, values = self._where(kind, filters)
+        if exists is not None:
+            where += (" AND " if where else " WHERE ") + "exists_ = ?"
+            values.append(int(exists))
+        query = f"SELECT path FROM targets{where} ORDER BY rowid"
+        return [row[0] for row in self.connection.execute(query, values)]
+
+    def missing(self, kind: Optional[str] = None, **filters) -> list[str]:
+        """Return the paths of targets that were missing at the last refresh."""
+        return self.paths(kind, exists=False, **filters)
+
+    def refresh(
+        self, kind: Optional[str] = None, hash_contents: bool = False, **filters
+    ) -> int:
+        """Update the status of targets from the file system.
+
+        Only targets whose size or mtime changed are updated (and re-hashed if
+        hash_contents). Return the number of updated targets.
+        """
+        where, values = self._where(kind, filters)
+        query = f"SELECT path, exists_, size, mtime, hash FROM targets{where}"
+        updates = []
+        for path, exists, size, mtime, hash_ in self.connection.execute(query, values):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if exists:
+                    updates.append((0, None, None, None, path))
+                continue
+            changed = not exists or (stat.st_size, stat.st_mtime) != (size, mtime)
+            if hash_contents and (changed or hash_ is None):
+                updates.append((1, stat.st_size, stat.st_mtime, file_hash(path), path))
+            elif changed:
+                updates.append((1, stat.st_size, stat.st_mtime, None, path))
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE targets SET exists_ = ?, size = ?, mtime = ?, hash = ? "
+                "WHERE path = ?",
+                updates,
+            )
+        return len(updates)
+
+    def hashes(self, kind: Optional[str] = None, **filters) -> dict[str, str]:
+        """Return the content hashes recorded for targets by `refresh`."""
+        where, values = self._where(kind, filters)
+        where += (" AND " if where else " WHERE ") + "hash IS NOT NULL"
+        query = f"SELECT path, hash FROM targets{where}"
+        return dict(self.connection.execute(query, values).fetchall())
+
+
+def manifest_path(config: Configuration) -> str:
+    """Get the default location of the manifest of config."""
+    return os.path.join(config.simulation_directory, "manifest.sqlite")
+
+
+def load_manifest(config: Configuration, path: Optional[str] = None) -> Manifest:
+    """Open the manifest of config, indexing its targets if needed."""
+    manifest = Manifest(path or manifest_path(config))
+    manifest.build(config)
+    return manifest
+
+
+def open_manifest(config: Configuration, path: Optional[str] = None) -> Manifest:
+    """Open the manifest of config read-only.
+
+    Raise FileNotFoundError or ValueError if it has not been built for config,
+    e.g. by `twosfs manifest`.
+    """
+    path = path or manifest_path(config)
+    try:
+        manifest = Manifest(path, read_only=True)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"No manifest at {path}. Run `twosfs manifest`.")
+    if not manifest.indexes(config):
+        manifest.close()
+        raise ValueError(
+            f"The manifest at {path} is out of date. Run `twosfs manifest`."
+        )
+    return manifest
+
+
+def target_paths(
+    config: Configuration, kind: str, path: Optional[str] = None
+) -> list[str]:
+    """List the targets of kind of config.
+
+    They are read from the manifest of config if it is up to date, and enumerated
+    from config otherwise, so that a missing or stale manifest only costs time.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {KINDS}.")
+    try:
+        manifest = open_manifest(config, path)
+    except (FileNotFoundError, ValueError):
+        return [target for target, k, _ in iter_targets(config) if k == kind]
+    with manifest:
+        return manifest.paths(kind)
@@ -0,0 +1,171 @@
+"""Memory footprints of Spectra operations and an optional memory budget.
+
+`operation_nbytes` estimates the peak bytes that an operation allocates beyond
+its inputs, from the shapes of the spectra alone, so that jobs can be planned
+before they run::
+
+    >>> operation_nbytes("normalize", num_samples=1000, num_windows=100)
+    3206403200
+
+A memory budget is set with the `memory_budget` context manager or the
+environment variable TWOSFS_MEMORY_BUDGET, in bytes or with a K, M or G suffix
+(e.g. "800M"). Under a budget, `Spectra.normalized_twosfs` processes windows
+and `sample_ks_statistics` processes replicates in chunks that fit it, and
+loading a Spectra that cannot fit raises a MemoryError before reading it.
+"""
+import os
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
+
+# Environment variable holding the default memory budget.
+MEMORY_BUDGET_VARIABLE = "TWOSFS_MEMORY_BUDGET"
+
+# Bytes per element of the float arrays of a Spectra.
+ITEMSIZE = 8
+
+# Peak number of 2SFS-sized temporaries, measured with tracemalloc.
+# Normalizing: the normalized 2SFS, its fold and its lumped copy.
+NORMALIZE_COPIES = 3
+# Resampling: the resampled counts and pdfs, symmetrized pdfs and their CDFs.
+RESAMPLE_COPIES = 13
+
+OPERATIONS = ("load", "save", "normalize", "fold", "lump", "resample")
+
+_SUFFIXES = {"K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+
+_budget: Optional[int] = None
+
+
+def parse_size(size: Union[int, float, str]) -> int:
+    """Convert a number of bytes with an optional K, M, G or T suffix to int."""
+    if not isinstance(size, str):
+        return int(size)
+    size = size.strip().upper().removesuffix("B")
+    if size and size[-1] in _SUFFIXES:
+        return int(float(size[:-1]) * _SUFFIXES[size[-1]])
+    return int(float(size))
+
+
+def twosfs_nbytes(num_samples: int, num_windows: int) -> int:
+    """Return the bytes of a 2SFS array with num_samples + 1 bins per axis."""
+    return num_windows * (num_samples + 1) ** 2 * ITEMSIZE
+
+
+def spectra_nbytes(num_samples: int, num_windows: int) -> int:
+    """Return the bytes of the arrays of a Spectra."""
+    return (
+        twosfs_nbytes(num_samples, num_windows)
+        + (num_samples + 1) * ITEMSIZE
+        + (2 * num_windows + 1) * ITEMSIZE
+    )
+
+
+def operation_nbytes(
+    operation: str,
+    num_samples: int,
+    num_windows: int,
+    k_max: Optional[int] = None,
+    num_replicates: int = 1,
+) -> int:
+    """Estimate the peak bytes that an operation on a Spectra allocates.
+
+    Parameters
+    ----------
+    operation : str
+        One of "load", "save", "normalize" (`Spectra.normalized_twosfs`), "fold"
+        (`foldtwosfs`), "lump" (`lump_twosfs`) or "resample" (one chunk of
+        `sample_ks_statistics`).
+    num_samples : int
+        The sample size of the Spectra.
+    num_windows : int
+        The number of windows of the Spectra.
+    k_max : int, optional
+        The maximum allele count after lumping. Defaults to num_samples.
+    num_replicates : int
+        With "resample", the number of replicates resampled at once.
+
+    Returns
+    -------
+    int
+        The estimated bytes, excluding those of the input Spectra. Loading
+        allocates the Spectra itself. Saving to hdf5 or npz writes the arrays
+        without copying them.
+    """
+    if k_max is None:
+        k_max = num_samples
+    full = twosfs_nbytes(num_samples, num_windows)
+    lumped = twosfs_nbytes(k_max, num_windows)
+    if operation == "load":
+        return spectra_nbytes(num_samples, num_windows)
+    elif operation == "save":
+        return 0
+    elif operation == "normalize":
+        return NORMALIZE_COPIES * full + lumped
+    elif operation == "fold":
+        return full
+    elif operation == "lump":
+        return lumped
+    elif operation == "resample":
+        return RESAMPLE_COPIES * num_replicates * twosfs_nbytes(k_max - 1, num_windows)
+    else:
+        raise ValueError(f"operation must be one of {', '.join(OPERATIONS)}.")
+
+
+def get_memory_budget() -> Optional[int]:
+    """Return the current memory budget in bytes, or None if there is none."""
+    if _budget is not None:
+        return _budget
+    size = os.environ.get(MEMORY_BUDGET_VARIABLE)
+    return parse_size(size) if size else None
+
+
+@contextmanager
+def memory_budget(size: Union[int, str, None]) -> Iterator[Optional[int]]:
+    """Set the memory budget within the context. None defers to the environment."""
+    global _budget
+    previous = _budget
+    _budget = None if size is None else parse_size(size)
+    try:
+        yield get_memory_budget()
+    finally:
+        _budget = previous
+
+
+def check_budget(nbytes: int, operation: str) -> None:
+    """Raise MemoryError if nbytes exceeds the memory budget."""
+    budget = get_memory_budget()
+    if budget is not None and nbytes > budget:
+        raise MemoryError(
+            f"{operation} needs about {nbytes} bytes, "
+            f"more than the memory budget of {budget} bytes."
+        )
+
+
+def chunk_length(
+    num_items: int, item_nbytes: int, operation: str, fixed_nbytes: int = 0
+) -> int:
+    """Return how many items to process at once to stay within the memory budget.
+
+    Without a budget, all items are processed at once.
+
+    Parameters
+    ----------
+    num_items : int
+        The number of items to process.
+    item_nbytes : int
+        The bytes allocated per item processed at once.
+    operation : str
+        The name of the operation, for the error message.
+    fixed_nbytes : int
+        The bytes allocated however the items are chunked, e.g. the output.
+
+    Raises
+    ------
+    MemoryError
+        If not even one item at a time fits in the budget.
+    """
+    budget = get_memory_budget()
+    if budget is None or fixed_nbytes + num_items * item_nbytes <= budget:
+        return max(num_items, 1)
+    check_budget(fixed_nbytes + item_nbytes, operation)
+    return max(int((budget - fixed_nbytes) // item_nbytes), 1)
@@ -0,0 +1,305 @@
+"""Weights of the pairs of sites in each window of the 2SFS.
+
+Resampling a 2SFS needs the number of pairs of sites in each window. It is
+pair_density * pair_weights(...), where the weights of a window are built from
+counts of pairs at each distance, summed over the integer distances in the
+window (from windows[i] up to but excluding windows[i + 1]) that are at most
+max_distance. The schemes are:
+
+codon
+    One pair at each distance that is a positive multiple of stride (default 3,
+    the distances between 4-fold degenerate sites of consecutive codons).
+empirical
+    The numbers of pairs of sites at each distance in a list of site positions,
+    e.g. a sites file.
+learned
+    The num_pairs of a Spectra built from real data, such as DPGP3, spread evenly
+    over the distances of its windows.
+
+The num_pairs of real data can be counted from its site positions alone with
+`num_pairs_from_positions`, without building the 2SFS, and saved with the
+pair_counts job for use as a learned source or as the num_pairs of
+`sample_spectra`.
+
+Empirical and learned weights are scaled to sum to the number of distances from
+1 to max_distance in the windows, so that a pair density means the same number
+of pairs per distance as with the codon scheme with stride 1. Weights are cached
+by (windows, max_distance, scheme, source, stride) and returned read-only.
+"""
+import os
+from hashlib import blake2b
+from typing import Optional, Union
+
+import numpy as np
+
+from twosfs.spectra import COUNT_DTYPE, Spectra, load_spectra
+
+SCHEMES = ("codon", "empirical", "learned")
+
+# The maximum number of weight arrays kept in the cache.
+CACHE_SIZE = 256
+
+Source = Union[str, np.ndarray, "Spectra", None]
+
+_cache: dict[tuple, np.ndarray] = {}
+
+
+def codon_distance_counts(max_distance: int, stride: int = 3) -> np.ndarray:
+    """Return one pair at each positive multiple of stride up to max_distance.
+
+    Element d of the result is the number of pairs at distance d.
+    """
+    counts = np.zeros(max_distance + 1)
+    counts[stride::stride] = 1
+    return counts
+
+
+def _sorted_sites(positions, max_distance: int, chromosomes=None) -> np.ndarray:
+    """Return the distinct sites as sorted positions on one line.
+
+    Chromosomes are laid end to end, with gaps longer than max_distance, so that
+    no pair of sites on different chromosomes is within max_distance.
+    """
+    positions = np.asarray(positions, dtype=np.int64).ravel()
+    if chromosomes is not None and positions.size:
+        _, codes = np.unique(np.asarray(chromosomes).ravel(), return_inverse=True)
+        span = positions.max() - positions.min() + max_distance + 1
+        positions = positions + codes.astype(np.int64) * span
+    positions = np.sort(positions)
+    distinct = np.ones(len(positions), dtype=bool)
+    distinct[1:] = positions[1:] != positions[:-1]
+    return positions[distinct]
+
+
+def positions_distance_counts(
+    positions, max_distance: int, chromosomes=None
+) -> np.ndarray:
+    """Count the pairs of sites at each distance up to max_distance.
+
+    Element d of the result is the number of pairs of positions at distance d,
+    with element 0 the number of distinct sites.
+
+    Parameters
+    ----------
+    positions : array_like
+        The integer positions of the sites, in any order.
+    max_distance : int
+        The largest distance counted.
+    chromosomes : array_like, optional
+        The chromosome of each site. Only pairs on the same chromosome count.
+
+    Returns
+    -------
+    ndarray
+        The exact counts as int64.
+
+    Notes
+    -----
+    This is a histogram of the differences between each sorted site and its
+    k-th following site, for k = 1, 2, ... until no site is within max_distance
+    of its k-th neighbor. The differences are taken between slices of the sorted
+    positions while most sites still have close neighbors, and only for the
+    remaining sites afterwards, so the time is roughly proportional to the
+    number of pairs counted.
+    """
+    positions = _sorted_sites(positions, max_distance, chromosomes)
+    num_sites = len(positions)
+    counts = np.zeros(max_distance + 1, dtype=np.int64)
+    counts[0] = num_sites
+    # The sites with a close k-th neighbor, once they are few.
+    left = None
+    for offset in range(1, num_sites):
+        if left is None:
+            distances = positions[offset:] - positions[:-offset]
+            close = distances <= max_distance
+            distances = distances[close]
+            if 4 * distances.size < close.size:
+                left = np.flatnonzero(close)
+        else:
+            left = left[: np.searchsorted(left, num_sites - offset)]
+            distances = positions[left + offset] - positions[left]
+            close = distances <= max_distance
+            left = left[close]
+            distances = distances[close]
+        if not distances.size:
+            break
+        counts += np.bincount(distances, minlength=max_distance + 1)
+    return counts
+
+
+def num_pairs_from_positions(positions, windows, chromosomes=None) -> np.ndarray:
+    """Count the pairs of sites in each window from the site positions alone.
+
+    The counts equal the num_pairs of the Spectra built by `spectra_from_sites`
+    from allele counts at the same sites and windows, without building its 2SFS.
+
+    Parameters
+    ----------
+    positions : array_like
+        The integer positions of the sites, in any order.
+    windows : array_like
+        The window boundaries. Window i counts the pairs at distances from
+        windows[i] up to but excluding windows[i + 1].
+    chromosomes : array_like, optional
+        The chromosome of each site. Only pairs on the same chromosome count.
+
+    Returns
+    -------
+    ndarray
+        The number of pairs in each window, of dtype COUNT_DTYPE.
+    """
+    windows = np.asarray(windows, dtype=float)
+    max_distance = max(int(np.ceil(windows[-1])) - 1, 0)
+    counts = positions_distance_counts(positions, max_distance, chromosomes)
+    return bin_distance_counts(windows, counts).astype(COUNT_DTYPE)
+
+
+def window_distance_counts(windows, num_pairs, max_distance: int) -> np.ndarray:
+    """Spread the num_pairs of each window evenly over its integer distances."""
+    windows = np.asarray(windows, dtype=float)
+    starts = np.ceil(windows[:-1]).astype(int)
+    stops = np.ceil(windows[1:]).astype(int)
+    counts = np.zeros(max(max_distance + 1, stops[-1]))
+    lengths = np.maximum(stops - starts, 1)
+    density = np.repeat(np.asarray(num_pairs, dtype=float) / lengths, stops - starts)
+    counts[starts[0] : stops[-1]] = density
+    return counts[: max_distance + 1]
+
+
+def bin_distance_counts(windows, distance_counts: np.ndarray) -> np.ndarray:
+    """Sum the counts at each distance over the integer distances of each window.
+
+    Distances beyond the end of distance_counts count as zero.
+    """
+    distance_counts = np.asarray(distance_counts)
+    cumulative = np.concatenate(
+        [np.zeros(1, dtype=distance_counts.dtype), np.cumsum(distance_counts)]
+    )
+    bounds = np.clip(
+        np.ceil(np.asarray(windows, dtype=float)), 0, len(distance_counts)
+    ).astype(int)
+    return np.diff(cumulative[bounds])
+
+
+def load_positions(sites_file: str) -> np.ndarray:
+    """Read the sorted, distinct site positions in a text file of integers."""
+    return np.unique(np.loadtxt(sites_file, dtype=np.int64, ndmin=1))
+
+
+def _source_key(source: Source) -> Optional[tuple]:
+    if source is None:
+        return None
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        return ("file", path, os.stat(path).st_mtime_ns)
+    h = blake2b(digest_size=16)
+    if isinstance(source, np.ndarray):
+        h.update(np.ascontiguousarray(source, dtype=float).tobytes())
+        return ("array", h.hexdigest())
+    h.update(np.ascontiguousarray(source.windows, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(source.num_pairs, dtype=float).tobytes())
+    return ("spectra", h.hexdigest())
+
+
+def _distance_counts(
+    scheme: str, source: Source, windows: np.ndarray, max_distance: int, stride: int
+) -> np.ndarray:
+    if scheme == "codon":
+        return codon_distance_counts(max_distance, stride)
+    if source is None:
+        raise ValueError(f"The {scheme} scheme needs a source.")
+    if scheme == "empirical":
+        if isinstance(source, (str, os.PathLike)):
+            source = load_positions(os.fspath(source))
+        counts = positions_distance_counts(source, max_distance).astype(float)
+    elif scheme == "learned":
+        if isinstance(source, (str, os.PathLike)):
+            path = os.fspath(source)
+            if path.endswith(".npy"):
+                source = np.load(path)
+            else:
+                source = load_spectra(path, "npz" if path.endswith(".npz") else "hdf5")
+        if isinstance(source, np.ndarray):
+            # num_pairs of data with the same windows.
+            num_pairs = source[: len(windows) - 1]
+            counts = window_distance_counts(
+                windows[: len(num_pairs) + 1], num_pairs, max_distance
+            )
+        else:
+            counts = window_distance_counts(
+                source.windows, source.num_pairs, max_distance
+            )
+    else:
+        raise ValueError(f"scheme must be one of {', '.join(SCHEMES)}.")
+    # Pairs at distance zero are pairs of a site with itself.
+    counts[0] = 0
+    distances = np.ones_like(counts)
+    distances[0] = 0
+    total = np.sum(bin_distance_counts(windows, counts))
+    if total > 0:
+        counts *= np.sum(bin_distance_counts(windows, distances)) / total
+    return counts
+
+
+def pair_weights(
+    windows,
+    max_distance: int,
+    scheme: str = "codon",
+    source: Source = None,
+    stride: int = 3,
+) -> np.ndarray:
+    """Return the weight of the pairs of sites in each window.
+
+    Parameters
+    ----------
+    windows : array_like
+        The window boundaries of the 2SFS.
+    max_distance : int
+        Pairs at larger distances have no weight.
+    scheme : str
+        "codon" (default), "empirical" or "learned". See the module docstring.
+    source : str, ndarray or Spectra, optional
+        With "empirical", the site positions or a file of them. With "learned",
+        a Spectra, a file of one, or the num_pairs of data with the same windows
+        or a .npy file of them.
+    stride : int
+        With "codon", the distance between weighted pairs.
+
+    Returns
+    -------
+    ndarray
+        A read-only array with one weight per window.
+    """
+    windows = np.asarray(windows, dtype=float)
+    key = (
+        windows.tobytes(),
+        int(max_distance),
+        scheme,
+        _source_key(source),
+        int(stride),
+    )
+    weights = _cache.get(key)
+    if weights is None:
+        counts = _distance_counts(scheme, source, windows, int(max_distance), stride)
+        weights = bin_distance_counts(windows, counts)
+        weights.setflags(write=False)
+        if len(_cache) >= CACHE_SIZE:
+            del _cache[next(iter(_cache))]
+        _cache[key] = weights
+    return weights
+
+
+def pair_mask(
+    windows,
+    max_distance: int,
+    scheme: str = "codon",
+    source: Source = None,
+    stride: int = 3,
+) -> np.ndarray:
+    """Return True for the windows with weighted pairs. See `pair_weights`."""
+    return pair_weights(windows, max_distance, scheme, source, stride) > 0
+
+
+def clear_pair_weight_cache() -> None:
+    """Clear the cache of pair weights."""
+    _cache.clear()
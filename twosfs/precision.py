@@ -0,0 +1,59 @@
+"""The floating point precision of arrays derived from spectra.
+
+Spectra accumulate counts in float64, or exactly in `twosfs.spectra.COUNT_DTYPE`
+if built with `counts=True` or `Spectra.astype`. Normalized 2SFS pdfs, resampled
+pdfs, their CDFs and the KS distances between them may instead be computed in
+float32, which halves the memory traffic of these bandwidth-bound kernels. The
+error of KS distances computed in float32 is of the order of 1e-6 of the
+distance, far below the resampling noise of a power analysis.
+
+The precision is chosen by the dtype argument of `Spectra.normalized_twosfs`,
+`twosfs_pdf` and `sample_ks_statistics`. Without one, they use the precision set
+by the `precision` context manager or by the environment variable
+TWOSFS_PRECISION ("float32" or "float64"), and float64 otherwise.
+"""
+import os
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
+
+import numpy as np
+
+# Environment variable holding the default precision of derived arrays.
+PRECISION_VARIABLE = "TWOSFS_PRECISION"
+
+DTypeLike = Union[str, type, np.dtype]
+
+_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+_precision: Optional[np.dtype] = None
+
+
+def _check_dtype(dtype: DTypeLike) -> np.dtype:
+    dtype = np.dtype(dtype)
+    if dtype not in _DTYPES:
+        raise ValueError("The precision of derived arrays must be float32 or float64.")
+    return dtype
+
+
+def derived_dtype(dtype: Optional[DTypeLike] = None) -> np.dtype:
+    """Return dtype, or the current precision of derived arrays if it is None."""
+    if dtype is not None:
+        return _check_dtype(dtype)
+    if _precision is not None:
+        return _precision
+    return _check_dtype(os.environ.get(PRECISION_VARIABLE) or np.float64)
+
+
+@contextmanager
+def precision(dtype: Optional[DTypeLike]) -> Iterator[np.dtype]:
+    """Set the precision of derived arrays within the context.
+
+    None defers to the environment.
+    """
+    global _precision
+    previous = _precision
+    _precision = None if dtype is None else _check_dtype(dtype)
+    try:
+        yield derived_dtype()
+    finally:
+        _precision = previous
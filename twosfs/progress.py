@@ -0,0 +1,238 @@
+"""Progress and throughput reports of long computations.
+
+A `Progress` sends status reports to a callback, a log stream and/or a JSON
+status file, at most once per interval seconds and when a task finishes, unless
+it finished within one interval without reporting. Each report gives the number
+of units done, the rate in units per second, the estimated time remaining and
+any running totals of the task::
+
+    progress = Progress(status_file="status.json", log=sys.stderr, interval=30)
+    spectra = simulate_spectra(..., progress=progress)
+
+The status file maps task names to their latest report, so that nested tasks,
+such as the simulations of a recombination rate search, are reported side by
+side. It is replaced atomically and can be polled by a dashboard.
+
+Functions that accept a progress argument fall back on the Progress activated
+by `reporting`. For workflow jobs, setting the environment variable
+TWOSFS_PROGRESS to a number of seconds activates a Progress that logs to stderr
+and writes `{output}.progress.json` with that interval.
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from typing import IO, Any, Callable, Iterable, Iterator, Optional, TypeVar, Union
+
+# Environment variable that turns on progress reports of workflow jobs.
+PROGRESS_VARIABLE = "TWOSFS_PROGRESS"
+
+T = TypeVar("T")
+
+_active: Optional["Progress"] = None
+
+
+class Progress(object):
+    """
+    Sends progress reports of tasks to a callback, a log and/or a status file.
+
+    Parameters
+    ----------
+    callback : Callable, optional
+        Called with each report, a dict.
+    status_file : str, optional
+        If given, the latest report of each task is written there as JSON.
+    log : file-like, optional
+        If given, each report is written there as one line of text.
+    interval : float
+        The minimum number of seconds between reports of a task.
+    """
+
+    def __init__(
+        self,
+        callback: Optional[Callable[[dict[str, Any]], None]] = None,
+        status_file: Optional[str] = None,
+        log: Optional[IO[str]] = None,
+        interval: float = 10.0,
+    ):
+        self.callback = callback
+        self.status_file = status_file
+        self.log = log
+        self.interval = interval
+        self.tasks: dict[str, dict[str, Any]] = {}
+
+    def task(
+        self, name: str, total: Optional[float] = None, unit: str = "items"
+    ) -> "Tracker":
+        """Start reporting a task of total units."""
+        return Tracker(self, name, total, unit)
+
+    def report(self, status: dict[str, Any]) -> None:
+        """Send the report of a task."""
+        self.tasks[status["task"]] = status
+        if self.callback is not None:
+            self.callback(status)
+        if self.log is not None:
+            print(format_status(status), file=self.log, flush=True)
+        if self.status_file is not None:
+            tmp_path = f"{self.status_file}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"updated": time.time(), "tasks": self.tasks}, f, indent=2)
+            os.replace(tmp_path, self.status_file)
+
+
+class Tracker(object):
+    """
+    Counts the units done of one task and reports them to a Progress.
+
+    A Tracker without a Progress only counts. Use it as a context manager, or call
+    `close` when the task is done, to send the final report.
+
+    Parameters
+    ----------
+    progress : Progress, optional
+        Where to send reports.
+    name : str
+        The name of the task.
+    total : float, optional
+        The total number of units, if known.
+    unit : str
+        The name of the units, e.g. "replicates".
+    """
+
+    def __init__(
+        self,
+        progress: Optional[Progress],
+        name: str,
+        total: Optional[float] = None,
+        unit: str = "items",
+    ):
+        self.progress = progress
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.done = 0.0
+        self.totals: dict[str, Any] = {}
+        self.start = self.last_report = time.perf_counter()
+        self.reported = False
+
+    def update(self, n: float = 1, **totals: Any) -> None:
+        """Add n units done and set running totals, reporting if it is time."""
+        self.done += n
+        if self.progress is None:
+            return
+        self.totals.update(totals)
+        now = time.perf_counter()
+        if now - self.last_report >= self.progress.interval:
+            self.last_report = now
+            self.reported = True
+            self.progress.report(self.status())
+
+    def iterate(self, iterable: Iterable[T]) -> Iterator[T]:
+        """Iterate over iterable, counting one unit per item."""
+        for item in iterable:
+            self.update()
+            yield item
+
+    def status(self, finished: bool = False) -> dict[str, Any]:
+        """Return the current report of the task."""
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        if self.total is None:
+            eta = None
+        elif finished or self.done >= self.total:
+            eta = 0.0
+        else:
+            eta = (self.total - self.done) / rate if rate > 0 else None
+        return {
+            "task": self.name,
+            "unit": self.unit,
+            "done": self.done,
+            "total": self.total,
+            "elapsed": elapsed,
+            "rate": rate,
+            "eta": eta,
+            "finished": finished,
+            "pid": os.getpid(),
+            "totals": dict(self.totals),
+        }
+
+    def close(self) -> None:
+        """Send the final report.
+
+        A task that finished within one interval without reporting is skipped, so
+        that short tasks, e.g. many small additions, do not flood the reports.
+        """
+        if self.progress is None:
+            return
+        elapsed = time.perf_counter() - self.start
+        if self.reported or elapsed >= self.progress.interval:
+            self.progress.report(self.status(finished=True))
+
+    def __enter__(self) -> "Tracker":
+        """Return the tracker."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Send the final report, unless the task raised an exception."""
+        if exc_type is None:
+            self.close()
+
+
+def track(
+    name: str,
+    total: Optional[float] = None,
+    unit: str = "items",
+    progress: Union[Progress, Tracker, None] = None,
+) -> Tracker:
+    """Return a Tracker of a task reporting to progress or the active Progress.
+
+    If progress is a Tracker, it is returned instead, so that a caller can report
+    the work of a function under its own task.
+    """
+    if isinstance(progress, Tracker):
+        return progress
+    return Tracker(progress or _active, name, total, unit)
+
+
+def format_status(status: dict[str, Any]) -> str:
+    """Format a report as one line of text."""
+    total = "" if status["total"] is None else f"/{status['total']:g}"
+    eta = "?" if status["eta"] is None else f"{status['eta']:.0f} s"
+    line = (
+        f"{status['task']}: {status['done']:g}{total} {status['unit']} "
+        f"in {status['elapsed']:.1f} s, {status['rate']:.3g} {status['unit']}/s, "
+        f"ETA {eta}"
+    )
+    totals = ", ".join(f"{k}={v:g}" for k, v in status["totals"].items())
+    return f"{line} ({totals})" if totals else line
+
+
+@contextmanager
+def reporting(progress: Progress) -> Iterator[Progress]:
+    """Make progress the default of functions that report progress."""
+    global _active
+    previous = _active
+    _active = progress
+    try:
+        yield progress
+    finally:
+        _active = previous
+
+
+def progress_from_environment(output: str):
+    """Return the progress reporting requested by TWOSFS_PROGRESS for a job.
+
+    If the variable is not set, return a context that does nothing.
+    """
+    interval = os.environ.get(PROGRESS_VARIABLE)
+    if not interval:
+        return nullcontext()
+    return reporting(
+        Progress(
+            status_file=f"{output}.progress.json",
+            log=sys.stderr,
+            interval=float(interval),
+        )
+    )
@@ -1,17 +1,32 @@
 """Helper functions for running msprime simulations."""
+import json
+import os
+from functools import lru_cache, partial
 from hashlib import blake2b
-from typing import Iterable, Union
+from typing import TYPE_CHECKING, Callable, Iterable, Optional, Union
 
-import msprime
 import numpy as np
-from scipy.special import betaln
 
-from twosfs.demography import (
-    expected_t2_demography,
-    make_exp_demography,
-    make_pwc_demography,
+from twosfs.cache import (
+    JSONCache,
+    cache_directory,
+    canonical_json,
+    normalize_parameters,
+    result_cache,
+    result_key,
 )
-from twosfs.spectra import Spectra, add_spectra, spectra_from_TreeSequence
+from twosfs.instrument import instrumented, instrumented_iter
+from twosfs.progress import Progress, track
+from twosfs.spectra import (
+    Spectra,
+    add_spectra,
+    load_spectra,
+    spectra_from_TreeSequence,
+)
+
+# msprime and scipy are slow to import, so they are imported where needed.
+if TYPE_CHECKING:
+    import msprime
 
 
 def list_rounded_parameters(params: Iterable[float], ndigits: int = 2) -> list[float]:
@@ -21,63 +36,320 @@ def list_rounded_parameters(params: Iterable[float], ndigits: int = 2) -> list[f
 
 def _dispatch_model(
     model: str, model_parameters: dict
-) -> tuple[msprime.AncestryModel, msprime.Demography, float]:
+) -> tuple["msprime.AncestryModel", Optional["msprime.Demography"], float]:
+    coal_model, demography = _build_model(model, model_parameters)
+    return coal_model, demography, expected_t2(model, model_parameters)
+
+
+def _build_model(
+    model: str, model_parameters: dict
+) -> tuple["msprime.AncestryModel", Optional["msprime.Demography"]]:
+    import msprime
+
+    from twosfs.demography import make_exp_demography, make_pwc_demography
+
     if model == "const":
         coal_model = msprime.StandardCoalescent()
         demography = make_pwc_demography([1.0], [])
-        t2 = expected_t2_demography(demography)
     elif model == "exp":
         coal_model = msprime.StandardCoalescent()
         demography = make_exp_demography(
             end_time=model_parameters["end_time"],
             growth_rate=model_parameters["growth_rate"],
         )
-        t2 = expected_t2_demography(demography)
     elif model == "pwc":
         coal_model = msprime.StandardCoalescent()
         demography = make_pwc_demography(
             sizes=model_parameters["sizes"],
             times=model_parameters["times"],
         )
-        t2 = expected_t2_demography(demography)
     elif model == "beta":
         coal_model = msprime.BetaCoalescent(alpha=model_parameters["alpha"])
         demography = None
-        t2 = expected_t2_beta(alpha=model_parameters["alpha"])
     else:
-        raise ValueError("Invalid model {model}. Must be const, exp, pwc, or beta.")
-    return coal_model, demography, t2
+        raise ValueError(f"Invalid model {model}. Must be const, exp, pwc, or beta.")
+    return coal_model, demography
 
 
-def simulate_spectra(
-    model: str,
-    model_parameters: dict,
-    msprime_parameters: dict,
-    scaled_recombination_rate: float,
-    random_seed: Union[int, np.random.Generator],
-) -> Spectra:
-    """Simulate spectra using msprime coalescent simulations."""
+# Name of the file holding expected T2 values in the shared cache directory.
+T2_CACHE_FILE = "expected_t2.json"
+
+
+def expected_t2(model: str, model_parameters: dict) -> float:
+    """Compute the mean pairwise coalescence time of a model.
+
+    Results are memoized in memory and, if the environment variable
+    TWOSFS_CACHE_DIR is set, in a JSON file in that directory shared across jobs.
+    Parameters are normalized, so that 1 and 1.0 share an entry, and the keys of
+    the file include `twosfs.cache.CODE_VERSION`.
+    """
+    parameters = normalize_parameters(model_parameters)
+    return _expected_t2(model, canonical_json(parameters))
+
+
+@lru_cache(maxsize=1024)
+def _expected_t2(model: str, parameter_string: str) -> float:
+    model_parameters = json.loads(parameter_string)
+    key = result_key("expected_t2", model, model_parameters)
+    directory = cache_directory()
+    disk_cache = (
+        JSONCache(os.path.join(directory, T2_CACHE_FILE)) if directory else None
+    )
+    if disk_cache is not None and key in disk_cache:
+        return disk_cache[key]
+    if model == "beta":
+        t2 = float(expected_t2_beta(alpha=model_parameters["alpha"]))
+    else:
+        _, demography = _build_model(model, model_parameters)
+        from twosfs.demography import expected_t2_demography
+
+        t2 = float(expected_t2_demography(demography))
+    if disk_cache is not None:
+        disk_cache[key] = t2
+    return t2
+
+
+def clear_t2_cache() -> None:
+    """Clear the in-memory cache of expected T2 values."""
+    _expected_t2.cache_clear()
+
+
+def _seed(random_seed: Union[int, np.random.Generator]) -> int:
     if isinstance(random_seed, int):
-        seed = random_seed
+        return random_seed
     elif isinstance(random_seed, np.random.Generator):
-        seed = random_seed.integers(2 ** 32)
+        return random_seed.integers(2 ** 32)
     else:
         raise ValueError("random_seed must be an int or a numpy.random.Generator")
-    coal_model, demography, t2 = _dispatch_model(model, model_parameters)
-    r = scaled_recombination_rate / (2 * t2)
+
+
+def _simulate(
+    coal_model: "msprime.AncestryModel",
+    demography: Optional["msprime.Demography"],
+    recombination_rate: float,
+    seed: int,
+    msprime_parameters: dict,
+    progress: Optional[Progress] = None,
+) -> Spectra:
+    import msprime
+
     sims = msprime.sim_ancestry(
         model=coal_model,
         demography=demography,
-        recombination_rate=r,
+        recombination_rate=recombination_rate,
         random_seed=seed,
         **msprime_parameters,
     )
     windows = np.arange(msprime_parameters["sequence_length"] + 1)
-    return add_spectra(spectra_from_TreeSequence(windows, r, tseq) for tseq in sims)
+    tracker = track(
+        "simulate_spectra",
+        msprime_parameters.get("num_replicates", 1),
+        "replicates",
+        progress,
+    )
+    return add_spectra(
+        (
+            spectra_from_TreeSequence(windows, recombination_rate, tseq)
+            for tseq in instrumented_iter("msprime.sim_ancestry", sims)
+        ),
+        tracker,
+    )
+
+
+@instrumented
+def simulate_spectra(
+    model: str,
+    model_parameters: dict,
+    msprime_parameters: dict,
+    scaled_recombination_rate: float,
+    random_seed: Union[int, np.random.Generator],
+    progress: Optional[Progress] = None,
+) -> Spectra:
+    """Simulate spectra using msprime coalescent simulations.
+
+    If the environment variable TWOSFS_RESULT_CACHE_DIR is set, results are cached
+    in that directory, keyed by the model, the normalized parameters and the msprime
+    seed. A Generator random_seed is advanced the same way whether or not the result
+    is cached.
+
+    Progress is reported as the task "simulate_spectra" in replicates, to progress
+    or the Progress activated by `twosfs.progress.reporting`.
+    """
+    seed = _seed(random_seed)
+    compute = partial(
+        _simulate_model,
+        model,
+        model_parameters,
+        msprime_parameters,
+        scaled_recombination_rate,
+        seed,
+        progress,
+    )
+    cache = result_cache()
+    if cache is None:
+        return compute()
+    key = result_key(
+        "simulate_spectra",
+        model,
+        model_parameters,
+        msprime_parameters,
+        scaled_recombination_rate,
+        seed,
+    )
+    return cache.get_or_compute(key, compute, load_spectra, Spectra.save)
+
+
+def _simulate_model(
+    model: str,
+    model_parameters: dict,
+    msprime_parameters: dict,
+    scaled_recombination_rate: float,
+    seed: int,
+    progress: Optional[Progress] = None,
+) -> Spectra:
+    coal_model, demography, t2 = _dispatch_model(model, model_parameters)
+    r = scaled_recombination_rate / (2 * t2)
+    return _simulate(coal_model, demography, r, seed, msprime_parameters, progress)
+
+
+def simulate_spectra_adaptive(
+    model: str,
+    model_parameters: dict,
+    msprime_parameters: dict,
+    scaled_recombination_rate: float,
+    random_seed: Union[int, np.random.Generator],
+    target_rse: float,
+    batch_size: int,
+    statistic: Optional[Callable[[Spectra], Union[float, np.ndarray]]] = None,
+    k_max: int = 20,
+    min_batches: int = 4,
+    num_groups: int = 10,
+) -> tuple[Spectra, float]:
+    """Simulate spectra in batches until a statistic reaches a target precision.
+
+    The relative standard error (RSE) of the statistic is estimated by jackknifing
+    over groups of batches, weighted by their numbers of replicates. For
+    array-valued statistics, the RSE is the norm of the standard errors divided by
+    the norm of the estimate. Batches are added to num_groups groups in turn, so
+    only the group totals are kept in memory.
+
+    Parameters
+    ----------
+    model, model_parameters, msprime_parameters, scaled_recombination_rate
+        As in `simulate_spectra`. `msprime_parameters["num_replicates"]` is the
+        maximum number of replicates to simulate.
+    random_seed : int or numpy.random.Generator
+        Seeds the per-batch msprime seeds.
+    target_rse : float
+        Stop once the estimated RSE is at most target_rse.
+    batch_size : int
+        The number of replicates simulated per batch.
+    statistic : Callable, optional
+        A function of a Spectra. Defaults to the normalized 2SFS lumped at k_max.
+    k_max : int
+        The maximum allele count of the lumped 2SFS of the default statistic.
+    min_batches : int
+        The minimum number of batches before the RSE is checked.
+    num_groups : int
+        The number of groups left out in turn by the jackknife.
+
+    Returns
+    -------
+    Spectra
+        The sum of all simulated batches.
+    float
+        The estimated RSE of the statistic of the returned Spectra.
+    """
+    if statistic is None:
+        statistic = partial(Spectra.normalized_twosfs, k_max=k_max)
+    if min_batches < 2 or num_groups < 2:
+        raise ValueError("min_batches and num_groups must be at least 2.")
+    rng = np.random.default_rng(random_seed)
+    coal_model, demography, t2 = _dispatch_model(model, model_parameters)
+    r = scaled_recombination_rate / (2 * t2)
+    max_replicates = msprime_parameters["num_replicates"]
+    groups: list[Spectra] = []
+    group_sizes: list[int] = []
+    total = None
+    rse = np.inf
+    num_batches = num_replicates = 0
+    while num_replicates < max_replicates:
+        n = min(batch_size, max_replicates - num_replicates)
+        batch = _simulate(
+            coal_model,
+            demography,
+            r,
+            _seed(rng),
+            msprime_parameters | {"num_replicates": n},
+        )
+        num_replicates += n
+        if num_batches < num_groups:
+            groups.append(batch)
+            group_sizes.append(n)
+        else:
+            i = num_batches % num_groups
+            groups[i] = groups[i] + batch
+            group_sizes[i] += n
+        num_batches += 1
+        total = batch if total is None else total + batch
+        if num_batches >= min_batches:
+            rse = jackknife_rse(total, groups, statistic, group_sizes)
+            if rse <= target_rse:
+                break
+    return total, rse
+
+
+def jackknife_rse(
+    total: Spectra,
+    parts: list[Spectra],
+    statistic: Callable[[Spectra], Union[float, np.ndarray]],
+    sizes: Optional[list[float]] = None,
+) -> float:
+    """Estimate the relative standard error of statistic(total) by jackknife.
+
+    Each jackknife replicate leaves out one of the parts that sum to total. If the
+    parts have different sizes, e.g. numbers of replicates, the delete-m jackknife
+    of Busing, Meijer and van der Leeden (1999) weights them by sizes.
+    """
+    estimate = np.asarray(statistic(total))
+    loo = np.array([statistic(_subtract_spectra(total, p)) for p in parts])
+    num_parts = len(parts)
+    if sizes is None:
+        sizes = [1.0] * num_parts
+    # h is the inverse of the fraction of the total in each part.
+    h = np.sum(sizes) / np.asarray(sizes, dtype=float)
+    h = h.reshape((num_parts,) + (1,) * estimate.ndim)
+    pseudovalues = h * estimate - (h - 1) * loo
+    mean = num_parts * estimate - np.sum((1 - 1 / h) * loo, axis=0)
+    variance = np.mean((pseudovalues - mean) ** 2 / (h - 1), axis=0)
+    norm = np.sqrt(np.sum(estimate ** 2))
+    if norm == 0:
+        return np.inf
+    return float(np.sqrt(np.sum(variance)) / norm)
+
+
+def _subtract_spectra(total: Spectra, part: Spectra) -> Spectra:
+    # Clip rounding errors so that the difference stays nonnegative.
+    num_sites = max(total.num_sites - part.num_sites, 0.0)
+    num_pairs = np.clip(total.num_pairs - part.num_pairs, 0, None)
+    onesfs = np.clip(total.onesfs - part.onesfs, 0, None) * (num_sites > 0)
+    twosfs = np.clip(total.twosfs - part.twosfs, 0, None)
+    twosfs[num_pairs == 0] = 0
+    return Spectra(
+        total.num_samples,
+        total.windows,
+        total.recombination_rate,
+        num_sites,
+        num_pairs,
+        onesfs,
+        twosfs,
+    )
 
 
 def expected_t2_beta(alpha, pop_size=1.0):
     """Compute the mean coalescent time of the diploid beta coalescent."""
+    from scipy.special import betaln
+
     m = 2 + np.exp(alpha * np.log(2) - (alpha - 1) * np.log(3) - np.log(alpha - 1))
     return np.exp(
         np.log(4)
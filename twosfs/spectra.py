@@ -1,14 +1,27 @@
 """Class and functions for manipulating SFS and 2SFS."""
-from collections.abc import Iterable
-from copy import deepcopy
-from typing import Any, Optional
+from collections.abc import Iterable, Sized
+from typing import TYPE_CHECKING, Any, Iterator, Optional, Union
 
 import attr
 import attr.validators as v
-import h5py
 import numpy as np
-import tskit
-from fitsfs.fitsfs import FittedPWCModel, fit_sfs
+
+from twosfs.instrument import instrumented
+from twosfs.memory import (
+    ITEMSIZE,
+    NORMALIZE_COPIES,
+    check_budget,
+    chunk_length,
+    spectra_nbytes,
+)
+from twosfs.precision import DTypeLike, derived_dtype
+from twosfs.progress import Progress, Tracker, track
+
+# h5py, tskit and fitsfs are slow to import, so they are imported where needed.
+if TYPE_CHECKING:
+    import h5py
+    import tskit
+    from fitsfs.fitsfs import FittedPWCModel
 
 # Converters
 
@@ -17,6 +30,32 @@ def _float_array(value) -> np.ndarray:
     return np.array(value, dtype=float)
 
 
+def _float_array_view(value) -> np.ndarray:
+    # Like _float_array, but without copying arrays that are already float.
+    return np.asarray(value, dtype=float)
+
+
+# The dtype of exact counts, e.g. of spectra built from data.
+COUNT_DTYPE = np.uint64
+
+
+def _count_array(value) -> np.ndarray:
+    # Exact counts stay COUNT_DTYPE. Everything else, other integers included,
+    # becomes float.
+    value = np.asarray(value)
+    if value.dtype == COUNT_DTYPE:
+        return value.copy()
+    return np.array(value, dtype=float)
+
+
+def _count_array_view(value) -> np.ndarray:
+    # Like _count_array, but without copying.
+    value = np.asarray(value)
+    if value.dtype == COUNT_DTYPE:
+        return value
+    return np.asarray(value, dtype=float)
+
+
 # Validators
 
 
@@ -67,7 +106,7 @@ def _zero_if_num_sites(instance, attribute, value):
 
 
 def _zero_if_num_pairs(instance, attribute, value):
-    if any((n == 0) & np.any(x > 0) for n, x in zip(instance.num_pairs, value)):
+    if np.any(np.any(value > 0, axis=(-2, -1)) & (instance.num_pairs == 0)):
         raise ValueError(
             f"If num_pairs == 0, {attribute.name} must only contain zeros."
         )
@@ -96,6 +135,11 @@ class Spectra(object):
     twosfs : ndarray
        3D array containing the 2-SFS for each of l windows
        `twosfs.shape == (l, n+1, n+1)`
+
+    num_pairs, onesfs and twosfs are float64, unless they are constructed from
+    arrays of dtype COUNT_DTYPE, e.g. by `astype(COUNT_DTYPE)`, in which case they
+    keep it. Such counts are exact and are saved as such. Normalization returns
+    floats and adding float spectra promotes counts to float.
     """
 
     # attr constructor
@@ -108,14 +152,14 @@ class Spectra(object):
     )
     num_sites: float = attr.ib(converter=float, validator=[_nonnegative])
     num_pairs: np.ndarray = attr.ib(
-        converter=_float_array, validator=[_1D, _matches_windows, _nonnegative]
+        converter=_count_array, validator=[_1D, _matches_windows, _nonnegative]
     )
     onesfs: np.ndarray = attr.ib(
-        converter=_float_array,
+        converter=_count_array,
         validator=[_1D, _matches_num_samples, _nonnegative, _zero_if_num_sites],
     )
     twosfs: np.ndarray = attr.ib(
-        converter=_float_array,
+        converter=_count_array,
         validator=[
             _3D,
             _matches_windows,
@@ -126,6 +170,73 @@ class Spectra(object):
         ],
     )
 
+    @classmethod
+    def from_arrays_unchecked(
+        cls,
+        num_samples: int,
+        windows: np.ndarray,
+        recombination_rate: float,
+        num_sites: float,
+        num_pairs: np.ndarray,
+        onesfs: np.ndarray,
+        twosfs: np.ndarray,
+    ) -> "Spectra":
+        """Construct a Spectra without conversion or validation.
+
+        This is a fast path for arrays produced inside the package. The arguments
+        must already have the types and shapes that the constructor would produce
+        and the arrays are stored without copying. Call `validate` to check them.
+        """
+        spec = cls.__new__(cls)
+        spec.num_samples = num_samples
+        spec.windows = windows
+        spec.recombination_rate = recombination_rate
+        spec.num_sites = num_sites
+        spec.num_pairs = num_pairs
+        spec.onesfs = onesfs
+        spec.twosfs = twosfs
+        return spec
+
+    def validate(self) -> None:
+        """Run the validators of all fields, raising an exception if one fails."""
+        attr.validate(self)
+
+    def copy(self) -> "Spectra":
+        """Return a copy of the Spectra."""
+        return Spectra.from_arrays_unchecked(
+            self.num_samples,
+            self.windows.copy(),
+            self.recombination_rate,
+            self.num_sites,
+            self.num_pairs.copy(),
+            self.onesfs.copy(),
+            self.twosfs.copy(),
+        )
+
+    def astype(self, dtype) -> "Spectra":
+        """Return a copy with num_pairs, onesfs and twosfs cast to dtype.
+
+        dtype is float or COUNT_DTYPE. Raise ValueError if it is COUNT_DTYPE and
+        the counts are not whole numbers.
+        """
+        dtype = np.dtype(dtype)
+        arrays = [self.num_pairs, self.onesfs, self.twosfs]
+        if dtype not in (np.dtype(float), np.dtype(COUNT_DTYPE)):
+            raise ValueError(f"Spectra counts must be float or {COUNT_DTYPE}.")
+        if dtype == COUNT_DTYPE:
+            if not all(np.all(np.mod(a, 1) == 0) for a in arrays):
+                raise ValueError(f"Spectra with fractional counts cannot be {dtype}.")
+        num_pairs, onesfs, twosfs = (a.astype(dtype) for a in arrays)
+        return Spectra.from_arrays_unchecked(
+            self.num_samples,
+            self.windows.copy(),
+            self.recombination_rate,
+            self.num_sites,
+            num_pairs,
+            onesfs,
+            twosfs,
+        )
+
     def __eq__(self, other) -> bool:
         """Equality is equality of elements."""
         if type(self) is not type(other):
@@ -167,7 +278,8 @@ class Spectra(object):
             return self.__add__(zero_spectra_like(self))
         elif type(self) is not type(other):
             return NotImplemented
-        return add_spectra((self, other))
+        # Untracked, so that summing spectra pairwise does not report every step.
+        return _add_spectra((self, other))
 
     def __radd__(self, other) -> "Spectra":
         """Addition of spectra is commutative."""
@@ -186,19 +298,39 @@ class Spectra(object):
             return lump_onesfs(normed, k_max=k_max)
 
     def normalized_twosfs(
-        self, folded: bool = False, k_max: Optional[int] = None
+        self,
+        folded: bool = False,
+        k_max: Optional[int] = None,
+        dtype: Optional[DTypeLike] = None,
     ) -> np.ndarray:
-        """Return the 2SFS normalized to one in each window."""
+        """Return the 2SFS normalized to one in each window.
+
+        The sums are accumulated in float64 and the result has the dtype given by
+        `twosfs.precision.derived_dtype(dtype)`. Under a memory budget (see
+        `twosfs.memory`), windows are normalized in chunks that fit the budget.
+        """
         if not k_max:
             k_max = self.num_samples
-        sums = np.sum(self.twosfs, axis=(1, 2))
-        nonzero = sums > 0
-        normed = np.zeros_like(self.twosfs)
-        normed[nonzero] = self.twosfs[nonzero] / sums[nonzero, None, None]
-        if folded:
-            return lump_twosfs(foldtwosfs(normed), k_max=k_max)
-        else:
-            return lump_twosfs(normed, k_max=k_max)
+        dtype = derived_dtype(dtype)
+        num_windows = self.twosfs.shape[0]
+        window_nbytes = self.twosfs.shape[1] * self.twosfs.shape[2] * ITEMSIZE
+        lumped = np.zeros((num_windows, k_max + 1, k_max + 1), dtype=dtype)
+        chunk = chunk_length(
+            num_windows,
+            NORMALIZE_COPIES * window_nbytes,
+            "normalized_twosfs",
+            fixed_nbytes=lumped.nbytes,
+        )
+        for start in range(0, num_windows, chunk):
+            twosfs = self.twosfs[start : start + chunk]
+            sums = np.sum(twosfs, axis=(1, 2))
+            normed = np.divide(
+                twosfs, np.where(sums > 0, sums, 1.0)[:, None, None], dtype=dtype
+            )
+            if folded:
+                normed = foldtwosfs(normed)
+            lumped[start : start + chunk] = lump_twosfs(normed, k_max=k_max)
+        return lumped
 
     def tajimas_pi(self) -> float:
         """Return the Tajima's pi (average pairwise diversity)."""
@@ -208,8 +340,10 @@ class Spectra(object):
         """Return pi * r (or 2 * E[T_2] * r)."""
         return self.tajimas_pi() * self.recombination_rate
 
-    def fit_pwc_demography(self, **kwargs) -> FittedPWCModel:
+    def fit_pwc_demography(self, **kwargs) -> "FittedPWCModel":
         """Fit a piecewise constant population size to the onesfs."""
+        from fitsfs.fitsfs import fit_sfs
+
         sfs = self.normalized_onesfs()[1:-1]
         return fit_sfs(sfs, **kwargs)
 
@@ -226,6 +360,8 @@ class Spectra(object):
             If format is "hdf5", the name of the group (default=spectra)
         """
         if format == "hdf5":
+            import h5py
+
             with h5py.File(output_file, "w") as f:
                 spectra_to_hdf5(self, f, _name)
         elif format == "npz":
@@ -234,45 +370,249 @@ class Spectra(object):
             raise ValueError("format must be hdf5 or npz.")
 
 
-def add_spectra(specs: Iterable[Spectra]):
-    """Add an iterable of compatible spectra."""
+@instrumented
+def add_spectra(
+    specs: Iterable[Spectra], progress: Union[Progress, Tracker, None] = None
+):
+    """Add an iterable of compatible spectra.
+
+    Progress is reported as the number of spectra added and the running total of
+    num_sites, under the task "add_spectra" or that of a Tracker.
+    """
+    total = len(specs) if isinstance(specs, Sized) else None
+    with track("add_spectra", total, "spectra", progress) as tracker:
+        return _add_spectra(specs, tracker)
+
+
+def _add_spectra(specs: Iterable[Spectra], tracker: Optional[Tracker] = None):
     it = iter(specs)
-    ret = deepcopy(next(it))
+    ret = next(it).copy()
+    if tracker is not None:
+        tracker.update(num_sites=float(ret.num_sites))
     for s in it:
         if not ret.compatible(s):
             raise ValueError("Spectra are incompatible.")
+        for name in ("num_pairs", "onesfs", "twosfs"):
+            # Counts are promoted to float when float spectra are added.
+            dtype = np.result_type(getattr(ret, name), getattr(s, name))
+            if dtype != getattr(ret, name).dtype:
+                setattr(ret, name, getattr(ret, name).astype(dtype))
         ret.num_sites += s.num_sites
         ret.num_pairs += s.num_pairs
         ret.onesfs += s.onesfs
         ret.twosfs += s.twosfs
+        if tracker is not None:
+            tracker.update(num_sites=float(ret.num_sites))
     return ret
 
 
+def _matches_batch_size(instance, attribute, value):
+    if value.shape[0] != len(instance.num_sites):
+        raise ValueError(
+            f"First dimension of {attribute.name} must equal len(num_sites)."
+        )
+
+
+def _matches_batch_windows(instance, attribute, value):
+    if value.shape[1] != len(instance.windows) - 1:
+        raise ValueError(
+            f"Second dimension of {attribute.name} must equal len(windows) - 1."
+        )
+
+
+@attr.s(eq=False)
+class SpectraBatch(object):
+    """
+    Stores a batch of compatible Spectra as stacked arrays.
+
+    Attributes
+    ----------
+    num_samples : int
+        The sample size (i.e. number of haploid genomes.)
+    windows : ndarray
+        The boundaries of the windows for computing the 2SFS
+    recombination_rate : float
+       The per-site recombination rate.
+    num_sites : ndarray
+        The number of sites contributing to each SFS, shape (N,)
+    num_pairs : ndarray
+        The number of pairs of sites contributing to each 2SFS, shape (N, l)
+    onesfs : ndarray
+       The SFS of each Spectra, shape (N, n+1)
+    twosfs : ndarray
+       The 2SFS of each Spectra, shape (N, l, n+1, n+1)
+    """
+
+    num_samples: int = attr.ib(validator=[v.instance_of(int), _nonnegative])
+    windows: np.ndarray = attr.ib(
+        converter=_float_array, validator=[_1D, _nonnegative, _strictly_increasing]
+    )
+    recombination_rate: float = attr.ib(
+        converter=float, validator=[v.instance_of(float), _nonnegative]
+    )
+    num_sites: np.ndarray = attr.ib(
+        converter=_float_array, validator=[_1D, _nonnegative]
+    )
+    num_pairs: np.ndarray = attr.ib(
+        converter=_count_array,
+        validator=[_matches_batch_size, _matches_batch_windows, _nonnegative],
+    )
+    onesfs: np.ndarray = attr.ib(
+        converter=_count_array,
+        validator=[_matches_batch_size, _matches_num_samples, _nonnegative],
+    )
+    twosfs: np.ndarray = attr.ib(
+        converter=_count_array,
+        validator=[
+            _matches_batch_size,
+            _matches_batch_windows,
+            _matches_num_samples,
+            _last_dims_square,
+            _nonnegative,
+        ],
+    )
+
+    def __len__(self) -> int:
+        """Return the number of Spectra in the batch."""
+        return len(self.num_sites)
+
+    def __getitem__(self, i: int) -> Spectra:
+        """Return the i-th Spectra of the batch as a view of the stacked arrays."""
+        # The arrays were validated as a batch, so skip the Spectra converters.
+        return Spectra.from_arrays_unchecked(
+            self.num_samples,
+            self.windows,
+            self.recombination_rate,
+            float(self.num_sites[i]),
+            self.num_pairs[i],
+            self.onesfs[i],
+            self.twosfs[i],
+        )
+
+    def __iter__(self) -> Iterator[Spectra]:
+        """Iterate over the Spectra of the batch."""
+        return (self[i] for i in range(len(self)))
+
+    def sum(self) -> Spectra:
+        """Add the Spectra of the batch."""
+        return Spectra(
+            self.num_samples,
+            self.windows,
+            self.recombination_rate,
+            np.sum(self.num_sites),
+            np.sum(self.num_pairs, axis=0),
+            np.sum(self.onesfs, axis=0),
+            np.sum(self.twosfs, axis=0),
+        )
+
+    def normalized_onesfs(
+        self, folded: bool = False, k_max: Optional[int] = None
+    ) -> np.ndarray:
+        """Return each SFS normalized to one."""
+        if not k_max:
+            k_max = self.num_samples
+        normed = self.onesfs / np.sum(self.onesfs, axis=-1, keepdims=True)
+        if folded:
+            return lump_onesfs(foldonesfs(normed), k_max=k_max)
+        else:
+            return lump_onesfs(normed, k_max=k_max)
+
+    def normalized_twosfs(
+        self,
+        folded: bool = False,
+        k_max: Optional[int] = None,
+        dtype: Optional[DTypeLike] = None,
+    ) -> np.ndarray:
+        """Return each 2SFS normalized to one in each window.
+
+        The result has the dtype given by `twosfs.precision.derived_dtype(dtype)`.
+        """
+        if not k_max:
+            k_max = self.num_samples
+        sums = np.sum(self.twosfs, axis=(-2, -1), keepdims=True)
+        normed = np.divide(
+            self.twosfs,
+            sums,
+            out=np.zeros(self.twosfs.shape, dtype=derived_dtype(dtype)),
+            where=sums > 0,
+        )
+        if folded:
+            return lump_twosfs(foldtwosfs(normed), k_max=k_max)
+        else:
+            return lump_twosfs(normed, k_max=k_max)
+
+    def tajimas_pi(self) -> np.ndarray:
+        """Return the Tajima's pi of each Spectra."""
+        return tajimas_pi(self.onesfs / self.num_sites[:, None])
+
+    def scaled_recombination_rate(self) -> np.ndarray:
+        """Return pi * r (or 2 * E[T_2] * r) of each Spectra."""
+        return self.tajimas_pi() * self.recombination_rate
+
+
+def spectra_batch_from_list(specs: Iterable[Spectra]) -> SpectraBatch:
+    """Stack an iterable of compatible spectra into a SpectraBatch."""
+    specs = list(specs)
+    first = specs[0]
+    if not all(first.compatible(s) for s in specs[1:]):
+        raise ValueError("Spectra are incompatible.")
+    return SpectraBatch(
+        first.num_samples,
+        first.windows,
+        first.recombination_rate,
+        np.array([s.num_sites for s in specs]),
+        np.stack([s.num_pairs for s in specs]),
+        np.stack([s.onesfs for s in specs]),
+        np.stack([s.twosfs for s in specs]),
+    )
+
+
 # HDF5
 def spectra_to_hdf5(
-    spec: Spectra, group: h5py.Group, name: str, attrs: Optional[dict[str, Any]] = None
-) -> h5py.Group:
-    """Save a spectra object as an hdf5 group."""
+    spec: Spectra,
+    group: "h5py.Group",
+    name: str,
+    attrs: Optional[dict[str, Any]] = None,
+) -> "h5py.Group":
+    """Save a spectra object as an hdf5 group.
+
+    Integer count arrays are compressed, which costs little for exact counts.
+    """
     spec_group = group.create_group(name)
     for name, value in spec.__dict__.items():
-        spec_group.create_dataset(name, data=value)
+        if np.ndim(value) > 0 and np.issubdtype(np.asarray(value).dtype, np.integer):
+            spec_group.create_dataset(
+                name, data=value, compression="gzip", shuffle=True
+            )
+        else:
+            spec_group.create_dataset(name, data=value)
     if attrs:
         for key, val in attrs.items():
             spec_group.attrs[key] = val
     return spec_group
 
 
-def spectra_from_hdf5(group: h5py.Group) -> Spectra:
-    """Load a spectra object from an hdf5 group."""
-    return Spectra(
-        num_samples=int(group["num_samples"][()]),
-        windows=group["windows"][()],
-        recombination_rate=group["recombination_rate"][()],
-        num_sites=group["num_sites"][()],
-        num_pairs=group["num_pairs"][()],
-        onesfs=group["onesfs"][()],
-        twosfs=group["twosfs"][()],
+def spectra_from_hdf5(group: "h5py.Group") -> Spectra:
+    """Load a spectra object from an hdf5 group.
+
+    The arrays are validated but not copied, so loading allocates the Spectra
+    once. Raise MemoryError before reading if it exceeds the memory budget.
+    """
+    num_samples = int(group["num_samples"][()])
+    check_budget(
+        spectra_nbytes(num_samples, group["twosfs"].shape[0]), "Loading spectra"
+    )
+    spec = Spectra.from_arrays_unchecked(
+        num_samples,
+        _float_array_view(group["windows"][()]),
+        float(group["recombination_rate"][()]),
+        float(group["num_sites"][()]),
+        _count_array_view(group["num_pairs"][()]),
+        _count_array_view(group["onesfs"][()]),
+        _count_array_view(group["twosfs"][()]),
     )
+    spec.validate()
+    return spec
 
 
 # Spectra constructors
@@ -300,6 +640,8 @@ def _load_npz(input_file) -> Spectra:
 
 def _load_hdf5(input_file) -> Spectra:
     """Read a Spectra object from a .hdf5 file created by Spectra.save()."""
+    import h5py
+
     with h5py.File(input_file, "r") as f:
         return spectra_from_hdf5(f[_name])
 
@@ -324,28 +666,38 @@ def zero_spectra_like(spectra: Spectra) -> Spectra:
     )
 
 
+@instrumented
 def spectra_from_TreeSequence(
-    windows, recombination_rate: float, tseq: tskit.TreeSequence
+    windows, recombination_rate: float, tseq: "tskit.TreeSequence"
 ) -> Spectra:
     """Construct a Spectra object from a tskit.TreeSeqeunce."""
-    num_samples = tseq.sample_size
-    num_sites = windows[-1] - windows[0]
+    windows = np.asarray(windows, dtype=float)
+    num_samples = int(tseq.sample_size)
+    num_sites = float(windows[-1] - windows[0])
     num_pairs = np.diff(windows)
     afs = tseq.allele_frequency_spectrum(
         mode="branch", windows=windows, polarised=True, span_normalise=False
     )
     onesfs = np.sum(afs, axis=0)
     twosfs = afs[0, :, None] * afs[:, None, :]
-    return Spectra(
-        num_samples, windows, recombination_rate, num_sites, num_pairs, onesfs, twosfs
+    return Spectra.from_arrays_unchecked(
+        num_samples,
+        windows,
+        float(recombination_rate),
+        num_sites,
+        num_pairs,
+        onesfs,
+        twosfs,
     )
 
 
+@instrumented
 def spectra_from_sites(
     num_samples: int,
     windows: np.ndarray,
     recombination_rate: float,
     allele_count_dict: dict[int, int],
+    counts: bool = False,
 ) -> Spectra:
     """Create a Spectra from a dictionary of allele counts and positions.
 
@@ -359,77 +711,104 @@ def spectra_from_sites(
        The per-site recombination rate.
     allele_count_dict : Dict[int, int]
         A dictionary of `position: allele_count` pairs
+    counts : bool
+        If True, store exact integer counts of dtype COUNT_DTYPE.
 
     Returns
     -------
     Spectra
 
+    Notes
+    -----
+    Window i counts the pairs of sites at distances windows[i] to
+    windows[i + 1] - 1. The pairs at each distance are found by a binary search of
+    the sorted positions and tallied with bincount.
     """
-    onesfs = np.zeros(num_samples + 1)
-    twosfs = np.zeros((len(windows) - 1, num_samples + 1, num_samples + 1))
-    num_sites = 0
-    num_pairs = np.zeros(len(windows) - 1)
-    for pos, ac1 in allele_count_dict.items():
-        num_sites += 1
-        onesfs[ac1] += 1
-        for i, dist in enumerate(windows[:-1]):
-            for d in range(dist, windows[i + 1]):
-                try:
-                    ac2 = allele_count_dict[pos + d]
-                except KeyError:
-                    continue
-                num_pairs[i] += 1
-                twosfs[i, ac1, ac2] += 1
-                twosfs[i, ac2, ac1] += 1
+    num_bins = num_samples + 1
+    num_windows = len(windows) - 1
+    positions = np.fromiter(allele_count_dict.keys(), dtype=np.int64)
+    allele_counts = np.fromiter(allele_count_dict.values(), dtype=np.int64)
+    order = np.argsort(positions)
+    positions = positions[order]
+    allele_counts = allele_counts[order]
+
+    dtype = COUNT_DTYPE if counts else float
+    onesfs = np.bincount(allele_counts, minlength=num_bins).astype(dtype)
+    twosfs = np.zeros((num_windows, num_bins, num_bins), dtype=dtype)
+    num_pairs = np.zeros(num_windows, dtype=dtype)
+    for i in range(num_windows):
+        cells = []
+        for d in range(int(windows[i]), int(windows[i + 1])):
+            j = np.searchsorted(positions, positions + d)
+            j[j == len(positions)] = 0
+            found = np.flatnonzero(positions[j] == positions + d)
+            cells.append(allele_counts[found] * num_bins + allele_counts[j[found]])
+        counts = np.bincount(
+            np.concatenate(cells, dtype=np.int64), minlength=num_bins ** 2
+        ).reshape(num_bins, num_bins)
+        num_pairs[i] = np.sum(counts)
+        twosfs[i] = counts + counts.T
     return Spectra(
-        num_samples, windows, recombination_rate, num_sites, num_pairs, onesfs, twosfs
+        num_samples,
+        windows,
+        recombination_rate,
+        len(positions),
+        num_pairs,
+        onesfs,
+        twosfs,
     )
 
 
 # Functions of arrays.
 
 
+# These operate on the last axes, so they also apply to stacked arrays of spectra.
+
+
 def foldonesfs(onesfs: np.ndarray) -> np.ndarray:
     """Fold the SFS so that it represents minor allele frequencies."""
-    n_fold = len(onesfs) // 2
+    n_fold = onesfs.shape[-1] // 2
     folded = np.zeros_like(onesfs)
-    folded[:-n_fold] = onesfs[:-n_fold]
-    folded[:n_fold] += onesfs[: -(n_fold + 1) : -1]
+    folded[..., :-n_fold] = onesfs[..., :-n_fold]
+    folded[..., :n_fold] += onesfs[..., : -(n_fold + 1) : -1]
     return folded
 
 
 def foldtwosfs(twosfs: np.ndarray) -> np.ndarray:
     """Fold the 2SFS so that it represents minor allele frequencies."""
     n_fold = twosfs.shape[-1] // 2
+    rev = slice(None, -(n_fold + 1), -1)
     folded = np.zeros_like(twosfs)
-    folded[:, :-n_fold, :-n_fold] = twosfs[:, :-n_fold, :-n_fold]
-    folded[:, :-n_fold, :n_fold] += twosfs[:, :-n_fold, : -(n_fold + 1) : -1]
-    folded[:, :n_fold, :-n_fold] += twosfs[:, : -(n_fold + 1) : -1, :-n_fold]
-    folded[:, :n_fold, :n_fold] += twosfs[:, : -(n_fold + 1) : -1, : -(n_fold + 1) : -1]
+    folded[..., :-n_fold, :-n_fold] = twosfs[..., :-n_fold, :-n_fold]
+    folded[..., :-n_fold, :n_fold] += twosfs[..., :-n_fold, rev]
+    folded[..., :n_fold, :-n_fold] += twosfs[..., rev, :-n_fold]
+    folded[..., :n_fold, :n_fold] += twosfs[..., rev, rev]
     return folded
 
 
 def lump_onesfs(onesfs: np.ndarray, k_max: int) -> np.ndarray:
     """Lump all sfs bins for k>=k_max into one bin."""
-    onesfs_lumped = np.zeros(k_max + 1)
-    onesfs_lumped[:-1] = onesfs[:k_max]
-    onesfs_lumped[-1] = np.sum(onesfs[k_max:])
+    onesfs_lumped = np.zeros(onesfs.shape[:-1] + (k_max + 1,), dtype=onesfs.dtype)
+    onesfs_lumped[..., :-1] = onesfs[..., :k_max]
+    onesfs_lumped[..., -1] = np.sum(onesfs[..., k_max:], axis=-1)
     return onesfs_lumped
 
 
 def lump_twosfs(twosfs: np.ndarray, k_max: int) -> np.ndarray:
     """Lump all 2-sfs bins for k>=k_max into one bin."""
-    twosfs_lumped = np.zeros((twosfs.shape[0], k_max + 1, k_max + 1))
-    twosfs_lumped[:, :-1, :-1] = twosfs[:, :k_max, :k_max]
-    twosfs_lumped[:, -1, :-1] = np.sum(twosfs[:, k_max:, :k_max], axis=1)
-    twosfs_lumped[:, :-1, -1] = np.sum(twosfs[:, :k_max, k_max:], axis=2)
-    twosfs_lumped[:, -1, -1] = np.sum(twosfs[:, k_max:, k_max:], axis=(1, 2))
+    twosfs_lumped = np.zeros(
+        twosfs.shape[:-2] + (k_max + 1, k_max + 1), dtype=twosfs.dtype
+    )
+    twosfs_lumped[..., :-1, :-1] = twosfs[..., :k_max, :k_max]
+    twosfs_lumped[..., -1, :-1] = np.sum(twosfs[..., k_max:, :k_max], axis=-2)
+    twosfs_lumped[..., :-1, -1] = np.sum(twosfs[..., :k_max, k_max:], axis=-1)
+    twosfs_lumped[..., -1, -1] = np.sum(twosfs[..., k_max:, k_max:], axis=(-2, -1))
     return twosfs_lumped
 
 
 def tajimas_pi(onesfs: np.ndarray) -> float:
     """Compute the average pairwise diversity from an SFS."""
-    n = len(onesfs) - 1
+    n = onesfs.shape[-1] - 1
     k = np.arange(n + 1)
     weights = 2 * k * (n - k) / (n * (n - 1))
     return np.dot(onesfs, weights)
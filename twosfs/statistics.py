@@ -1,13 +1,19 @@
 """Functions for running statistical tests on twosfs."""
+import json
+import os
 from functools import partial
+from hashlib import blake2b
 from typing import Callable, Iterable, Iterator, Optional, Union
 
-import h5py
+import attr
 import numpy as np
-from scipy.constants import golden
 
-from twosfs.simulations import simulate_spectra
-from twosfs.spectra import Spectra, lump_twosfs, spectra_to_hdf5
+from twosfs.instrument import instrumented
+from twosfs.memory import chunk_length, operation_nbytes
+from twosfs.pairs import Source, pair_weights
+from twosfs.precision import DTypeLike, derived_dtype
+from twosfs.progress import Progress, Tracker, track
+from twosfs.spectra import COUNT_DTYPE, Spectra, SpectraBatch, spectra_to_hdf5
 
 
 def search_recombination_rates(
@@ -18,12 +24,215 @@ def search_recombination_rates(
     r_low: float,
     r_high: float,
     num_iters: int,
+    checkpoint_file: Optional[str] = None,
+    method: str = "golden",
+    batch_size: int = 1,
+    workers: int = 1,
+    progress: Optional[Progress] = None,
 ) -> tuple[tuple[float, float, Spectra], tuple[float, float, Spectra]]:
-    """Use golden section search to find the r that minimizes ks distance."""
-    (r_l, r_u), ((ks_l, spec_l), (ks_u, spec_u)) = golden_section_search(
-        simulate_ks, r_low, r_high, num_iters, spectra, k_max, folded, **sim_kwargs
+    """Find the r that minimizes ks distance.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The target spectra.
+    k_max : int
+        The maximum allele count of the lumped 2SFS.
+    folded : bool
+        If True, compare folded 2SFS.
+    sim_kwargs : dict
+        Keyword arguments of `simulate_spectra`, except scaled_recombination_rate.
+    r_low, r_high : float
+        The range of scaled recombination rates to search.
+    num_iters : int
+        With method="golden", the number of golden section iterations. Both
+        methods run num_iters + 2 simulations.
+    checkpoint_file : str, optional
+        If given, every evaluation is recorded there, and a search interrupted
+        with the same arguments resumes after its last evaluation. Requires
+        workers=1.
+    method : str
+        "golden" (default) for golden section search, or "surrogate" for
+        `surrogate_search`, which models the noise of the KS distance.
+    batch_size : int
+        With method="surrogate", the number of simulations per batch.
+    workers : int
+        With method="surrogate", the number of processes simulating a batch.
+    progress : Progress, optional
+        Where to report the simulations done and the best rate and KS distance so
+        far. Defaults to the Progress activated by `twosfs.progress.reporting`.
+
+    Returns
+    -------
+    (r_l, ks_l, spec_l), (r_u, ks_u, spec_u)
+        With method="golden", the final bracket. With method="surrogate", the
+        simulated rates closest to the minimum of the surrogate from below and
+        above.
+
+    Notes
+    -----
+    The simulations are cached as in `simulate_spectra`, so repeating a search
+    with the same seed only recomputes the KS distances.
+    """
+    f = simulate_ks
+    if checkpoint_file is not None:
+        if workers > 1:
+            raise ValueError("Checkpointing requires workers=1.")
+        key = _search_key(
+            spectra,
+            k_max,
+            folded,
+            sim_kwargs,
+            r_low,
+            r_high,
+            num_iters,
+            method,
+            batch_size,
+        )
+        # Surrogate search may return any evaluated point, so keep all spectra.
+        f = SearchCheckpoint(
+            checkpoint_file,
+            key,
+            sim_kwargs.get("random_seed"),
+            keep_all=method == "surrogate",
+        )
+    if method not in ("golden", "surrogate"):
+        raise ValueError("method must be golden or surrogate.")
+    search = partial(
+        _search_recombination_rates,
+        f,
+        spectra,
+        k_max,
+        folded,
+        sim_kwargs,
+        r_low,
+        r_high,
+        num_iters,
+        method,
+        batch_size,
+        workers,
+        progress,
     )
-    return (r_l, ks_l, spec_l), (r_u, ks_u, spec_u)
+    try:
+        return search()
+    except _CheckpointMismatch:
+        # The checkpoint has forgotten its evaluations, so the search starts over.
+        return search()
+
+
+def _search_recombination_rates(
+    f: Callable,
+    spectra: Spectra,
+    k_max: int,
+    folded: bool,
+    sim_kwargs: dict,
+    r_low: float,
+    r_high: float,
+    num_iters: int,
+    method: str,
+    batch_size: int,
+    workers: int,
+    progress: Optional[Progress],
+) -> tuple[tuple[float, float, Spectra], tuple[float, float, Spectra]]:
+    with track(
+        "search_recombination_rates", num_iters + 2, "simulations", progress
+    ) as tracker:
+        if method == "golden":
+            (r_l, r_u), ((ks_l, spec_l), (ks_u, spec_u)) = golden_section_search(
+                partial(_tracked_evaluation, f, tracker),
+                r_low,
+                r_high,
+                num_iters,
+                spectra,
+                k_max,
+                folded,
+                **sim_kwargs,
+            )
+            return (r_l, ks_l, spec_l), (r_u, ks_u, spec_u)
+        return _surrogate_search_rates(
+            f,
+            spectra,
+            k_max,
+            folded,
+            sim_kwargs,
+            r_low,
+            r_high,
+            num_iters + 2,
+            batch_size,
+            workers,
+            tracker,
+        )
+
+
+def _report_evaluation(tracker: Tracker, r: float, ks: float) -> None:
+    if ks < tracker.totals.get("best_ks_distance", np.inf):
+        tracker.update(best_ks_distance=float(ks), best_r=float(r))
+    else:
+        tracker.update()
+
+
+def _tracked_evaluation(f: Callable, tracker: Tracker, r: float, *args, **kwargs):
+    result = f(r, *args, **kwargs)
+    _report_evaluation(tracker, r, result[0])
+    return result
+
+
+def _simulate_ks_task(args: tuple[Callable, float, tuple, dict]):
+    f, r, args, kwargs = args
+    return f(r, *args, **kwargs)
+
+
+def _surrogate_search_rates(
+    f: Callable,
+    spectra: Spectra,
+    k_max: int,
+    folded: bool,
+    sim_kwargs: dict,
+    r_low: float,
+    r_high: float,
+    num_evals: int,
+    batch_size: int,
+    workers: int,
+    tracker: Tracker,
+) -> tuple[tuple[float, float, Spectra], tuple[float, float, Spectra]]:
+    from twosfs.simulations import _seed
+
+    rng = np.random.default_rng(sim_kwargs.get("random_seed"))
+    results: dict[float, tuple[float, Spectra]] = {}
+
+    def evaluate(rs: np.ndarray, map_fn: Callable = map) -> list[float]:
+        # Seeds are drawn here, so that the results do not depend on workers.
+        tasks = [
+            (
+                f,
+                r,
+                (spectra, k_max, folded),
+                sim_kwargs | {"random_seed": int(_seed(rng))},
+            )
+            for r in rs
+        ]
+        for r, result in zip(rs, map_fn(_simulate_ks_task, tasks)):
+            results[r] = result
+            _report_evaluation(tracker, r, result[0])
+        return [results[r][0] for r in rs]
+
+    if workers > 1:
+        from multiprocessing import Pool
+
+        with Pool(workers) as pool:
+            rs, _, r_min = surrogate_search(
+                partial(evaluate, map_fn=pool.map), r_low, r_high, num_evals, batch_size
+            )
+    else:
+        rs, _, r_min = surrogate_search(evaluate, r_low, r_high, num_evals, batch_size)
+    below = [r for r in rs if r <= r_min]
+    above = [r for r in rs if r > r_min]
+    r_l = max(below) if below else sorted(rs)[0]
+    r_u = min(above) if above else sorted(rs)[-1]
+    if r_l == r_u:
+        r_u = sorted(rs)[1] if r_l == min(rs) else sorted(rs)[-2]
+        r_l, r_u = sorted((r_l, r_u))
+    return (float(r_l), *results[r_l]), (float(r_u), *results[r_u])
 
 
 def search_recombination_rates_save(
@@ -35,15 +244,33 @@ def search_recombination_rates_save(
     r_low: float,
     r_high: float,
     num_iters: int,
+    checkpoint: bool = True,
+    **search_kwargs,
 ) -> None:
     """
     Use golden section search to find the r that minimizes ks distance.
 
-    Save output to a file in hdf5 format.
+    Save output to a file in hdf5 format. If checkpoint, evaluations are recorded
+    in `output_file + ".checkpoint"` until the search finishes, so that an
+    interrupted search resumes where it stopped. search_kwargs (method,
+    batch_size, workers) are passed to `search_recombination_rates`.
     """
+    if search_kwargs.get("workers", 1) > 1:
+        checkpoint = False
+    checkpoint_file = f"{output_file}.checkpoint" if checkpoint else None
     (r_l, ks_l, spec_l), (r_h, ks_h, spec_h) = search_recombination_rates(
-        spectra, k_max, folded, sim_kwargs, r_low, r_high, num_iters
+        spectra,
+        k_max,
+        folded,
+        sim_kwargs,
+        r_low,
+        r_high,
+        num_iters,
+        checkpoint_file,
+        **search_kwargs,
     )
+    import h5py
+
     with h5py.File(output_file, "w") as f:
         spectra_to_hdf5(
             spectra,
@@ -62,13 +289,191 @@ def search_recombination_rates_save(
             "spectra_high",
             attrs={"recombination_rate": r_h, "ks_distance": ks_h},
         )
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+
+def _search_key(
+    spectra: Spectra,
+    k_max: int,
+    folded: bool,
+    sim_kwargs: dict,
+    r_low: float,
+    r_high: float,
+    num_iters: int,
+    method: str,
+    batch_size: int,
+) -> str:
+    from twosfs.cache import canonical_json, result_key
 
+    kwargs = dict(sim_kwargs)
+    seed = kwargs.pop("random_seed", None)
+    if isinstance(seed, np.random.Generator):
+        # Generator states hold 128-bit integers, which must not become floats.
+        seed = canonical_json(seed.bit_generator.state)
+    h = blake2b(digest_size=16)
+    for value in spectra.__dict__.values():
+        h.update(np.ascontiguousarray(value, dtype=float).tobytes())
+    return result_key(
+        "search_recombination_rates",
+        h.hexdigest(),
+        k_max,
+        folded,
+        kwargs,
+        seed,
+        r_low,
+        r_high,
+        num_iters,
+        method,
+        batch_size,
+    )
+
+
+class _CheckpointMismatch(Exception):
+    pass
+
+
+@attr.s(eq=False)
+class _Evaluation(object):
+    r: float = attr.ib()
+    ks_distance: float = attr.ib()
+    rng_state: Optional[str] = attr.ib()
+    spectra: Optional[Spectra] = attr.ib()
+
+
+class SearchCheckpoint(object):
+    """
+    Wraps simulate_ks and records its evaluations in an hdf5 file.
+
+    On the first calls, recorded evaluations are replayed instead of simulated, and
+    after the last of them the state of rng is restored. Unless keep_all, only the
+    spectra of the latest evaluation and of the best of the others are kept, which
+    are the points of the bracket of golden section search and the only ones it
+    can return. A file recorded with a different key is ignored. If a call does not
+    match its recorded evaluation, all of them are forgotten, the state of rng is
+    reset and `_CheckpointMismatch` is raised, so that the search can start over.
+
+    Parameters
+    ----------
+    path : str
+        The checkpoint file.
+    key : str
+        Identifies the search, e.g. a hash of its arguments.
+    rng : numpy.random.Generator, optional
+        The generator used by the simulations.
+    keep_all : bool
+        If True, keep the spectra of every evaluation.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        key: str,
+        rng: Optional[np.random.Generator],
+        keep_all: bool = False,
+    ):
+        self.path = path
+        self.key = key
+        self.rng = rng if isinstance(rng, np.random.Generator) else None
+        self.keep_all = keep_all
+        self.initial_state = self.rng.bit_generator.state if self.rng else None
+        self.evaluations = self._load()
+        self.num_calls = 0
+
+    def _load(self) -> list[_Evaluation]:
+        import h5py
+
+        from twosfs.spectra import spectra_from_hdf5
 
+        if not os.path.exists(self.path):
+            return []
+        evaluations = []
+        with h5py.File(self.path, "r") as f:
+            if f.attrs.get("key") != self.key:
+                return []
+            for i in range(f.attrs["num_evaluations"]):
+                group = f[f"evaluation_{i}"]
+                evaluations.append(
+                    _Evaluation(
+                        float(group.attrs["r"]),
+                        float(group.attrs["ks_distance"]),
+                        group.attrs.get("rng_state"),
+                        spectra_from_hdf5(group["spectra"])
+                        if "spectra" in group
+                        else None,
+                    )
+                )
+        return evaluations
+
+    def _save(self) -> None:
+        import h5py
+
+        last = len(self.evaluations) - 1
+        best = min((e.ks_distance for e in self.evaluations[:last]), default=None)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with h5py.File(tmp_path, "w") as f:
+            f.attrs["key"] = self.key
+            f.attrs["num_evaluations"] = len(self.evaluations)
+            for i, e in enumerate(self.evaluations):
+                group = f.create_group(f"evaluation_{i}")
+                group.attrs["r"] = e.r
+                group.attrs["ks_distance"] = e.ks_distance
+                if e.rng_state is not None:
+                    group.attrs["rng_state"] = e.rng_state
+                keep = self.keep_all or i == last or e.ks_distance == best
+                if keep and e.spectra is not None:
+                    spectra_to_hdf5(e.spectra, group, "spectra")
+        os.replace(tmp_path, self.path)
+
+    def __call__(
+        self, r: float, spectra: Spectra, k_max: int, folded: bool, **simulation_kwargs
+    ) -> tuple[float, Optional[Spectra]]:
+        """Replay or compute `simulate_ks(r, spectra, k_max, folded, ...)`."""
+        from twosfs.cache import canonical_json
+
+        i = self.num_calls
+        self.num_calls += 1
+        if i < len(self.evaluations):
+            e = self.evaluations[i]
+            if not np.isclose(e.r, r):
+                self.evaluations = []
+                self.num_calls = 0
+                if self.rng:
+                    self.rng.bit_generator.state = self.initial_state
+                raise _CheckpointMismatch(self.path)
+            if i == len(self.evaluations) - 1 and self.rng and e.rng_state:
+                self.rng.bit_generator.state = json.loads(e.rng_state)
+            return e.ks_distance, e.spectra
+        ks, spectra_sim = simulate_ks(r, spectra, k_max, folded, **simulation_kwargs)
+        rng_state = canonical_json(self.rng.bit_generator.state) if self.rng else None
+        self.evaluations.append(_Evaluation(r, ks, rng_state, spectra_sim))
+        self._save()
+        return ks, spectra_sim
+
+
+@instrumented
 def simulate_ks(
     r: float, spectra: Spectra, k_max: int, folded: bool, **simulation_kwargs
 ) -> tuple[float, Spectra]:
     """Simulate a Spectra and compute its KS distance to the supplied Spectra."""
+    from twosfs.simulations import simulate_spectra
+
     spectra_sim = simulate_spectra(scaled_recombination_rate=r, **simulation_kwargs)
+    return spectra_ks_distance(spectra, spectra_sim, k_max, folded), spectra_sim
+
+
+@instrumented
+def spectra_ks_distance(
+    spectra: Spectra, spectra_sim: Spectra, k_max: int, folded: bool
+) -> float:
+    """Compute the KS distance between the twosfs of spectra and spectra_sim.
+
+    Windows are weighted by spectra.num_pairs.
+
+    To simulate until the KS distance is precise, pass
+    `partial(spectra_ks_distance, spectra, k_max=k_max, folded=folded)` as the
+    statistic of `simulate_spectra_adaptive`.
+    """
     twosfs_orig = reweight_and_symmetrize(
         twosfs_pdf(spectra, k_max, folded)[: len(spectra_sim.num_pairs)],
         spectra.num_pairs,
@@ -77,7 +482,7 @@ def simulate_ks(
         twosfs_pdf(spectra_sim, k_max, folded),
         spectra.num_pairs,
     )
-    return max_ks_distance(twosfs_orig, twosfs_sim), spectra_sim
+    return max_ks_distance(twosfs_orig, twosfs_sim)
 
 
 def sample_onesfs(spectra: Spectra, num_sites: int, rng: Optional[np.random.Generator]):
@@ -92,24 +497,28 @@ def sample_onesfs(spectra: Spectra, num_sites: int, rng: Optional[np.random.Gene
 def sample_twosfs(
     spectra: Spectra, num_pairs: np.ndarray, rng: Optional[np.random.Generator]
 ):
-    """Take a random sample of num_pairs from the twosfs."""
+    """Take a random sample of num_pairs from the twosfs. Return integer counts."""
     if rng:
         gen = rng
     else:
         gen = np.random.default_rng()
-    twosfs_sampled = np.zeros_like(spectra.twosfs)
-    for i, (n, p) in enumerate(zip(num_pairs, spectra.normalized_twosfs())):
-        twosfs_sampled[i] = gen.binomial(n, p)
-    return twosfs_sampled
+    n = np.asarray(num_pairs).astype(int)
+    return gen.binomial(n[:, None, None], spectra.normalized_twosfs())
 
 
+@instrumented
 def sample_spectra(
     spectra: Spectra,
     num_sites: Optional[int] = None,
     num_pairs: Optional[np.ndarray] = None,
     rng: Optional[np.random.Generator] = None,
+    counts: bool = False,
 ) -> Spectra:
-    """Resample the one- and twosfs from a spectra. Return a new spectra."""
+    """Resample the one- and twosfs from a spectra. Return a new spectra.
+
+    If counts, the new spectra stores exact integer counts of dtype COUNT_DTYPE,
+    which requires the arrays that are not resampled to be whole numbers.
+    """
     if num_sites is None:
         num_sites_new = spectra.num_sites
         onesfs_new = spectra.onesfs.copy()
@@ -122,22 +531,97 @@ def sample_spectra(
     else:
         num_pairs_new = num_pairs
         twosfs_new = sample_twosfs(spectra, num_pairs, rng)
-    return Spectra(
+    resampled = Spectra.from_arrays_unchecked(
+        num_samples=spectra.num_samples,
+        windows=spectra.windows,
+        recombination_rate=spectra.recombination_rate,
+        num_sites=float(num_sites_new),
+        num_pairs=np.array(num_pairs_new, dtype=float),
+        onesfs=np.asarray(onesfs_new, dtype=float),
+        twosfs=np.asarray(twosfs_new, dtype=float),
+    )
+    return resampled.astype(COUNT_DTYPE) if counts else resampled
+
+
+def sample_spectra_batch(
+    spectra: Spectra,
+    num_pairs: np.ndarray,
+    reps: int,
+    rng: Optional[np.random.Generator] = None,
+    num_sites: Optional[int] = None,
+    multinomial: bool = False,
+) -> SpectraBatch:
+    """Resample the one- and twosfs from a spectra reps times.
+
+    All windows and replicates are drawn together.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The spectra to resample.
+    num_pairs : ndarray
+        The number of pairs to sample in each window.
+    reps : int
+        The number of replicates.
+    rng : numpy.random.Generator, optional
+        The random number generator.
+    num_sites : int, optional
+        The number of sites to sample for the onesfs. If None, keep the onesfs.
+    multinomial : bool
+        If True, draw exactly num_pairs pairs per window from a multinomial
+        distribution. Otherwise (default), draw each 2SFS entry independently from a
+        binomial distribution, as `sample_spectra` does.
+
+    Returns
+    -------
+    SpectraBatch
+    """
+    if rng:
+        gen = rng
+    else:
+        gen = np.random.default_rng()
+    num_pairs = np.asarray(num_pairs)
+    if num_sites is None:
+        num_sites_new = np.full(reps, spectra.num_sites)
+        onesfs_new = np.broadcast_to(spectra.onesfs, (reps,) + spectra.onesfs.shape)
+    else:
+        num_sites_new = np.full(reps, num_sites)
+        onesfs_new = gen.binomial(
+            num_sites, spectra.normalized_onesfs(), size=(reps,) + spectra.onesfs.shape
+        )
+    pdfs = spectra.normalized_twosfs()
+    if multinomial:
+        twosfs_new = np.zeros((reps,) + pdfs.shape)
+        for i, (n, p) in enumerate(zip(num_pairs, pdfs)):
+            total = np.sum(p)
+            if n > 0 and total > 0:
+                twosfs_new[:, i] = gen.multinomial(
+                    int(n), p.ravel() / total, size=reps
+                ).reshape((reps,) + p.shape)
+    else:
+        twosfs_new = gen.binomial(
+            num_pairs.astype(int)[:, None, None], pdfs, size=(reps,) + pdfs.shape
+        )
+    return SpectraBatch(
         num_samples=spectra.num_samples,
         windows=spectra.windows,
         recombination_rate=spectra.recombination_rate,
         num_sites=num_sites_new,
-        num_pairs=num_pairs_new,
+        num_pairs=np.broadcast_to(num_pairs, (reps,) + num_pairs.shape),
         onesfs=onesfs_new,
         twosfs=twosfs_new,
     )
 
 
+# The golden ratio
+GOLDEN = (1 + np.sqrt(5)) / 2
+
+
 def golden_section_search(
     f: Callable, a: float, b: float, num_iters: int, *args, **kwargs
 ):
     """Minimize a scalar function by golden section search."""
-    lamb = 1 / golden
+    lamb = 1 / GOLDEN
     x_l = a + (b - a) * (1 - lamb)
     f_l = f(x_l, *args, **kwargs)
     x_u = a + (b - a) * lamb
@@ -158,11 +642,144 @@ def golden_section_search(
     return (x_l, x_u), (f_l, f_u)
 
 
+def surrogate_search(
+    evaluate: Callable[[np.ndarray], list[float]],
+    a: float,
+    b: float,
+    num_evals: int,
+    batch_size: int = 1,
+    num_initial: Optional[int] = None,
+    num_candidates: int = 201,
+) -> tuple[np.ndarray, np.ndarray, float]:
+    """Minimize a noisy scalar function with a Gaussian process surrogate.
+
+    After an evenly spaced initial design, each batch of points maximizes the
+    expected improvement over the lowest posterior mean. Later points of a batch
+    are chosen as if the earlier ones had returned their posterior mean. No point
+    is evaluated twice, so the search stops early if every candidate has been.
+
+    Parameters
+    ----------
+    evaluate : Callable
+        Takes an array of points and returns a list of function values. The
+        points of a batch can be evaluated in parallel.
+    a, b : float
+        The search interval.
+    num_evals : int
+        The total number of function evaluations.
+    batch_size : int
+        The number of points evaluated per call of evaluate.
+    num_initial : int, optional
+        The size of the initial design. Defaults to max(3, batch_size).
+    num_candidates : int
+        The number of grid points on which the surrogate is optimized.
+
+    Returns
+    -------
+    xs : ndarray
+        The evaluated points, all distinct.
+    ys : ndarray
+        The function values at xs.
+    x_min : float
+        The minimum of the posterior mean of the surrogate.
+    """
+    if num_initial is None:
+        num_initial = max(3, batch_size)
+    num_initial = min(num_initial, num_evals)
+    xs = a + (b - a) * (np.arange(num_initial) + 0.5) / num_initial
+    ys = np.asarray(evaluate(xs), dtype=float)
+    candidates = np.linspace(a, b, num_candidates)
+    unused = ~np.isclose(candidates[:, None], xs).any(axis=1)
+    while len(xs) < num_evals and np.any(unused):
+        gp = _GaussianProcess.fit((xs - a) / (b - a), ys)
+        batch: list[float] = []
+        for _ in range(min(batch_size, num_evals - len(xs), np.sum(unused))):
+            improvement = gp.expected_improvement(candidates, a, b)
+            i = np.argmax(np.where(unused, improvement, -np.inf))
+            unused[i] = False
+            batch.append(candidates[i])
+            gp = gp.condition(np.array([(candidates[i] - a) / (b - a)]))
+        batch_xs = np.array(batch)
+        xs = np.concatenate([xs, batch_xs])
+        ys = np.concatenate([ys, np.asarray(evaluate(batch_xs), dtype=float)])
+    gp = _GaussianProcess.fit((xs - a) / (b - a), ys)
+    mean, _ = gp.predict((candidates - a) / (b - a))
+    return xs, ys, float(candidates[np.argmin(mean)])
+
+
+class _GaussianProcess(object):
+    # A GP with a squared exponential kernel on [0, 1] and standardized outputs.
+
+    length_scales = (0.1, 0.2, 0.4, 0.8)
+    noise_levels = (1e-4, 1e-2, 0.1, 0.3, 1.0)
+
+    def __init__(self, x, y, length_scale, noise, y_mean, y_std):
+        self.x = x
+        self.y = y
+        self.length_scale = length_scale
+        self.noise = noise
+        self.y_mean = y_mean
+        self.y_std = y_std
+        kernel = self._kernel(x, x) + noise * np.eye(len(x))
+        self.cholesky = np.linalg.cholesky(kernel)
+        self.weights = np.linalg.solve(
+            self.cholesky.T, np.linalg.solve(self.cholesky, y)
+        )
+
+    @classmethod
+    def fit(cls, x: np.ndarray, y: np.ndarray) -> "_GaussianProcess":
+        # Choose hyperparameters on a grid by marginal likelihood.
+        y_mean = np.mean(y)
+        y_std = np.std(y) or 1.0
+        z = (y - y_mean) / y_std
+        best, best_ll = None, -np.inf
+        for length_scale in cls.length_scales:
+            for noise in cls.noise_levels:
+                gp = cls(x, z, length_scale, noise, y_mean, y_std)
+                ll = -0.5 * z @ gp.weights - np.sum(np.log(np.diag(gp.cholesky)))
+                if ll > best_ll:
+                    best, best_ll = gp, ll
+        return best
+
+    def _kernel(self, x1, x2):
+        return np.exp(-0.5 * ((x1[:, None] - x2[None, :]) / self.length_scale) ** 2)
+
+    def predict(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        k = self._kernel(x, self.x)
+        mean = k @ self.weights
+        v = np.linalg.solve(self.cholesky, k.T)
+        var = np.clip(1 - np.sum(v ** 2, axis=0), 1e-12, None)
+        return mean * self.y_std + self.y_mean, np.sqrt(var) * self.y_std
+
+    def condition(self, x_new: np.ndarray) -> "_GaussianProcess":
+        mean, _ = self.predict(x_new)
+        y = np.concatenate([self.y, (mean - self.y_mean) / self.y_std])
+        return _GaussianProcess(
+            np.concatenate([self.x, x_new]),
+            y,
+            self.length_scale,
+            self.noise,
+            self.y_mean,
+            self.y_std,
+        )
+
+    def expected_improvement(self, candidates, a, b) -> np.ndarray:
+        from scipy.special import ndtr
+
+        mean, std = self.predict((candidates - a) / (b - a))
+        best = np.min(self.predict(self.x)[0])
+        z = (best - mean) / std
+        return (best - mean) * ndtr(z) + std * np.exp(-0.5 * z ** 2) / np.sqrt(
+            2 * np.pi
+        )
+
+
 def ks_distance(cdf1: np.ndarray, cdf2: np.ndarray) -> float:
     """Compute the KS distance between two CDFs."""
     return np.max(np.abs(cdf1 - cdf2))
 
 
+@instrumented
 def max_ks_distance(pdf1: np.ndarray, pdf2: np.ndarray) -> float:
     """Compute the maximum KS distance between two (multidimensional) PDFs."""
     return max(
@@ -170,47 +787,278 @@ def max_ks_distance(pdf1: np.ndarray, pdf2: np.ndarray) -> float:
     )
 
 
+@instrumented
+def batch_max_ks_distance(pdfs: np.ndarray, pdf: np.ndarray) -> np.ndarray:
+    """Compute the maximum KS distance between each of a stack of PDFs and pdf.
+
+    The first axis of pdfs indexes the batch. The remaining axes must match pdf.
+    """
+    axes = tuple(range(1, pdfs.ndim))
+    return np.max(
+        [
+            np.max(np.abs(cdf1 - cdf2), axis=axes)
+            for cdf1, cdf2 in zip(_all_cdfs(pdfs, pdf.ndim), _all_cdfs(pdf))
+        ],
+        axis=0,
+    )
+
+
 def empirical_pvals(values: np.ndarray, comparisons: list[np.ndarray]):
     """Compute the rank of a value in an array of comparisons with pseudocounts."""
+    comparisons = np.asarray(comparisons)
     return (1 + np.sum(comparisons > values, axis=0)) / (2 + len(comparisons))
 
 
-def resample_pdf(pdf: np.ndarray, n_obs: int) -> np.ndarray:
-    """Multinomial resample discrete pdf."""
-    rand_counts = np.random.multinomial(n_obs, pdf.ravel()).reshape(pdf.shape)
+def _sorted_array(value) -> np.ndarray:
+    return np.sort(np.array(value, dtype=float).ravel())
+
+
+@attr.s(eq=False)
+class NullDistribution(object):
+    """
+    Stores samples of a statistic under the null hypothesis for computing p-values.
+
+    Attributes
+    ----------
+    samples : ndarray
+        The sorted null samples.
+    """
+
+    samples: np.ndarray = attr.ib(converter=_sorted_array)
+
+    def __len__(self) -> int:
+        """Return the number of null samples."""
+        return len(self.samples)
+
+    def num_greater(self, values) -> np.ndarray:
+        """Count the null samples strictly greater than each value."""
+        return len(self.samples) - np.searchsorted(self.samples, values, side="right")
+
+    def pvals(self, values) -> np.ndarray:
+        """Compute upper-tail p-values with pseudocounts.
+
+        Matches `empirical_pvals(values, samples)` for scalar samples, but takes
+        O(log n) per value.
+        """
+        return (1 + self.num_greater(values)) / (2 + len(self.samples))
+
+    def power(self, values, alpha: float = 0.05) -> float:
+        """Return the fraction of values that reject the null at level alpha."""
+        return float(np.mean(self.pvals(values) < alpha))
+
+    def save(self, output_file, format: str = "hdf5", name: str = "null") -> None:
+        """Save the null distribution to a file.
+
+        Parameters
+        ----------
+        output_file :
+            May be a filename string or a file handle.
+        format : str
+            May be "hdf5" (default) or "npz")
+        name : str
+            If format is "hdf5", the name of the dataset (default=null)
+        """
+        if format == "hdf5":
+            import h5py
+
+            with h5py.File(output_file, "w") as f:
+                f.create_dataset(name, data=self.samples)
+        elif format == "npz":
+            np.savez_compressed(output_file, samples=self.samples)
+        else:
+            raise ValueError("format must be hdf5 or npz.")
+
+
+def load_null_distribution(
+    input_file, format: str = "hdf5", name: str = "null"
+) -> NullDistribution:
+    """Read a NullDistribution from file. Format may be hdf5 or npz."""
+    if format == "hdf5":
+        import h5py
+
+        with h5py.File(input_file, "r") as f:
+            return NullDistribution(f[name][()])
+    elif format == "npz":
+        with np.load(input_file) as data:
+            return NullDistribution(data["samples"])
+    else:
+        raise ValueError("format must be hdf5 or npz.")
+
+
+def resample_pdf(
+    pdf: np.ndarray, n_obs: int, rng: Optional[np.random.Generator] = None
+) -> np.ndarray:
+    """Multinomial resample discrete pdf.
+
+    Without rng, draws from numpy's global random state, as seeded by
+    np.random.seed.
+    """
+    rand_counts = resample_pdf_counts(pdf, n_obs, 1, rng)[0]
     return rand_counts / np.sum(rand_counts)
 
 
+def resample_pdf_counts(
+    pdf: np.ndarray,
+    n_obs: int,
+    num_replicates: int,
+    rng: Optional[np.random.Generator] = None,
+) -> np.ndarray:
+    """Draw num_replicates multinomial samples of n_obs from a discrete pdf.
+
+    The counts have shape (num_replicates, *pdf.shape) and are drawn as in
+    `resample_pdf_sparse`, with the same results for the same rng, but tallied
+    directly into a dense array.
+    """
+    n_obs = int(n_obs)
+    p = _sampling_probabilities(pdf)
+    shape = (num_replicates, *pdf.shape)
+    if rng is not None and n_obs < p.size:
+        keys = _draw_keys(p, n_obs, num_replicates, rng)
+        return np.bincount(keys, minlength=num_replicates * p.size).reshape(shape)
+    return _multinomial(p, n_obs, num_replicates, rng).reshape(shape)
+
+
+def _sampling_probabilities(pdf: np.ndarray) -> np.ndarray:
+    # Sampling probabilities are float64 whatever the precision of pdf.
+    p = np.asarray(pdf, dtype=float).ravel()
+    return p / np.sum(p)
+
+
+def _draw_keys(
+    p: np.ndarray, n_obs: int, num_replicates: int, rng: np.random.Generator
+) -> np.ndarray:
+    # Draw observations by inverting the CDF. Return replicate * p.size + cell.
+    cdf = np.cumsum(p)
+    # Rounding must not send draws past the last cell with positive probability.
+    cdf[np.flatnonzero(p)[-1] :] = 1.0
+    cells = np.searchsorted(cdf, rng.random((num_replicates, n_obs)), side="right")
+    return (np.arange(num_replicates)[:, None] * p.size + cells).ravel()
+
+
+def _multinomial(
+    p: np.ndarray, n_obs: int, num_replicates: int, rng: Optional[np.random.Generator]
+) -> np.ndarray:
+    if rng is None:
+        return np.random.multinomial(n_obs, p, size=num_replicates)
+    return rng.multinomial(n_obs, p, size=num_replicates)
+
+
+@attr.s(eq=False)
+class SparseCounts(object):
+    """
+    Stores replicate multinomial counts as (replicate, cell, count) triples.
+
+    Only nonzero counts are stored.
+
+    Attributes
+    ----------
+    shape : tuple
+        The shape of the dense counts, (num_replicates, *pdf.shape)
+    replicates : ndarray
+        The replicate index of each nonzero count
+    cells : ndarray
+        The flat index into the pdf of each nonzero count
+    counts : ndarray
+        The nonzero counts
+    """
+
+    shape: tuple = attr.ib(converter=tuple)
+    replicates: np.ndarray = attr.ib()
+    cells: np.ndarray = attr.ib()
+    counts: np.ndarray = attr.ib()
+
+    def totals(self) -> np.ndarray:
+        """Return the total count of each replicate."""
+        return np.bincount(
+            self.replicates, weights=self.counts, minlength=self.shape[0]
+        )
+
+    def to_dense(self) -> np.ndarray:
+        """Return the counts as an array of shape self.shape."""
+        dense = np.zeros((self.shape[0], int(np.prod(self.shape[1:]))), dtype=int)
+        dense[self.replicates, self.cells] = self.counts
+        return dense.reshape(self.shape)
+
+
+def resample_pdf_sparse(
+    pdf: np.ndarray,
+    n_obs: int,
+    num_replicates: int,
+    rng: Optional[np.random.Generator] = None,
+) -> SparseCounts:
+    """Draw num_replicates multinomial samples of n_obs from a discrete pdf.
+
+    When n_obs is smaller than the number of cells, individual observations are
+    drawn by inverting the CDF and tallied, which avoids work on empty cells.
+    Otherwise all replicates are drawn in one multinomial call. Without rng, they
+    are drawn from numpy's global random state, as seeded by np.random.seed, with
+    one multinomial call.
+    """
+    n_obs = int(n_obs)
+    p = _sampling_probabilities(pdf)
+    shape = (num_replicates, *pdf.shape)
+    if rng is not None and n_obs < p.size:
+        keys, counts = np.unique(
+            _draw_keys(p, n_obs, num_replicates, rng), return_counts=True
+        )
+        return SparseCounts(shape, keys // p.size, keys % p.size, counts)
+    dense = _multinomial(p, n_obs, num_replicates, rng)
+    replicates, cells = np.nonzero(dense)
+    return SparseCounts(shape, replicates, cells, dense[replicates, cells])
+
+
 def symmetrize(pdf: np.ndarray) -> np.ndarray:
-    """Return a symmetrized version of a 2D pdf."""
-    return (pdf + pdf.T) / 2
+    """Return a symmetrized version of a 2D pdf (or a stack of 2D pdfs)."""
+    return (pdf + np.swapaxes(pdf, -1, -2)) / 2
 
 
-def twosfs_pdf(spectra: Spectra, k_max: int, folded: bool) -> np.ndarray:
-    """Get the twosfs for segregating sites as a normalized 2D pdf."""
-    ret = lump_twosfs(spectra.normalized_twosfs(folded=folded), k_max)[:, 1:, 1:]
-    return ret / np.sum(ret)
+@instrumented
+def twosfs_pdf(
+    spectra: Union[Spectra, SpectraBatch],
+    k_max: int,
+    folded: bool,
+    dtype: Optional[DTypeLike] = None,
+) -> np.ndarray:
+    """Get the twosfs for segregating sites as a normalized 2D pdf.
 
+    For a SpectraBatch, each Spectra is normalized separately. The pdf has the
+    dtype given by `twosfs.precision.derived_dtype(dtype)`.
+    """
+    normed = spectra.normalized_twosfs(folded=folded, k_max=k_max, dtype=dtype)
+    ret = normed[..., 1:, 1:]
+    return ret / np.sum(ret, axis=(-3, -2, -1), keepdims=True)
 
-def resample_marginal_pdfs(pdfs: np.ndarray, n_obs: Iterable[int]) -> np.ndarray:
+
+def resample_marginal_pdfs(
+    pdfs: np.ndarray, n_obs: Iterable[int], rng: Optional[np.random.Generator] = None
+) -> np.ndarray:
     """Resample 2D PDFs along the first axis of a 3D array."""
-    return np.array([resample_pdf(pdf / np.sum(pdf), n) for pdf, n in zip(pdfs, n_obs)])
+    return np.array([resample_pdf(pdf, n, rng) for pdf, n in zip(pdfs, n_obs)])
 
 
+@instrumented
 def reweight_and_symmetrize(pdf: np.ndarray, weights: Iterable[float]) -> np.ndarray:
-    """Reweight 3D pdf along first dimension by weights and symmetrize."""
-    ret = np.array([symmetrize(p) * w for p, w in zip(pdf, weights)])
-    return ret / np.sum(ret)
+    """Reweight 3D pdf along first dimension by weights and symmetrize.
+
+    Extra leading axes of pdf are treated as batch axes. If pdf and weights differ
+    in length, the longer one is truncated. A float32 pdf stays float32.
+    """
+    w = np.array(list(weights), dtype=np.result_type(pdf.dtype, np.float32))
+    num_windows = min(pdf.shape[-3], len(w))
+    ret = symmetrize(pdf[..., :num_windows, :, :]) * w[:num_windows, None, None]
+    return ret / np.sum(ret, axis=(-3, -2, -1), keepdims=True)
 
 
 def degenerate_pairs(spectra: Spectra, max_distance: int) -> np.ndarray:
-    """Return an array with ones at 4-fold degenerate distances up to max_distance."""
-    ret = np.zeros(len(spectra.windows) - 1)
-    for i in range(3, max_distance + 1, 3):
-        ret[i] = 1
-    return ret
+    """Return an array with ones at 4-fold degenerate distances up to max_distance.
+
+    These are the codon weights of `twosfs.pairs.pair_weights` for windows of
+    length one.
+    """
+    return np.array(pair_weights(spectra.windows, max_distance, "codon"))
 
 
+@instrumented
 def sample_ks_statistics(
     spectra_comp: Spectra,
     spectra_null: Spectra,
@@ -218,25 +1066,67 @@ def sample_ks_statistics(
     folded: bool,
     n_reps: int,
     num_pairs: np.ndarray,
+    rng: Optional[np.random.Generator] = None,
+    chunk_size: int = 100,
+    dtype: Optional[DTypeLike] = None,
 ) -> np.ndarray:
-    """Sample 2-SFS KS statistics between spectra_comp and spectra_null."""
+    """Sample 2-SFS KS statistics between spectra_comp and spectra_null.
+
+    Replicates are resampled and compared chunk_size at a time, or fewer if
+    chunk_size replicates would exceed the memory budget (see `twosfs.memory`).
+    The pdfs and their CDFs have the dtype given by
+    `twosfs.precision.derived_dtype(dtype)`. Without rng, the replicates are drawn
+    from numpy's global random state, as seeded by np.random.seed.
+    """
+    dtype = derived_dtype(dtype)
     nonzero = num_pairs > 0
     np_nz = num_pairs[nonzero]
     twosfs_comp = reweight_and_symmetrize(
-        twosfs_pdf(spectra_comp, k_max, folded)[nonzero], np_nz
+        twosfs_pdf(spectra_comp, k_max, folded, dtype)[nonzero], np_nz
     )
     twosfs_null = reweight_and_symmetrize(
-        twosfs_pdf(spectra_null, k_max, folded)[nonzero], np_nz
+        twosfs_pdf(spectra_null, k_max, folded, dtype)[nonzero], np_nz
+    )
+    chunk_size = min(
+        chunk_size,
+        chunk_length(
+            n_reps,
+            operation_nbytes("resample", spectra_comp.num_samples, len(np_nz), k_max),
+            "sample_ks_statistics",
+        ),
     )
     ks_values = np.zeros(n_reps)
-    for i in range(n_reps):
-        resampled = reweight_and_symmetrize(
-            resample_marginal_pdfs(twosfs_comp, np_nz), np_nz
+    for start in range(0, n_reps, chunk_size):
+        size = min(chunk_size, n_reps - start)
+        resampled = np.stack(
+            [
+                np.divide(resample_pdf_counts(pdf, n, size, rng), int(n), dtype=dtype)
+                for pdf, n in zip(twosfs_comp, np_nz)
+            ],
+            axis=1,
+        )
+        ks_values[start : start + size] = batch_max_ks_distance(
+            reweight_and_symmetrize(resampled, np_nz), twosfs_null
         )
-        ks_values[i] = max_ks_distance(resampled, twosfs_null)
     return ks_values * np.sqrt(sum(np_nz))
 
 
+def ks_null_distribution(
+    spectra_null: Spectra,
+    k_max: int,
+    folded: bool,
+    n_reps: int,
+    num_pairs: np.ndarray,
+    rng: Optional[np.random.Generator] = None,
+) -> NullDistribution:
+    """Sample the distribution of 2-SFS KS statistics under spectra_null."""
+    return NullDistribution(
+        sample_ks_statistics(
+            spectra_null, spectra_null, k_max, folded, n_reps, num_pairs, rng
+        )
+    )
+
+
 def _axis_combinations(n_dims: int) -> list[tuple]:
     if n_dims <= 0:
         return [()]
@@ -245,18 +1135,27 @@ def _axis_combinations(n_dims: int) -> list[tuple]:
         return sublist + [(*t, n_dims - 1) for t in sublist]
 
 
-def _cumsum_all_axes(x: np.ndarray, axis: Optional[int] = None) -> np.ndarray:
+def _cumsum_all_axes(
+    x: np.ndarray, axis: Optional[int] = None, first_axis: int = 0
+) -> np.ndarray:
     if axis is None:
         axis = x.ndim - 1
-    if axis < 0:
+    if axis < first_axis:
         return x
     else:
-        return np.cumsum(_cumsum_all_axes(x, axis=axis - 1), axis=axis)
+        return np.cumsum(_cumsum_all_axes(x, axis - 1, first_axis), axis=axis)
 
 
-def _all_cdfs(pdf: np.ndarray) -> list[np.ndarray]:
-    flips = [partial(np.flip, axis=axes) for axes in _axis_combinations(pdf.ndim)]
-    return [flip(_cumsum_all_axes(flip(pdf))) for flip in flips]
+def _all_cdfs(pdf: np.ndarray, n_dims: Optional[int] = None) -> list[np.ndarray]:
+    # Compute CDFs over the last n_dims axes (default: all axes).
+    if n_dims is None:
+        n_dims = pdf.ndim
+    offset = pdf.ndim - n_dims
+    flips = [
+        partial(np.flip, axis=tuple(a + offset for a in axes))
+        for axes in _axis_combinations(n_dims)
+    ]
+    return [flip(_cumsum_all_axes(flip(pdf), first_axis=offset)) for flip in flips]
 
 
 def scan_parameters(
@@ -267,16 +1166,34 @@ def scan_parameters(
     k_max: int,
     folded: bool,
     n_reps: int,
+    rng: Optional[np.random.Generator] = None,
+    progress: Optional[Progress] = None,
+    pair_scheme: str = "codon",
+    pair_source: Source = None,
 ) -> Iterator[dict[str, Union[int, list[float]]]]:
-    """Compute resampled KS stats scanning over pair densities and max distances."""
-    for pd in pair_densities:
-        for md in max_distances:
-            num_pairs = pd * degenerate_pairs(spectra_comp, md)
-            ks = sample_ks_statistics(
-                spectra_comp, spectra_null, k_max, folded, n_reps, num_pairs
-            )
-            yield {
-                "pair_density": pd,
-                "max_distance": md,
-                "ks_stats": list(ks),
-            }
+    """Compute resampled KS stats scanning over pair densities and max distances.
+
+    The number of pairs in each window is the pair density times the weights of
+    `twosfs.pairs.pair_weights` with pair_scheme and pair_source. Without rng,
+    the replicates are drawn from numpy's global random state. Progress is
+    reported in resampled replicates, to progress or the Progress activated by
+    `twosfs.progress.reporting`.
+    """
+    pair_densities = list(pair_densities)
+    max_distances = list(max_distances)
+    total = len(pair_densities) * len(max_distances) * n_reps
+    with track("scan_parameters", total, "replicates", progress) as tracker:
+        for pd in pair_densities:
+            for md in max_distances:
+                num_pairs = pd * pair_weights(
+                    spectra_comp.windows, md, pair_scheme, pair_source
+                )
+                ks = sample_ks_statistics(
+                    spectra_comp, spectra_null, k_max, folded, n_reps, num_pairs, rng
+                )
+                tracker.update(n_reps, pair_density=pd, max_distance=md)
+                yield {
+                    "pair_density": pd,
+                    "max_distance": md,
+                    "ks_stats": list(ks),
+                }
@@ -0,0 +1,219 @@
+"""A long-lived process that runs workflow jobs without re-importing the package.
+
+Jobs are JSON objects, one per line::
+
+    {"id": 1, "job": "add", "kwargs": {"inputs": ["a.hdf5", "b.hdf5"], "output": "c"}}
+
+The worker answers each job with one line::
+
+    {"id": 1, "ok": true, "elapsed": 0.12}
+
+or, if the job raised an exception::
+
+    {"id": 1, "ok": false, "error": "FileNotFoundError: ..."}
+
+Job names are the keys of `twosfs.jobs.JOBS`, plus "ping". The worker reads jobs
+from stdin (`python -m twosfs.worker stdio`) or from a Unix socket
+(`python -m twosfs.worker serve --socket PATH [--workers N]`). Jobs run in
+persistent processes: the server itself, or a fixed pool of N pre-warmed
+processes that run the jobs of concurrent connections in parallel. Because
+modules and caches, such as the expected T2 of demographies and the last spectra
+read by `twosfs.jobs.load_spectra_cached`, stay loaded between jobs, small jobs
+are dominated by their actual work.
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from contextlib import suppress
+from typing import IO, Any, Optional
+
+# Environment variable naming the socket of a running worker.
+SOCKET_VARIABLE = "TWOSFS_WORKER_SOCKET"
+
+
+def _warm_up() -> None:
+    # Import the slow dependencies once, before the first job arrives.
+    import h5py  # noqa: F401
+    import msprime  # noqa: F401
+
+    import twosfs.jobs  # noqa: F401
+    import twosfs.simulations  # noqa: F401
+    import twosfs.statistics  # noqa: F401
+
+    # fitsfs is only needed by fit jobs.
+    with suppress(ImportError):
+        import fitsfs.fitsfs  # noqa: F401
+
+
+def handle_request(request: dict[str, Any]) -> dict[str, Any]:
+    """Run the job described by request and return the response."""
+    from twosfs.instrument import instrumentation_from_environment
+    from twosfs.jobs import JOBS
+    from twosfs.progress import progress_from_environment
+
+    response: dict[str, Any] = {"id": request.get("id")}
+    start = time.perf_counter()
+    try:
+        name = request["job"]
+        if name != "ping":
+            try:
+                job = JOBS[name]
+            except KeyError:
+                raise ValueError(f"Unknown job {name}. Must be one of {list(JOBS)}.")
+            kwargs = request.get("kwargs", {})
+            output = kwargs.get("output")
+            if output:
+                os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+                with instrumentation_from_environment(output):
+                    with progress_from_environment(output):
+                        job(**kwargs)
+            else:
+                job(**kwargs)
+    except Exception as e:
+        response["ok"] = False
+        response["error"] = f"{type(e).__name__}: {e}"
+    else:
+        response["ok"] = True
+    response["elapsed"] = time.perf_counter() - start
+    response["pid"] = os.getpid()
+    return response
+
+
+def _handle_line(line: str) -> str:
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return json.dumps({"id": None, "ok": False, "error": f"JSONDecodeError: {e}"})
+    return json.dumps(handle_request(request))
+
+
+def serve_stdio(infile: IO[str] = sys.stdin, outfile: IO[str] = sys.stdout) -> None:
+    """Run jobs read from infile and write responses to outfile until EOF."""
+    for line in infile:
+        if line.strip():
+            outfile.write(_handle_line(line) + "\n")
+            outfile.flush()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if line.strip():
+                response = self.server.run(line.decode())
+                self.wfile.write(response.encode() + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, workers: int):
+        self.pool = None
+        if workers > 1:
+            from multiprocessing import Pool
+
+            self.pool = Pool(workers, initializer=_warm_up)
+        self.lock = threading.Lock()
+        super().__init__(socket_path, _Handler)
+
+    def run(self, line: str) -> str:
+        if self.pool is not None:
+            return self.pool.apply(_handle_line, (line,))
+        with self.lock:
+            return _handle_line(line)
+
+    def server_close(self):
+        super().server_close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+
+def make_server(socket_path: str, workers: int = 1) -> socketserver.BaseServer:
+    """Make a server that runs jobs sent to a Unix socket.
+
+    With workers=1, jobs run one at a time in the server process. Otherwise, they
+    run in a pool of that many processes, started once and warmed up, so that the
+    jobs of concurrent connections run in parallel. Either way, caches filled by a
+    job are reused by later jobs in the same process.
+    """
+    _warm_up()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    return _Server(socket_path, workers)
+
+
+def serve(socket_path: str, workers: int = 1) -> None:
+    """Run jobs sent to a Unix socket until interrupted. See `make_server`."""
+    with make_server(socket_path, workers) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+def submit(
+    job: str, socket_path: Optional[str] = None, job_id: Any = None, **kwargs
+) -> dict[str, Any]:
+    """Send a job to a running worker and wait for the response."""
+    if socket_path is None:
+        socket_path = os.environ[SOCKET_VARIABLE]
+    request = {"id": job_id, "job": job, "kwargs": kwargs}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile("rwb") as f:
+            f.write(json.dumps(request).encode() + b"\n")
+            f.flush()
+            return json.loads(f.readline())
+
+
+def run_job(job: str, **kwargs) -> None:
+    """Run a job on the worker named by TWOSFS_WORKER_SOCKET, or in this process.
+
+    Raise RuntimeError if the worker reports an error.
+    """
+    socket_path = os.environ.get(SOCKET_VARIABLE)
+    if socket_path:
+        response = submit(job, socket_path, **kwargs)
+    else:
+        response = handle_request({"job": job, "kwargs": kwargs})
+    if not response["ok"]:
+        raise RuntimeError(f"Job {job} failed with {response['error']}")
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the worker from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stdio", help="Read jobs from stdin.")
+    serve_parser = subparsers.add_parser("serve", help="Read jobs from a socket.")
+    serve_parser.add_argument("--socket", required=True)
+    serve_parser.add_argument(
+        "--workers", type=int, default=1, help="Processes running jobs in parallel."
+    )
+    submit_parser = subparsers.add_parser("submit", help="Send a job to a worker.")
+    submit_parser.add_argument("--socket", default=os.environ.get(SOCKET_VARIABLE))
+    submit_parser.add_argument("request", help="The job as a JSON object.")
+    args = parser.parse_args(argv)
+
+    if args.command == "stdio":
+        _warm_up()
+        serve_stdio()
+    elif args.command == "serve":
+        serve(args.socket, args.workers)
+    elif args.command == "submit":
+        request = json.loads(args.request)
+        response = submit(
+            request["job"], args.socket, request.get("id"), **request.get("kwargs", {})
+        )
+        print(json.dumps(response))
+        if not response["ok"]:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()